@@ -5,17 +5,32 @@ Run all the unit tests in threads so as to get more of them done in a shorter
 amount of time. The processing follows a "worker-bee" style solution, where a
 jobs list is populated with the projects to be tested and then workers pull off
 that list and processes them. Jobs can be filtered out either because they do
-not need to be tested (see opt_out) or because they have not been written in
-such a way as to allow them to be run while other tests run, because they use a
-common resource like redis (see run_alone).
+not need to be tested (see opt_out). Modules that use a common resource like
+redis (see run_alone) are run one at a time after everything else, or with
+--isolate-run-alone are given a private redis port each so that they can run
+in the pool alongside everything else. The time each module takes is kept
+in a history file so that the next run can start the longest modules first.
+With --changed-since only the modules with files changed since a git ref, and
+the modules that depend on them according to their project.clj files, are run.
+A module that passed before is not run again while its files, its project.clj
+and the files of the modules it depends on stay the same, see --no-cache.
+Each module also has its peak memory kept in the history, and a module is only
+started when its peak fits in the available memory next to the modules already
+running. The output of each module is written to its own log file as it
+arrives and a progress table with the estimated time left is printed while
+the modules run.
 """
 
 from concurrent.futures import ThreadPoolExecutor, wait
-from threading import Lock
+from threading import Condition, Event, Lock, Thread
 import argparse
 import datetime
+import hashlib
+import json
 import multiprocessing
 import os
+import re
+import socket
 import subprocess
 import sys
 import time
@@ -36,7 +51,34 @@ total_time = 0 # pylint: disable=invalid-name
 total_jobs = 0 # pylint: disable=invalid-name
 work_list = [] # will hold a list of modules from lein to test
 failed_tasks = [] # will hold module test failures
+durations = {} # module -> seconds the module took in this run
+cached_tasks = [] # will hold modules skipped because they passed with the same inputs
+task_keys = {} # module -> hash of everything the tests of the module depend on
+result_cache = {} # module -> key of the last run in which the module passed
+peak_memory = {} # module -> peak bytes of the largest process of the module in this run
+estimates = {} # module -> (seconds, bytes) expected from the history
+running_tasks = {} # module -> time the module was started
+waiting_tasks = set() # modules waiting for memory to start
+memory_changed = Condition(lock) # notified when running modules give back memory
+memory_budget = None # pylint: disable=invalid-name
+reserved_memory = 0 # pylint: disable=invalid-name
 base = os.getcwd()
+history_file = os.path.join(base, ".unit-test-history.json")
+cache_file = os.path.join(base, ".unit-test-cache.json")
+log_dir = os.path.join(base, ".unit-test-logs")
+
+# Change when what goes into a module key changes so that old results are not reused
+CACHE_VERSION = 1
+
+# Weight of the latest run when averaging a module's durations over runs
+HISTORY_WEIGHT = 0.5
+# Memory expected of a module with no history: lein, and the JVM it starts
+DEFAULT_MODULE_MEMORY = 2 * 1024**3
+# The peak measured is that of the largest process of a module, leave room for
+# the lein JVM running next to the test JVM
+MEMORY_HEADROOM = 1.25
+# Part of the available memory the modules may use together
+MEMORY_FRACTION = 0.9
 
 opt_out = ["cmr-dev-system",
     "cmr-system-int-test",
@@ -45,6 +87,22 @@ opt_out = ["cmr-dev-system",
 
 run_alone = ["cmr-common-app-lib", "cmr-indexer-app", "cmr-search-app"]
 
+# The redis ports of cmr.redis-utils.config, all pointed at the private port of a
+# run_alone module. The redis test fixture starts a redis container on that port.
+redis_port_variables = ["CMR_REDIS_PORT",
+    "CMR_REDIS_READ_PORT",
+    "CMR_REDIS_COLLECTION_METADATA_PORT",
+    "CMR_REDIS_COLLECTION_METADATA_READ_PORT",]
+task_environments = {} # module -> environment variables for its test run
+
+# Files outside of the modules that change what every module is built with
+shared_build_files = ["project.clj", "profiles.clj"]
+
+# The project name of a module and the CMR modules it names, either as a
+# dependency vector or as a keyword in a map of project versions
+project_name_pattern = re.compile(r"defproject (?:nasa-cmr|gov\.nasa\.earthdata)/cmr-([a-z0-9-]+)")
+module_reference_pattern = re.compile(r"(?:\[(?:nasa-cmr|gov\.nasa\.earthdata)/|:)cmr-([a-z0-9-]+)")
+
 # ##############################################################################
 
 def update_active_threads_locking(amount):
@@ -53,27 +111,318 @@ def update_active_threads_locking(amount):
     with lock:
         active_threads += amount
 
-def update_total_time_locking(durration):
-    "Update the total time spent, but make sure only one thread at a time can do this"
+def update_total_time_locking(durration, task=None):
+    """Update the total time spent and record how long the task took, but make
+    sure only one thread at a time can do this"""
     global total_time
     with lock:
         total_time = total_time + durration
+        if task is not None:
+            durations[task] = durration
+
+def load_history(file_name):
+    """Read the module durations and peak memory of earlier runs, as a map of
+    module to {"seconds": ..., "peak_rss": ...}, an empty history if there is none.
+    Histories from before peak memory was kept only hold the seconds."""
+    try:
+        with open(file_name, encoding="utf-8") as history:
+            data = json.load(history)
+    except (OSError, ValueError):
+        return {}
+    return {task: entry if isinstance(entry, dict) else {"seconds": entry}
+            for task, entry in data.items()}
+
+def average_into(entry, field, value):
+    "Average the value of this run into a field of a module's history"
+    if field in entry:
+        entry[field] = HISTORY_WEIGHT * value + (1 - HISTORY_WEIGHT) * entry[field]
+    else:
+        entry[field] = value
+
+def save_history(file_name, history):
+    """Average the durations and peak memory of this run into the history and
+    write it, so that one unusually slow or fast run does not decide on its own"""
+    for task, durration in durations.items():
+        average_into(history.setdefault(task, {}), "seconds", durration)
+    for task, peak in peak_memory.items():
+        average_into(history.setdefault(task, {}), "peak_rss", peak)
+    try:
+        with open(file_name, "w", encoding="utf-8") as out:
+            json.dump(history, out, indent=2, sort_keys=True)
+    except OSError as e:
+        color.cprint(color.tcode.red, f"Could not save the test history: {e}",
+                     verbose=color.VMode.ERROR, environment=env)
+
+def longest_last(tasks, history):
+    """Order the tasks by their duration in earlier runs, longest last since
+    workers pop from the end of the list. Modules without a history are taken
+    to be as long as the longest one so that they are started early."""
+    seconds = {task: entry["seconds"] for task, entry in history.items() if "seconds" in entry}
+    longest = max(seconds.values(), default=0)
+    return sorted(tasks, key=lambda task: (seconds.get(task, longest), task))
+
+def task_estimates(tasks, history):
+    """The seconds and bytes of memory each task is expected to take. Modules
+    without a history are expected to be as long as the longest one and to
+    need DEFAULT_MODULE_MEMORY."""
+    longest = max((entry.get("seconds", 0) for entry in history.values()), default=0)
+    result = {}
+    for task in tasks:
+        entry = history.get(task, {})
+        peak = entry.get("peak_rss")
+        result[task] = (entry.get("seconds", longest),
+                        DEFAULT_MODULE_MEMORY if peak is None else peak * MEMORY_HEADROOM)
+    return result
+
+def available_memory():
+    "Bytes of memory available to new processes, None when it can not be found"
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def reserve_memory_locking(task):
+    """Wait until the expected memory of the task fits in the budget next to the
+    running tasks, then hold it. A task always starts when nothing else runs."""
+    global reserved_memory
+    amount = estimates.get(task, (0, DEFAULT_MODULE_MEMORY))[1]
+    with memory_changed:
+        waiting_tasks.add(task)
+        memory_changed.wait_for(lambda: memory_budget is None or reserved_memory == 0
+                                or reserved_memory + amount <= memory_budget)
+        waiting_tasks.discard(task)
+        reserved_memory += amount
+        running_tasks[task] = time.time()
+    return amount
+
+def release_memory_locking(task, amount):
+    "Give back the memory held by a finished task and wake the waiting threads"
+    global reserved_memory
+    with memory_changed:
+        reserved_memory -= amount
+        running_tasks.pop(task, None)
+        memory_changed.notify_all()
+
+def run_task(task):
+    """Run the tests of a module with its output written to its log file as it
+    arrives. Returns the exit code and the peak memory, in bytes, of the largest
+    process the tests started."""
+    with open(os.path.join(log_dir, f"{task}.log"), "w", encoding="utf-8") as log:
+        with subprocess.Popen(["lein", "ci-utest"], stdout=log, stderr=subprocess.STDOUT,
+                              cwd=os.path.join(base, task), text=True,
+                              env=task_environments.get(task)) as process:
+            # wait4 gives the resources used by the process and the ones it waited for
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return process.returncode, peak
+
+def format_seconds(seconds):
+    "Format a number of seconds as minutes and seconds"
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m{seconds:02d}s"
+
+def print_progress(start, total, threads):
+    """Print the running modules with how long they have run and are expected
+    to run, then the estimated time left for the whole run"""
+    now = time.time()
+    with lock:
+        running = dict(running_tasks)
+        queued = list(work_list) + list(waiting_tasks)
+        done = total_jobs - len(running) - len(waiting_tasks)
+    remaining = {task: max(0, estimates.get(task, (0, 0))[0] - (now - started))
+                 for task, started in running.items()}
+    queued_seconds = sum(estimates.get(task, (0, 0))[0] for task in queued)
+    left = max(max(remaining.values(), default=0),
+               (sum(remaining.values()) + queued_seconds) / max(1, threads))
+    lines = [f"{'module':<28} {'elapsed':>9} {'remaining':>10}"]
+    for task, started in sorted(running.items(), key=lambda item: item[1]):
+        lines.append(f"{task:<28} {format_seconds(now - started):>9} {format_seconds(remaining[task]):>10}")
+    lines.append(f"{done}/{total} done, {len(running)} running, {len(queued)} queued, "
+                 f"elapsed {format_seconds(now - start)}, about {format_seconds(left)} left")
+    with lock:
+        print("\n".join(lines), flush=True)
+
+def report_progress(stop, interval, start, total, threads):
+    "Print the progress table every interval seconds until stop is set"
+    while not stop.wait(interval):
+        print_progress(start, total, threads)
 
 def record_failed_task_locking(task, returncode):
     "Record a failed task, but make sure only one thread at a time can do this"
     global failed_tasks
     with lock:
         failed_tasks.append((task, returncode))
+        result_cache.pop(task, None)
 
-def get_work_list():
-    "Get a dump of all the projects that lein manages"
+def record_passed_task_locking(task):
+    "Remember the inputs a task passed with, but make sure only one thread at a time can do this"
+    with lock:
+        if task in task_keys:
+            result_cache[task] = task_keys[task]
+
+def is_cached_locking(task):
+    """Check if the task passed before with the same inputs and record it as
+    cached if so, but make sure only one thread at a time can do this"""
+    with lock:
+        if task in task_keys and result_cache.get(task) == task_keys[task]:
+            cached_tasks.append(task)
+            return True
+        return False
+
+def tree_hash(paths):
+    """Hash the names and content of the files under the paths that git tracks
+    or would track, so that ignored build output does not change the hash"""
+    listing = subprocess.run(["git", "ls-files", "-z", "--cached", "--others",
+                              "--exclude-standard", "--"] + paths,
+                             check=True, capture_output=True, text=True, cwd=base)
+    digest = hashlib.sha256()
+    for file_name in sorted(set(listing.stdout.split("\0")) - {""}):
+        path = os.path.join(base, file_name)
+        if not os.path.isfile(path):
+            continue # deleted but not yet committed
+        with open(path, "rb") as content:
+            digest.update(f"{file_name}:{hashlib.sha256(content.read()).hexdigest()}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def module_keys(tasks):
+    """Key every task on its own files, including its project.clj, the shared
+    build files and the keys of the modules it depends on, so a change to a
+    library changes the key of everything built on it"""
+    dependencies = module_dependencies()
+    shared = tree_hash([name for name in shared_build_files if os.path.exists(os.path.join(base, name))])
+    keys = {}
+
+    def key(module):
+        if module not in keys:
+            digest = hashlib.sha256(f"{CACHE_VERSION}:{shared}:{tree_hash([module])}\n".encode("utf-8"))
+            for dependency in sorted(dependencies.get(module, ())):
+                digest.update(f"{dependency}:{key(dependency)}\n".encode("utf-8"))
+            keys[module] = digest.hexdigest()
+        return keys[module]
+
+    return {task: key(task) for task in tasks}
+
+def load_results(file_name):
+    "Read the keys the modules last passed with, an empty cache if there is none"
+    try:
+        with open(file_name, encoding="utf-8") as results:
+            return json.load(results)
+    except (OSError, ValueError):
+        return {}
+
+def save_results(file_name):
+    "Write the keys the modules last passed with for the next run"
+    try:
+        with open(file_name, "w", encoding="utf-8") as out:
+            json.dump(result_cache, out, indent=2, sort_keys=True)
+    except OSError as e:
+        color.cprint(color.tcode.red, f"Could not save the test results: {e}",
+                     verbose=color.VMode.ERROR, environment=env)
+
+def free_port():
+    "Ask the OS for a port nothing is listening on"
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+def isolated_environment(used_ports):
+    "Environment variables that give a module its own redis port, not one in used_ports"
+    port = free_port()
+    while port in used_ports:
+        port = free_port()
+    used_ports.add(port)
+    task_env = dict(os.environ)
+    for variable in redis_port_variables:
+        task_env[variable] = str(port)
+    return task_env
+
+def module_dependencies():
+    """Read the project.clj of every module, returning a map of module directory
+    to the set of module directories it depends on"""
+    projects = {}
+    for entry in sorted(os.scandir(base), key=lambda entry: entry.name):
+        project_file = os.path.join(entry.path, "project.clj")
+        if not entry.is_dir() or not os.path.exists(project_file):
+            continue
+        with open(project_file, encoding="utf-8") as project:
+            text = project.read()
+        name = project_name_pattern.search(text)
+        if name:
+            projects[entry.name] = (name.group(1), set(module_reference_pattern.findall(text)))
+    directories = {name: directory for directory, (name, _) in projects.items()}
+    return {directory: {directories[ref] for ref in refs if ref in directories and ref != name}
+            for directory, (name, refs) in projects.items()}
+
+def changed_files(ref):
+    """List the files, relative to the top of the repository, that differ from
+    the ref, including uncommitted and untracked files"""
+    diff = subprocess.run(["git", "diff", "--name-only", ref, "--"], check=True,
+                          capture_output=True, text=True, cwd=base)
+    untracked = subprocess.run(["git", "ls-files", "--others", "--exclude-standard"],
+                               check=True, capture_output=True, text=True, cwd=base)
+    return sorted(set(diff.stdout.split("\n") + untracked.stdout.split("\n")) - {""})
+
+def changed_modules(files, dependencies):
+    """Map the changed files to their modules. A change to a shared build file
+    counts as a change to every module, other files outside of a module are
+    not tested by any module."""
+    modules = set()
+    for file_name in files:
+        if file_name in shared_build_files:
+            return set(dependencies)
+        module = file_name.split("/")[0]
+        if module in dependencies:
+            modules.add(module)
+    return modules
+
+def with_dependents(modules, dependencies):
+    "Add every module that depends on one of the modules, directly or not"
+    dependents = {}
+    for module, needs in dependencies.items():
+        for need in needs:
+            dependents.setdefault(need, set()).add(module)
+    selected = set(modules)
+    pending = list(modules)
+    while pending:
+        for dependent in dependents.get(pending.pop(), ()):
+            if dependent not in selected:
+                selected.add(dependent)
+                pending.append(dependent)
+    return selected
+
+def select_changed(tasks, ref):
+    "Keep the tasks whose module, or a module they depend on, changed since the ref"
+    dependencies = module_dependencies()
+    changed = changed_modules(changed_files(ref), dependencies)
+    selected = with_dependents(changed, dependencies)
+    color.cprint(color.tcode.yellow,
+        f"Changed since {ref}: {', '.join(sorted(changed)) or 'no modules'}",
+        environment=env)
+    skipped = [task for task in tasks if task not in selected]
+    if skipped:
+        print (f"skipping unchanged {', '.join(skipped)}")
+    return [task for task in tasks if task in selected]
+
+def get_work_list(include_run_alone=False):
+    """Get a dump of all the projects that lein manages. The run_alone modules
+    are included when they have been given isolated resources."""
     cmd_result = subprocess.run(["lein", "dump"], check=True, capture_output=True)
     raw_work_list = cmd_result.stdout.decode('utf-8')
 
     list_of_projects = []
     for item in raw_work_list.split("\n"):
         item = item.strip(" ")
-        if item.startswith("cmr-") and (item not in opt_out) and (item not in run_alone):
+        if item.startswith("cmr-") and (item not in opt_out) and \
+            (include_run_alone or item not in run_alone):
             list_of_projects.append(item[4:]) #remove cmr-
         else:
             print (f"skipping {item}")
@@ -99,34 +448,46 @@ def worker(_context, id_number):
                 verbose=color.VMode.ERROR, environment=env)
             continue
 
+        if is_cached_locking(task):
+            color.cprint(color.tcode.yellow,
+                f"- task {id_number} skipped {task}, it passed before with the same inputs. "
+                f"{len(work_list)} tasks left.", environment=env)
+            continue
+
         color.cprint(color.tcode.white, f"+task {id_number} working on {task}.",
             environment=env)
 
+        reserved = reserve_memory_locking(task)
         st = time.time()
         # Run the external command in the task directory inside a try/except
         # block, to ensure thread never dies
         try:
-            subprocess.run(["lein", "ci-utest"], check=True, capture_output=True,
-                           cwd=os.path.join(base, task), text=True)
-        except subprocess.CalledProcessError as e:
-            record_failed_task_locking(task, e.returncode)
+            returncode, peak = run_task(task)
             with lock:
-                color.cprint(color.tcode.red,
-                             f"{id_number}: {task} failed with exit code {e.returncode}",
-                             verbose=color.VMode.ERROR,
-                             environment=env)
-                if e.stdout:
-                    print(f"===== {task} stdout =====")
-                    print(e.stdout, end="" if e.stdout.endswith("\n") else "\n")
-                if e.stderr:
-                    print(f"===== {task} stderr =====")
-                    print(e.stderr, end="" if e.stderr.endswith("\n") else "\n")
+                peak_memory[task] = peak
+            if returncode == 0:
+                record_passed_task_locking(task)
+            else:
+                record_failed_task_locking(task, returncode)
+                log_name = os.path.join(log_dir, f"{task}.log")
+                with lock:
+                    color.cprint(color.tcode.red,
+                                 f"{id_number}: {task} failed with exit code {returncode}",
+                                 verbose=color.VMode.ERROR,
+                                 environment=env)
+                    with open(log_name, encoding="utf-8", errors="replace") as log:
+                        output = log.read()
+                    if output:
+                        print(f"===== {task} output ({log_name}) =====")
+                        print(output, end="" if output.endswith("\n") else "\n")
         except Exception as e: # pylint: disable=broad-exception-caught
             record_failed_task_locking(task, "unknown")
             color.cprint(color.tcode.red, f"{id_number}: {task} - {e}",
                          verbose=color.VMode.ERROR, environment=env)
+        finally:
+            release_memory_locking(task, reserved)
         et = time.time()
-        update_total_time_locking(et-st)
+        update_total_time_locking(et-st, task)
 
         # show status
         stat_msg = f"- task {id_number} took {(et-st):.3f}s on {task}. {len(work_list)} tasks left."
@@ -151,11 +512,27 @@ def init_argparse() -> argparse.ArgumentParser:
     )
     parser.add_argument('-v', '--verbose', action='store_true',
         help="Print more output")
+    parser.add_argument('--history', default=history_file,
+        help='File the module durations are kept in to run the longest modules first')
+    parser.add_argument('--isolate-run-alone', action='store_true',
+        help='Give the run_alone modules a private redis port each and run them in the pool with the others')
+    parser.add_argument('--cache', default=cache_file,
+        help='File the inputs of the modules that passed are kept in')
+    parser.add_argument('--no-cache', action='store_true',
+        help='Run every module, even those that passed before with the same inputs')
+    parser.add_argument('--memory', type=float,
+        help='GiB of memory the modules may use together, defaults to most of the available memory')
+    parser.add_argument('--log-dir', default=log_dir,
+        help='Directory the output of each module is written to')
+    parser.add_argument('--progress', type=int, default=60,
+        help='Seconds between progress tables, 0 to not print them')
+    parser.add_argument('--changed-since', metavar='REF',
+        help='Only test the modules changed since the git ref and the modules that depend on them')
     return parser
 
 def main():
     " Main function, called in command line mode "
-    global work_list, total_jobs, total_time
+    global work_list, total_jobs, total_time, result_cache, memory_budget, log_dir
 
     #handle command line input
     parser = init_argparse()
@@ -170,13 +547,47 @@ def main():
     print (f"{datetime.datetime.now()}")
     print ("This is the new script to run unit tests: run_unit_tests.py")
 
+    history = load_history(args.history)
+    log_dir = args.log_dir
+    os.makedirs(log_dir, exist_ok=True)
+    if args.memory is not None:
+        memory_budget = args.memory * 1024**3
+    elif available_memory() is not None:
+        memory_budget = available_memory() * MEMORY_FRACTION
+    caching = not args.no_cache
+    if caching:
+        result_cache = load_results(args.cache)
+
     with ThreadPoolExecutor() as executor:
-        work_list = get_work_list()
+        if args.isolate_run_alone:
+            used_ports = set()
+            for task in run_alone:
+                task_environments[task[4:]] = isolated_environment(used_ports)
+        work_list = get_work_list(include_run_alone=args.isolate_run_alone)
+        if args.changed_since:
+            work_list = select_changed(work_list, args.changed_since)
+        work_list = longest_last(work_list, history)
+        if caching:
+            try:
+                task_keys.update(module_keys(work_list + [task[4:] for task in run_alone]))
+            except (subprocess.CalledProcessError, OSError) as e:
+                color.cprint(color.tcode.red,
+                    f"Could not hash the module files, running every module without the cache: {e}",
+                    verbose=color.VMode.ERROR, environment=env)
+                caching = False
+        estimates.update(task_estimates(work_list + [task[4:] for task in run_alone], history))
 
+        memory_note = "" if memory_budget is None else f" within {memory_budget / 1024**3:.1f} GiB of memory"
         color.cprint(color.tcode.yellow,
-            f"Using {args.threads} threads on {len(work_list)} tasks.",
+            f"Using {args.threads} threads on {len(work_list)} tasks{memory_note}, logs in {log_dir}.",
             environment=env)
 
+        stop_progress = Event()
+        if args.progress > 0:
+            total = len(work_list) + (0 if args.isolate_run_alone else len(run_alone))
+            Thread(target=report_progress, daemon=True,
+                   args=(stop_progress, args.progress, time.time(), total, args.threads)).start()
+
         jobs = []
 
         # Create all the worker threads
@@ -198,15 +609,28 @@ def main():
             environment=env)
 
     # There are some tests which can not run along side each other because they
-    # start up services.
-    color.cprint('\033[0;36m', "Starting single threads", environment=env)
-    work_list = [task[4:] for task in run_alone]
-    worker({}, -1)
+    # start up services, unless they were given their own.
+    if not args.isolate_run_alone:
+        color.cprint('\033[0;36m', "Starting single threads", environment=env)
+        work_list = [task[4:] for task in run_alone]
+        if args.changed_since:
+            work_list = select_changed(work_list, args.changed_since)
+        worker({}, -1)
+    stop_progress.set()
+
+    save_history(args.history, history)
+    if caching:
+        save_results(args.cache)
 
     color.cprint(color.tcode.yellow, f"Done processing {total_jobs}", environment=env)
+    if cached_tasks:
+        color.cprint(color.tcode.yellow,
+            f"Cached: {len(cached_tasks)} passed before with the same inputs ({', '.join(sorted(cached_tasks))})",
+            environment=env)
     color.cprint(color.tcode.yellow, f"Total: {total_time:.3f}s", environment=env)
-    if total_jobs > 0:
-        color.cprint(color.tcode.yellow, f"Average: {total_time/total_jobs:.3f}s", environment=env)
+    if total_jobs > len(cached_tasks):
+        color.cprint(color.tcode.yellow, f"Average: {total_time/(total_jobs-len(cached_tasks)):.3f}s",
+            environment=env)
     if failed_tasks:
         print("Failed unit test modules:")
         for task, returncode in failed_tasks:
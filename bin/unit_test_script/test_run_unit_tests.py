@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+"""
+Tests for run_unit_tests.py. The modules are project.clj stubs in a temporary
+directory, run from this directory with: python3 -m unittest test_run_unit_tests
+"""
+
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+import run_unit_tests
+
+def project(name, dependencies=(), versions=()):
+    "The text of a project.clj for the module with dependency vectors and version keywords"
+    vectors = " ".join(f'[nasa-cmr/cmr-{dependency} "0.1.0-SNAPSHOT"]' for dependency in dependencies)
+    keywords = " ".join(f':cmr-{dependency} "0.1.0-SNAPSHOT"' for dependency in versions)
+    return (f'(defproject nasa-cmr/cmr-{name} "0.1.0-SNAPSHOT"\n'
+            f'  :dependencies [[org.clojure/clojure "1.11.2"] {vectors}]\n'
+            f'  :profiles {{:versions {{{keywords}}}}})\n')
+
+class TestModules(unittest.TestCase):
+    """Test reading the module dependencies and selecting the changed modules"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        base_patch = patch.object(run_unit_tests, "base", self.directory.name)
+        base_patch.start()
+        self.addCleanup(base_patch.stop)
+        self.write("project.clj", '(defproject nasa-cmr/cmr "0.1.0-SNAPSHOT")\n')
+        self.write(".gitignore", "target/\n")
+        self.write("common-lib/project.clj", project("common-lib", versions=["common-lib"]))
+        self.write("common-lib/src/cmr/common/util.clj", "(ns cmr.common.util)\n")
+        self.write("transmit-lib/project.clj", project("transmit-lib", dependencies=["common-lib"]))
+        self.write("search-app/project.clj", project("search-app", versions=["transmit-lib"]))
+        self.write("ingest-app/project.clj", project("ingest-app", dependencies=["common-lib"]))
+        self.write("other-app/project.clj", project("other-app"))
+        self.write("docs/README.md", "not a module\n")
+
+    def write(self, file_name, text):
+        "Write a file under the temporary repository"
+        path = os.path.join(self.directory.name, file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as out:
+            out.write(text)
+
+    def test_module_dependencies(self):
+        """Dependency vectors and version keywords are both references, a
+        project does not depend on itself and directories without a project
+        are not modules"""
+        self.assertEqual({"common-lib": set(),
+                          "transmit-lib": {"common-lib"},
+                          "search-app": {"transmit-lib"},
+                          "ingest-app": {"common-lib"},
+                          "other-app": set()},
+                         run_unit_tests.module_dependencies())
+
+    def test_changed_modules(self):
+        """Files map to the module of their top directory and files outside of
+        the modules are ignored"""
+        dependencies = run_unit_tests.module_dependencies()
+        self.assertEqual({"transmit-lib"},
+                         run_unit_tests.changed_modules(["transmit-lib/src/cmr/transmit/config.clj",
+                                                         "docs/README.md"],
+                                                        dependencies))
+        self.assertEqual(set(), run_unit_tests.changed_modules(["docs/README.md"], dependencies))
+
+    def test_shared_build_file_changes_every_module(self):
+        """A change to the top level project.clj is a change to every module,
+        while a module's own project.clj is only a change to that module"""
+        dependencies = run_unit_tests.module_dependencies()
+        self.assertEqual(set(dependencies),
+                         run_unit_tests.changed_modules(["docs/README.md", "project.clj"], dependencies))
+        self.assertEqual({"other-app"},
+                         run_unit_tests.changed_modules(["other-app/project.clj"], dependencies))
+
+    def test_with_dependents(self):
+        """Modules depending on a changed module are added, also through
+        another module"""
+        dependencies = run_unit_tests.module_dependencies()
+        self.assertEqual({"common-lib", "transmit-lib", "search-app", "ingest-app"},
+                         run_unit_tests.with_dependents({"common-lib"}, dependencies))
+        self.assertEqual({"transmit-lib", "search-app"},
+                         run_unit_tests.with_dependents({"transmit-lib"}, dependencies))
+        self.assertEqual({"other-app"}, run_unit_tests.with_dependents({"other-app"}, dependencies))
+
+    def test_module_keys(self):
+        """A change to a module changes its key and the keys of the modules
+        depending on it, a change to a shared build file changes every key and
+        ignored files change none"""
+        subprocess.run(["git", "init", "-q"], check=True, cwd=self.directory.name)
+        modules = ["common-lib", "transmit-lib", "search-app", "ingest-app", "other-app"]
+        before = run_unit_tests.module_keys(modules)
+        self.assertEqual(before, run_unit_tests.module_keys(modules))
+
+        self.write("common-lib/target/classes/util.class", "build output")
+        self.assertEqual(before, run_unit_tests.module_keys(modules))
+
+        self.write("transmit-lib/src/cmr/transmit/config.clj", "(ns cmr.transmit.config)\n")
+        after = run_unit_tests.module_keys(modules)
+        self.assertEqual({"transmit-lib", "search-app"},
+                         {module for module in modules if before[module] != after[module]})
+
+        self.write("project.clj", '(defproject nasa-cmr/cmr "0.2.0-SNAPSHOT")\n')
+        shared = run_unit_tests.module_keys(modules)
+        self.assertTrue(all(after[module] != shared[module] for module in modules))
+
+    def test_module_keys_outside_git(self):
+        """Hashing fails when git cannot list the files, which turns the cache off"""
+        missing = os.path.join(self.directory.name, "no-repository")
+        with patch.dict(os.environ, {"GIT_DIR": missing}), self.assertRaises(subprocess.CalledProcessError):
+            run_unit_tests.module_keys(["common-lib"])
+
+class TestResultCache(unittest.TestCase):
+    """Test skipping the modules that passed with the same inputs"""
+
+    def test_passed_modules_are_cached(self):
+        """A module is cached once it passed with its current key, and not
+        after its key changed or it failed"""
+        with patch.dict(run_unit_tests.task_keys, {"common-lib": "key-1", "search-app": "key-2"}, clear=True), \
+             patch.dict(run_unit_tests.result_cache, {}, clear=True), \
+             patch.object(run_unit_tests, "cached_tasks", []), \
+             patch.object(run_unit_tests, "failed_tasks", []):
+            self.assertFalse(run_unit_tests.is_cached_locking("common-lib"))
+            run_unit_tests.record_passed_task_locking("common-lib")
+            run_unit_tests.record_passed_task_locking("search-app")
+            self.assertTrue(run_unit_tests.is_cached_locking("common-lib"))
+
+            run_unit_tests.task_keys["common-lib"] = "key-3"
+            self.assertFalse(run_unit_tests.is_cached_locking("common-lib"))
+            run_unit_tests.record_failed_task_locking("search-app", 1)
+            self.assertFalse(run_unit_tests.is_cached_locking("search-app"))
+            self.assertEqual(["common-lib"], run_unit_tests.cached_tasks)
+
+    def test_results_file(self):
+        """The results are read back as saved, a missing file is an empty cache"""
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, "cache.json")
+            self.assertEqual({}, run_unit_tests.load_results(file_name))
+            with patch.dict(run_unit_tests.result_cache, {"common-lib": "key-1"}, clear=True):
+                run_unit_tests.save_results(file_name)
+            self.assertEqual({"common-lib": "key-1"}, run_unit_tests.load_results(file_name))
+
+class TestHistory(unittest.TestCase):
+    """Test ordering the modules by the durations of earlier runs"""
+
+    def test_longest_last(self):
+        """Modules are ordered by their duration with the longest last and
+        modules without a history count as the longest"""
+        history = {"common-lib": {"seconds": 30}, "search-app": {"seconds": 300},
+                   "ingest-app": {"seconds": 120}}
+        self.assertEqual(["common-lib", "ingest-app", "new-app", "search-app"],
+                         run_unit_tests.longest_last(["new-app", "search-app", "common-lib", "ingest-app"],
+                                                     history))
+        self.assertEqual(["a-app", "b-app"], run_unit_tests.longest_last(["b-app", "a-app"], {}))
+
+    def test_save_history(self):
+        """The durations of this run are averaged into the history, so one
+        slow run does not decide the order on its own"""
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, "history.json")
+            with patch.dict(run_unit_tests.durations, {"common-lib": 50, "new-app": 20}, clear=True):
+                run_unit_tests.save_history(file_name, {"common-lib": {"seconds": 30}})
+            history = run_unit_tests.load_history(file_name)
+            with open(file_name, encoding="utf-8") as saved:
+                self.assertEqual(history, json.load(saved))
+        self.assertEqual({"common-lib": {"seconds": 40}, "new-app": {"seconds": 20}}, history)
+
+class TestRunAlone(unittest.TestCase):
+    """Test giving the run_alone modules their own redis port"""
+
+    @patch.dict(os.environ, {"PATH": "/usr/bin"}, clear=True)
+    def test_isolated_environment(self):
+        """Every redis port variable is set to a port no other module was
+        given, next to the rest of the environment"""
+        used_ports = {6379}
+        with patch.object(run_unit_tests, "free_port", side_effect=[6379, 7001, 7001, 7002]):
+            first = run_unit_tests.isolated_environment(used_ports)
+            second = run_unit_tests.isolated_environment(used_ports)
+        self.assertEqual({"6379", "7001", "7002"}, {str(port) for port in used_ports})
+        self.assertEqual({"7001"}, {first[variable] for variable in run_unit_tests.redis_port_variables})
+        self.assertEqual({"7002"}, {second[variable] for variable in run_unit_tests.redis_port_variables})
+        self.assertEqual("/usr/bin", first["PATH"])
+        self.assertNotIn("CMR_REDIS_PORT", os.environ)
+
+    def test_get_work_list(self):
+        """The run_alone modules are only in the work list when they are isolated"""
+        dump = "cmr-common-lib\ncmr-search-app\ncmr-oracle-lib\n"
+        with patch("subprocess.run", return_value=MagicMock(stdout=dump.encode("utf-8"))), \
+             patch("builtins.print"):
+            self.assertEqual(["common-lib"], run_unit_tests.get_work_list())
+            self.assertEqual(["common-lib", "search-app"],
+                             run_unit_tests.get_work_list(include_run_alone=True))
+
+class TestMemory(unittest.TestCase):
+    """Test starting modules only when their expected memory fits"""
+
+    def setUp(self):
+        for name, value in (("memory_budget", 10), ("reserved_memory", 0)):
+            memory_patch = patch.object(run_unit_tests, name, value)
+            memory_patch.start()
+            self.addCleanup(memory_patch.stop)
+        for name, value in (("estimates", {"common-lib": (60, 6), "search-app": (300, 6), "huge-app": (60, 20)}),
+                            ("running_tasks", {})):
+            dict_patch = patch.dict(getattr(run_unit_tests, name), value, clear=True)
+            dict_patch.start()
+            self.addCleanup(dict_patch.stop)
+
+    def test_old_history(self):
+        """Histories from before peak memory was kept only hold the seconds and
+        are read into the current form"""
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, "history.json")
+            with open(file_name, "w", encoding="utf-8") as out:
+                json.dump({"common-lib": 30, "search-app": {"seconds": 300, "peak_rss": 1024}}, out)
+            history = run_unit_tests.load_history(file_name)
+        self.assertEqual({"common-lib": {"seconds": 30}, "search-app": {"seconds": 300, "peak_rss": 1024}},
+                         history)
+        self.assertEqual(["common-lib", "search-app"],
+                         run_unit_tests.longest_last(["search-app", "common-lib"], history))
+
+    def test_task_estimates(self):
+        """The peak memory of a module gets headroom for lein, modules without
+        one get the default and modules without a history the longest duration"""
+        history = {"common-lib": {"seconds": 30, "peak_rss": 1024}, "search-app": {"seconds": 300}}
+        self.assertEqual({"common-lib": (30, 1024 * run_unit_tests.MEMORY_HEADROOM),
+                          "search-app": (300, run_unit_tests.DEFAULT_MODULE_MEMORY),
+                          "new-app": (300, run_unit_tests.DEFAULT_MODULE_MEMORY)},
+                         run_unit_tests.task_estimates(["common-lib", "search-app", "new-app"], history))
+
+    def test_reserve_memory_waits_for_room(self):
+        """A module waits until the modules running next to it give back
+        enough memory"""
+        self.assertEqual(6, run_unit_tests.reserve_memory_locking("common-lib"))
+        started = threading.Event()
+
+        def reserve():
+            run_unit_tests.reserve_memory_locking("search-app")
+            started.set()
+        waiting = threading.Thread(target=reserve, daemon=True)
+        waiting.start()
+        self.assertFalse(started.wait(0.2))
+        self.assertEqual({"search-app"}, run_unit_tests.waiting_tasks)
+
+        run_unit_tests.release_memory_locking("common-lib", 6)
+        self.assertTrue(started.wait(5))
+        waiting.join(5)
+        self.assertEqual(["search-app"], list(run_unit_tests.running_tasks))
+        self.assertEqual(6, run_unit_tests.reserved_memory)
+        self.assertEqual(set(), run_unit_tests.waiting_tasks)
+
+    def test_reserve_memory_alone_over_budget(self):
+        """A module expected to need more than the budget still starts when
+        nothing else runs"""
+        self.assertEqual(20, run_unit_tests.reserve_memory_locking("huge-app"))
+        run_unit_tests.release_memory_locking("huge-app", 20)
+        self.assertEqual(0, run_unit_tests.reserved_memory)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,16 +2,26 @@
 create-eventbridge-schedule uses details provided in a json file to create
 rules in AWS EventBridge with the job-router Lambda as a target for invocation
 """
+import bisect
 import json
 import os
+import re
 import sys
 import boto3
 import argparse
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
 
+# The job definitions loader is shared with the other job utilities
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# pylint: disable=wrong-import-position
+from job_definitions.job_definitions import CronSchedule, JobDefinitionError, load_jobs_map
+
 environment = None
-lambda_client = lambda_client = boto3.client('lambda')
-events_client = events_client = boto3.client('events')
+# The AWS clients are created on first use, see get_lambda_client and get_events_client
+lambda_client = None
+events_client = None
 
 def make_cron_expression(job):
     """
@@ -53,39 +63,338 @@ def make_schedule_expression(job):
         return make_cron_expression(job)
     return make_interval_expression(job)
 
-def create_event_targets(jobs_map, lambda_arn):
+def make_target_input(job_name, job):
+    """
+    Makes the event the job router lambda is invoked with, which is the job
+    target plus the job name so that job runs can be reported on by name
+    """
+    target_input = dict(job["target"])
+    target_input["job-name"] = job_name
+    return target_input
+
+# Schedules are analyzed over one week, starting on a Monday at midnight UTC
+ANALYSIS_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+ANALYSIS_MINUTES = 7 * 24 * 60
+
+def firing_minutes(job, minutes=ANALYSIS_MINUTES):
+    """
+    Returns the minutes after ANALYSIS_START at which the job fires within the
+    analyzed period, or None for interval jobs. EventBridge starts rate schedules
+    when the rule is created, so when an interval job fires is not known.
+    """
+    timing = job["scheduling"]["timing"]
+    if job["scheduling"]["type"] != "cron":
+        return None
+
+    schedule = CronSchedule(timing)
+    firings = []
+    for day in range(0, minutes, 24 * 60):
+        if schedule.matches_day((ANALYSIS_START + timedelta(minutes=day)).date()):
+            firings.extend(day + hour * 60 + minute
+                           for hour in schedule.hours for minute in schedule.minutes
+                           if day + hour * 60 + minute < minutes)
+    return firings
+
+def find_overlaps(jobs_map):
+    """
+    Returns, per target service, the minutes at which more than one job fires
+    as a map of service to a map of minute to the names of the jobs firing then.
+    Interval jobs are left out, since when they fire is not known.
+    """
+    firings = {}
+    for job_key, job in jobs_map.items():
+        service_firings = firings.setdefault(job["target"]["service"], {})
+        for minute in firing_minutes(job) or ():
+            service_firings.setdefault(minute, []).append(job_key)
+    return {service: {minute: jobs for minute, jobs in sorted(service_firings.items()) if len(jobs) > 1}
+            for service, service_firings in firings.items()}
+
+def is_staggerable(job):
+    """
+    Returns True if the job is a cron job that fires at a single minute of the
+    hour, which is the only kind of schedule that can be moved without changing
+    how often it runs.
+    """
+    return job["scheduling"]["type"] == "cron" and str(job["scheduling"]["timing"]["minutes"]).isdigit()
+
+def with_minute(job, minute):
+    """
+    Returns a copy of the job that fires at the given minute of the hour.
+    """
+    job = json.loads(json.dumps(job))
+    job["scheduling"]["timing"]["minutes"] = minute
+    return job
+
+def minute_gap(minute, busy_minutes):
+    """
+    Returns the number of minutes between the minute and the closest busy minute,
+    wrapping around the analyzed period.
+    """
+    if not busy_minutes:
+        return ANALYSIS_MINUTES
+    index = bisect.bisect_left(busy_minutes, minute)
+    neighbours = (busy_minutes[index % len(busy_minutes)], busy_minutes[index - 1])
+    return min(min(abs(minute - neighbour), ANALYSIS_MINUTES - abs(minute - neighbour))
+               for neighbour in neighbours)
+
+def suggest_offsets(jobs_map):
+    """
+    Suggests new minutes of the hour for the cron jobs that fire at the same
+    time as another job of the same service. Jobs are placed one at a time:
+    a job that does not collide keeps its minute, one that does is moved to
+    the minute with the fewest concurrent firings that is furthest from the
+    other firings of the service. Interval jobs, whose firings are not known,
+    are not taken into account. Returns a map of job name to new minute.
+    """
+    offsets = {}
+    by_service = {}
+    for job_key, job in sorted(jobs_map.items()):
+        by_service.setdefault(job["target"]["service"], []).append(job_key)
+
+    for job_keys in by_service.values():
+        load = {}
+        # The jobs that cannot be moved are placed first
+        job_keys = sorted(job_keys, key=lambda job_key: is_staggerable(jobs_map[job_key]))
+        for job_key in job_keys:
+            job = jobs_map[job_key]
+            if is_staggerable(job):
+                current = int(job["scheduling"]["timing"]["minutes"])
+                busy_minutes = sorted(load)
+
+                def cost(minute, job=job, busy_minutes=busy_minutes, current=current):
+                    firings = firing_minutes(with_minute(job, minute))
+                    peak = max((load.get(firing, 0) for firing in firings), default=0)
+                    gap = min((minute_gap(firing, busy_minutes) for firing in firings), default=0)
+                    return (peak, -gap, abs(minute - current))
+
+                if cost(current)[0] > 0:
+                    minute = min(range(60), key=cost)
+                    if minute != current:
+                        offsets[job_key] = minute
+                        job = with_minute(job, minute)
+            for firing in firing_minutes(job) or ():
+                load[firing] = load.get(firing, 0) + 1
+    return offsets
+
+def apply_offsets(jobs_map, offsets):
+    """
+    Returns a copy of the jobs map with the suggested minutes applied.
+    """
+    return {job_key: with_minute(job, offsets[job_key]) if job_key in offsets else job
+            for job_key, job in jobs_map.items()}
+
+def write_offsets(file_name, offsets):
+    """
+    Changes only the minutes of the moved jobs in the jobs file, leaving the
+    rest of the hand written file, its layout included, as it is. Raises
+    ValueError if the file cannot be changed that way.
+    """
+    with open(file_name, encoding="UTF-8") as jobs_file:
+        original = jobs_file.read()
+    text = original
+    minutes_pattern = re.compile(r'("minutes"\s*:\s*)("[^"]*"|\d+)')
+    for job_key, minute in sorted(offsets.items()):
+        key = re.search(rf'"{re.escape(job_key)}"\s*:', text)
+        minutes = minutes_pattern.search(text, key.end()) if key else None
+        if minutes is None:
+            raise ValueError(f"Could not find the minutes of {job_key} in {file_name}")
+        value = f'"{minute}"' if minutes.group(2).startswith('"') else str(minute)
+        text = text[:minutes.start(2)] + value + text[minutes.end(2):]
+
+    # Check that exactly the moved minutes changed
+    changed = json.loads(text)
+    for job_key in offsets:
+        timing = changed[job_key]["scheduling"]["timing"]
+        timing["minutes"] = int(timing["minutes"])
+    if changed != apply_offsets(json.loads(original), offsets):
+        raise ValueError(f"Could not change only the minutes in {file_name}")
+    with open(file_name, "w", encoding="UTF-8") as jobs_file:
+        jobs_file.write(text)
+
+def format_minute(minute):
+    """
+    Formats a minute of the analyzed week as a day and time.
+    """
+    return (ANALYSIS_START + timedelta(minutes=minute)).strftime("%a %H:%M")
+
+def print_schedule_analysis(jobs_map):
+    """
+    Prints the concurrent firings per service and the suggested offsets, and
+    the interval jobs that could not be analyzed. Returns the suggested offsets.
+    """
+    unknown_phase = {}
+    for job_key, job in sorted(jobs_map.items()):
+        if firing_minutes(job) is None:
+            unknown_phase.setdefault(job["target"]["service"], []).append(job_key)
+    for service, overlaps in find_overlaps(jobs_map).items():
+        if service in unknown_phase:
+            print(f"{service}: unknown phase, not analyzed: {', '.join(unknown_phase[service])}")
+        if not overlaps:
+            print(f"{service}: no concurrent firings")
+            continue
+        peak = max(len(jobs) for jobs in overlaps.values())
+        print(f"{service}: {len(overlaps)} minutes a week with concurrent firings, at most {peak} jobs at once")
+        groups = {}
+        for minute, jobs in overlaps.items():
+            groups.setdefault(tuple(jobs), []).append(minute)
+        for jobs, minutes in groups.items():
+            print(f"  {', '.join(jobs)}: {len(minutes)} times, first at {format_minute(minutes[0])} UTC")
+
+    offsets = suggest_offsets(jobs_map)
+    for job_key, minute in offsets.items():
+        print(f"suggest moving {job_key} from minute {jobs_map[job_key]['scheduling']['timing']['minutes']} to {minute}")
+    return offsets
+
+def get_lambda_client():
+    """
+    Returns the AWS Lambda client, creating it on first use.
+    """
+    global lambda_client # pylint: disable=global-statement
+    if lambda_client is None:
+        lambda_client = boto3.client('lambda')
+    return lambda_client
+
+def get_events_client():
+    """
+    Returns the AWS EventBridge client, creating it on first use.
+    """
+    global events_client # pylint: disable=global-statement
+    if events_client is None:
+        events_client = boto3.client('events')
+    return events_client
+
+def run_in_parallel(function, items, max_workers):
+    """
+    Calls function on every item using at most max_workers threads and
+    returns a map of item to result.
+    """
+    if not items:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+        return dict(zip(items, executor.map(function, items)))
+
+def target_id():
+    """
+    The id of the job router target on every rule.
+    """
+    return "job-router-" + environment
+
+def statement_id(job_key):
+    """
+    The id of the lambda permission statement that lets a rule invoke the job router.
+    """
+    return "InvokeJobRouter" + "_" + job_key
+
+def get_existing_rules():
+    """
+    Lists all EventBridge rules once and returns a map of rule name to rule.
+    """
+    rules = {}
+    for page in get_events_client().get_paginator('list_rules').paginate():
+        for rule in page['Rules']:
+            rules[rule['Name']] = rule
+    return rules
+
+def get_existing_targets(rule_names, max_workers):
+    """
+    Returns a map of rule name to the list of targets of that rule.
+    """
+    def list_targets(rule_name):
+        targets = []
+        for page in get_events_client().get_paginator('list_targets_by_rule').paginate(Rule=rule_name):
+            targets.extend(page['Targets'])
+        return targets
+    return run_in_parallel(list_targets, list(rule_names), max_workers)
+
+def get_existing_permissions():
+    """
+    Returns the statement ids in the job router lambda resource policy.
+    """
+    try:
+        policy = get_lambda_client().get_policy(FunctionName="job-router-"+environment)
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ResourceNotFoundException":
+            return set()
+        raise
+    return {statement["Sid"] for statement in json.loads(policy["Policy"])["Statement"]}
+
+def target_matches(targets, job_key, job, lambda_arn):
+    """
+    Returns True if the job router target of the rule invokes the lambda with the job input.
+    """
+    for target in targets:
+        if target["Id"] == target_id() and target["Arn"] == lambda_arn:
+            return json.loads(target.get("Input", "null")) == make_target_input(job_key, job)
+    return False
+
+def make_deploy_plan(jobs_map, existing_rules, existing_targets, existing_permissions, lambda_arn):
+    """
+    Compares the jobs to what is deployed and returns the job names whose rule,
+    lambda permission or target need to be put, and the job names that are
+    already up to date.
+    """
+    plan = {"rules": [], "permissions": [], "targets": [], "unchanged": []}
+    for job_key, job in jobs_map.items():
+        rule = existing_rules.get(job_key)
+        changed = False
+        if rule is None or rule.get("ScheduleExpression") != make_schedule_expression(job) \
+           or rule.get("State") != "ENABLED":
+            plan["rules"].append(job_key)
+            changed = True
+        if statement_id(job_key) not in existing_permissions:
+            plan["permissions"].append(job_key)
+            changed = True
+        if not target_matches(existing_targets.get(job_key, []), job_key, job, lambda_arn):
+            plan["targets"].append(job_key)
+            changed = True
+        if not changed:
+            plan["unchanged"].append(job_key)
+    return plan
+
+def print_deploy_plan(plan):
+    """
+    Prints what a deployment will change.
+    """
+    for job_key in plan["rules"]:
+        print("put rule: " + job_key)
+    for job_key in plan["permissions"]:
+        print("add permission: " + job_key)
+    for job_key in plan["targets"]:
+        print("put target: " + job_key)
+    print(f"{len(plan['unchanged'])} jobs unchanged")
+
+def create_event_targets(jobs_map, lambda_arn, max_workers=8):
     """
     Creates AWS EventBridge lambda targets so that when the EventBridge scheduler
     fires, the job router lambda is called to carry out the task, which calls a
-    CMR API call to refresh a cache.
+    CMR API call to refresh a cache. Each rule has a single target, so there is
+    one put_targets call per rule and the calls are made in parallel.
     """
-    targets=[]
-
-    # Go through each of the jobs and create a target for each one
-    # that will call the job router lambda.
-    for jobs_key in jobs_map:
+    def put_target(jobs_key):
         job_details = jobs_map[jobs_key]
-
         try:
-            events_client.put_targets(
+            get_events_client().put_targets(
                 Rule=jobs_key,
-                Targets=[{"Id" : "job-router-" + environment,
+                Targets=[{"Id" : target_id(),
                           "Arn" : lambda_arn,
-                          "Input" : json.dumps(job_details["target"])}])
+                          "Input" : json.dumps(make_target_input(jobs_key, job_details))}])
         except ClientError as e:
             print("Error putting lambda target: " + e.response["Error"]["Code"])
 
+    run_in_parallel(put_target, list(jobs_map), max_workers)
+
 def add_lambda_permissions(rules):
     """
     Creates lambda permissions for each job so that the job router lambda can be
-    invoked by AWS EventBridge rules.
+    invoked by AWS EventBridge rules. These are added one at a time because
+    concurrent updates to the same lambda policy conflict.
     """
     for job_key in rules:
         rule = rules[job_key]
         try:
-            lambda_client.add_permission(
+            get_lambda_client().add_permission(
                 FunctionName="job-router-"+environment,
-                StatementId="InvokeJobRouter" + "_" + job_key,
+                StatementId=statement_id(job_key),
                 Action="lambda:InvokeFunction",
                 Principal="events.amazonaws.com",
                 SourceArn=rule["RuleArn"])
@@ -93,30 +402,29 @@ def add_lambda_permissions(rules):
             print("Error adding permissions to lambda: " + e.response["Error"]["Code"])
             print("This does not mean the deployment will fail, it could just indicate the permission already exists")
 
-def create_scheduler_rules(jobs_map):
+def create_scheduler_rules(jobs_map, max_workers=8):
     """
     Creates AWS EventBridge scheduler rules to schedule all the refresh cache jobs.
     """
-    rules = {}
-
-    for job_key in jobs_map:
+    def put_rule(job_key):
         try:
-            create_rule_resp = events_client.put_rule(
+            return get_events_client().put_rule(
                 Name=job_key,
                 ScheduleExpression=make_schedule_expression(jobs_map[job_key]),
                 State='ENABLED')
-            rules[job_key] = create_rule_resp
         except ClientError as e:
             print("Error putting EventBridge rule: " + e.response["Error"]["Code"])
+            return None
 
-    return rules
+    results = run_in_parallel(put_rule, list(jobs_map), max_workers)
+    return {job_key: result for job_key, result in results.items() if result is not None}
 
 def get_lambda_function():
     """
     Gets the job router AWS lambda client and its details such as its arn.
     """
     try:
-        lambda_details = lambda_client.get_function(
+        lambda_details = get_lambda_client().get_function(
             FunctionName="job-router-"+environment
         )
         return lambda_details["Configuration"]["FunctionArn"]
@@ -124,46 +432,69 @@ def get_lambda_function():
         print("Error getting lambda function: " + e.response['Error']['Code'])
         sys.exit(1)
 
-def deploy_schedules(jobs_map):
+def deploy_schedules(jobs_map, dry_run=False, max_workers=8):
     """
     Uses the job details provided in the jobs_file to put rules
     into AWS EventBridge that invoke the job-router lambda
-    for each given job in the jobs_file
+    for each given job in the jobs_file. The deployed rules, targets and
+    permissions are read first and only the differences are applied.
+    With dry_run the differences are printed and nothing is changed.
     """
     # First get the lambda function.
     lambda_arn = get_lambda_function()
 
-    # Then create the schedule rules for each job.
-    rules = create_scheduler_rules(jobs_map)
+    # Then read what is deployed and work out what needs to change.
+    existing_rules = get_existing_rules()
+    existing_targets = get_existing_targets([job_key for job_key in jobs_map if job_key in existing_rules],
+                                            max_workers)
+    existing_permissions = get_existing_permissions()
+    plan = make_deploy_plan(jobs_map, existing_rules, existing_targets, existing_permissions, lambda_arn)
+    print_deploy_plan(plan)
+    if dry_run:
+        return plan
+
+    # Then create the schedule rules for the new or changed jobs.
+    rules = create_scheduler_rules({job_key: jobs_map[job_key] for job_key in plan["rules"]}, max_workers)
 
     # Then add the permissions for the event bridge scheduler to invoke
-    # the job router lambda for each scheduled rule.
-    add_lambda_permissions(rules)
+    # the job router lambda for each scheduled rule that does not have one.
+    permission_rules = {}
+    for job_key in plan["permissions"]:
+        if job_key in rules:
+            permission_rules[job_key] = rules[job_key]
+        elif job_key in existing_rules:
+            permission_rules[job_key] = {"RuleArn": existing_rules[job_key]["Arn"]}
+    add_lambda_permissions(permission_rules)
 
     # Lastly add the job router lambda as a target for each schedule rule
     # so the scheduler can invoke the job router lambda when a schedule rule fires.
-    create_event_targets(jobs_map, lambda_arn)
+    create_event_targets({job_key: jobs_map[job_key] for job_key in plan["targets"]}, lambda_arn, max_workers)
 
     print("job events deployed")
+    return plan
 
 def get_jobs_map(job_name, jobs_file_name):
     """
     Reads the file that holds the event bridge scheduler jobs.
     If a specific job name is passed in then just that job will be
-    deployed. Otherwise all jobs will be deployed.
+    deployed. Otherwise all jobs will be deployed. Nothing is deployed
+    if any job in the file is invalid.
     """
-    with open(jobs_file_name, encoding="UTF-8") as json_file:
-        jobs_map = json.load(json_file)
+    try:
+        jobs_map = load_jobs_map(jobs_file_name)
+    except JobDefinitionError as e:
+        print(e)
+        sys.exit(1)
 
-        if not job_name:
-            return jobs_map
+    if not job_name:
+        return jobs_map
+    else:
+        if not job_name in jobs_map:
+            print("Job details for " + job_name + " do not exist in "
+                  + jobs_file_name + " file")
+            sys.exit(1)
         else:
-            if not job_name in jobs_map:
-                print("Job details for " + job_name + " do not exist in "
-                      + jobs_file_name + " file")
-                sys.exit(1)
-            else:
-                return {job_name: jobs_map[job_name]}
+            return {job_name: jobs_map[job_name]}
 
 def get_args():
     """
@@ -172,6 +503,10 @@ def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--job_name", type=str, default=None, help="Name of the job in the job details file to deploy just 1 job. Do not use to deploy all jobs.")
     parser.add_argument("--jobs_file_name", type=str, default="../job-details.json",  help="Name of a specific jobs file to be deployed.")
+    parser.add_argument("--dry_run", action="store_true", help="Print the changes the deployment would make without making them.")
+    parser.add_argument("--analyze", action="store_true", help="Print the concurrent firings per service and the suggested offsets, then exit.")
+    parser.add_argument("--stagger", action="store_true", help="Move colliding cron jobs to the suggested minutes in the jobs file before deploying.")
+    parser.add_argument("--max_workers", type=int, default=8, help="Maximum number of AWS calls made at the same time.")
 
     return parser.parse_args()
 
@@ -205,15 +540,36 @@ if __name__ == '__main__':
     or
     python3 deploy_schedule.py --job_name <name of specific job to deploy> \
                                --jobs_file_name <name of specific json file where jobs are stored>
+    or
+    python3 deploy_schedule.py --dry_run
+    or
+    python3 deploy_schedule.py --analyze
     """
+    # Parse any command line arguments if any exist. Provide defaults.
+    args = get_args()
+
+    if args.analyze:
+        # The analysis needs all the jobs, since any of them can collide.
+        print_schedule_analysis(get_jobs_map(None, args.jobs_file_name))
+        sys.exit(0)
+
     # Get the deployment environment from the CMR_ENVIRONMENT variable
     environment = get_environment()
 
-    # Parse any command line arguments if any exist. Provide defaults.
-    args = get_args()
+    if args.stagger:
+        all_jobs = get_jobs_map(None, args.jobs_file_name)
+        suggested_offsets = print_schedule_analysis(all_jobs)
+        if args.dry_run:
+            print(f"Dry run, the suggested minutes are not written to {args.jobs_file_name}")
+        elif suggested_offsets:
+            try:
+                write_offsets(args.jobs_file_name, suggested_offsets)
+            except ValueError as e:
+                print(f"{e}, set the suggested minutes by hand")
+                sys.exit(1)
 
     # Get the jobs from the json jobs definition file.
     jobs_map = get_jobs_map(args.job_name, args.jobs_file_name)
 
     # Deploy the schedules and tie them to the job router lambda.
-    deploy_schedules(jobs_map)
+    deploy_schedules(jobs_map, dry_run=args.dry_run, max_workers=args.max_workers)
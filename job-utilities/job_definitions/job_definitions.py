@@ -0,0 +1,284 @@
+"""
+job_definitions loads the job details file shared by deploy_schedule and
+local_scheduler. The file is validated once against JOB_SCHEMA, every
+schedule is compiled into a CronSchedule or IntervalSchedule and the result
+is cached until the file changes, so a malformed job fails when the file is
+loaded rather than when the job fires.
+"""
+import json
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+DAY_NAMES = {"SUN": 1, "MON": 2, "TUE": 3, "WED": 4, "THU": 5, "FRI": 6, "SAT": 7}
+MONTH_NAMES = {"JAN": 1, "FEB": 2, "MAR": 3, "APR": 4, "MAY": 5, "JUN": 6,
+               "JUL": 7, "AUG": 8, "SEP": 9, "OCT": 10, "NOV": 11, "DEC": 12}
+# Years EventBridge accepts in the year field
+MIN_YEAR = 1970
+MAX_YEAR = 2199
+
+# The fields of a job, as field name -> (types, required). The fields of the
+# target are passed to the job router lambda as its event.
+JOB_SCHEMA = {
+    "target": {
+        "endpoint": ((str,), True),
+        "service": ((str,), True),
+        "request-type": ((str,), False),
+        "single-target": ((bool,), False),
+        "async": ((bool,), False),
+        "trigger-timeout": ((int, float), False),
+        "timeout": ((int, float), False)
+    },
+    "cron": {
+        "minutes": ((int, str), True),
+        "hours": ((int, str), True),
+        "day-of-month": ((int, str), True),
+        "month": ((int, str), True),
+        "day-of-week": ((int, str), True),
+        "year": ((int, str), False)
+    },
+    "interval": {
+        "minutes": ((int,), True),
+        "hours": ((int,), False)
+    }
+}
+REQUEST_TYPES = ("GET", "POST", "PUT", "DELETE")
+# Values given to the optional fields of a job that leaves them out, so the
+# programs using the jobs can read every field
+JOB_DEFAULTS = {
+    "target": {"request-type": "GET"},
+    "cron": {"year": "*"}
+}
+# The services jobs can target, as service name -> local port
+SERVICES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "job_router", "service-ports.json")
+
+# A job with its compiled schedule
+Job = namedtuple("Job", ["name", "details", "schedule"])
+
+class JobDefinitionError(ValueError):
+    """
+    Raised when the job details file does not match JOB_SCHEMA. errors lists
+    every problem found in the file.
+    """
+    def __init__(self, file_name, errors):
+        self.errors = errors
+        super().__init__(f"{file_name} has {len(errors)} invalid job details:\n  " + "\n  ".join(errors))
+
+def expand_cron_field(field, low, high, names=None):
+    """
+    Returns the sorted values a cron field matches, supporting *, ?, single
+    values, ranges, steps and lists, for example "0/15", "1-5" or "MON,WED".
+    Raises ValueError for values outside of low and high.
+    """
+    names = names or {}
+    values = set()
+    for part in str(field).upper().split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/")
+            step = int(step_text)
+        if part in ("*", "?"):
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(names.get(value, value)) for value in part.split("-"))
+        else:
+            start = int(names.get(part, part))
+            end = high if step > 1 else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Cron field {field} is outside of {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+class CronSchedule:
+    """
+    A schedule that fires at the times matching all six EventBridge cron fields:
+    minutes, hours, day-of-month, month, day-of-week (1 is Sunday) and year.
+    """
+    def __init__(self, timing):
+        self.minutes = expand_cron_field(timing["minutes"], 0, 59)
+        self.hours = expand_cron_field(timing["hours"], 0, 23)
+        self.days_of_month = set(expand_cron_field(timing["day-of-month"], 1, 31))
+        self.months = set(expand_cron_field(timing["month"], 1, 12, MONTH_NAMES))
+        self.days_of_week = set(expand_cron_field(timing["day-of-week"], 1, 7, DAY_NAMES))
+        self.years = set(expand_cron_field(timing.get("year", "*"), MIN_YEAR, MAX_YEAR))
+
+    def matches_day(self, day):
+        """
+        Returns True if the job fires at some time of the given date
+        """
+        return (day.year in self.years and day.month in self.months
+                and day.day in self.days_of_month
+                and day.isoweekday() % 7 + 1 in self.days_of_week)
+
+    def next_fire(self, after):
+        """
+        Returns the first fire time after the given UTC datetime, or None if
+        the schedule never fires again
+        """
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        while day.year <= max(self.years):
+            if day.month not in self.months or day.year not in self.years:
+                # Skip to the first day of the next month
+                day = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+                continue
+            if self.matches_day(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        fire_time = datetime(day.year, day.month, day.day, hour, minute, tzinfo=timezone.utc)
+                        if fire_time >= start:
+                            return fire_time
+            day += timedelta(days=1)
+        return None
+
+class IntervalSchedule:
+    """
+    A schedule that fires every given number of minutes
+    """
+    def __init__(self, timing):
+        self.period = timedelta(minutes=timing.get("hours", 0) * 60 + timing.get("minutes", 0))
+        if self.period <= timedelta(0):
+            raise ValueError("Interval must be at least one minute")
+
+    def next_fire(self, after):
+        """
+        Returns the fire time one period after the given UTC datetime
+        """
+        return after + self.period
+
+def make_schedule(job_details):
+    """
+    Returns the cron or interval schedule of the job
+    """
+    if job_details["scheduling"]["type"] == "cron":
+        return CronSchedule(job_details["scheduling"]["timing"])
+    return IntervalSchedule(job_details["scheduling"]["timing"])
+
+def check_fields(path, value, schema, errors):
+    """
+    Adds an error for every missing required field and every field of the
+    wrong type. Returns False if the value is not an object
+    """
+    if not isinstance(value, dict):
+        errors.append(f"{path} must be an object")
+        return False
+    for field, (types, required) in schema.items():
+        if field not in value:
+            if required:
+                errors.append(f"{path} is missing {field}")
+        # bool is a subclass of int, so it is only accepted where it is listed
+        elif not isinstance(value[field], types) or (isinstance(value[field], bool) and bool not in types):
+            errors.append(f"{path}.{field} must be of type {' or '.join(t.__name__ for t in types)}")
+    return True
+
+def known_services(file_name=SERVICES_FILE):
+    """
+    Returns the names of the services in a service ports file
+    """
+    with open(file_name, encoding="UTF-8") as services_file:
+        return sorted(json.load(services_file))
+
+def validate_job(job_name, job_details, services=None):
+    """
+    Returns the list of problems with the job details, empty if there are none.
+    When services is given the target service must be one of them
+    """
+    errors = []
+    if not check_fields(job_name, job_details, {"target": ((dict,), True), "scheduling": ((dict,), True)},
+                        errors) or errors:
+        return errors
+
+    check_fields(f"{job_name}.target", job_details["target"], JOB_SCHEMA["target"], errors)
+    request_type = job_details["target"].get("request-type", "GET")
+    if request_type not in REQUEST_TYPES:
+        errors.append(f"{job_name}.target.request-type must be one of {', '.join(REQUEST_TYPES)}")
+    service = job_details["target"].get("service")
+    if services is not None and isinstance(service, str) and service not in services:
+        errors.append(f"{job_name}.target.service must be one of {', '.join(sorted(services))}")
+
+    scheduling = job_details["scheduling"]
+    if scheduling.get("type") not in ("cron", "interval"):
+        errors.append(f"{job_name}.scheduling.type must be cron or interval")
+        return errors
+    error_count = len(errors)
+    if not check_fields(f"{job_name}.scheduling.timing", scheduling.get("timing"),
+                        JOB_SCHEMA[scheduling["type"]], errors) or len(errors) > error_count:
+        return errors
+
+    timing = scheduling["timing"]
+    if scheduling["type"] == "cron" and (str(timing["day-of-month"]) == "?") == (str(timing["day-of-week"]) == "?"):
+        errors.append(f"{job_name}.scheduling.timing needs ? in exactly one of day-of-month and day-of-week")
+    try:
+        make_schedule(job_details)
+    except ValueError as e:
+        errors.append(f"{job_name}.scheduling.timing is invalid: {e}")
+    return errors
+
+def with_defaults(job_details):
+    """
+    Returns a copy of valid job details with JOB_DEFAULTS filled in for the
+    optional fields that are left out
+    """
+    job_details = json.loads(json.dumps(job_details))
+    scheduling = job_details["scheduling"]
+    for field, value in JOB_DEFAULTS["target"].items():
+        job_details["target"].setdefault(field, value)
+    for field, value in JOB_DEFAULTS.get(scheduling["type"], {}).items():
+        scheduling["timing"].setdefault(field, value)
+    return job_details
+
+def compile_jobs(jobs_map, file_name="job details", services=None):
+    """
+    Validates every job and returns a map of job name to Job, with the
+    defaults of the optional fields filled in. When services is given every
+    job must target one of them. Raises a JobDefinitionError listing all the
+    problems if any job is invalid
+    """
+    if not isinstance(jobs_map, dict):
+        raise JobDefinitionError(file_name, ["the file must contain an object of jobs"])
+    errors = []
+    for job_name, job_details in jobs_map.items():
+        errors.extend(validate_job(job_name, job_details, services))
+    if errors:
+        raise JobDefinitionError(file_name, errors)
+    jobs = {}
+    for job_name, job_details in jobs_map.items():
+        job_details = with_defaults(job_details)
+        jobs[job_name] = Job(job_name, job_details, make_schedule(job_details))
+    return jobs
+
+cache = {}
+cache_lock = threading.Lock()
+
+def load_jobs(file_name, services=None):
+    """
+    Returns the compiled jobs of the job details file. Every job must target
+    one of the services, which default to those of SERVICES_FILE. The jobs
+    are cached by file name and reloaded only when the file is modified
+    """
+    if services is None:
+        services = known_services()
+    path = os.path.abspath(file_name)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size, tuple(sorted(services)))
+    with cache_lock:
+        cached = cache.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+    with open(path, encoding="UTF-8") as json_file:
+        try:
+            jobs_map = json.load(json_file)
+        except json.JSONDecodeError as e:
+            raise JobDefinitionError(file_name, [f"the file is not valid JSON: {e}"]) from e
+    jobs = compile_jobs(jobs_map, file_name, services)
+    with cache_lock:
+        cache[path] = (version, jobs)
+    return jobs
+
+def load_jobs_map(file_name, services=None):
+    """
+    Returns the validated job details of the file, with defaults filled in, as
+    a map of job name to details
+    """
+    return {job_name: job.details for job_name, job in load_jobs(file_name, services).items()}
@@ -0,0 +1,173 @@
+"""
+job_report reads the structured job run lines written by the job router
+Lambda and the local scheduler, and summarizes the run times of each job.
+Jobs whose runs take close to the time between two of their firings
+are flagged, since they are at risk of overlapping their next run.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+from datetime import datetime, timezone
+
+# The job definitions loader is shared with the other job utilities
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# pylint: disable=wrong-import-position
+from job_definitions.job_definitions import IntervalSchedule, JobDefinitionError, load_jobs
+
+JOB_RUN_LOG_PREFIX = "JOB_RUN "
+
+# Cron schedules are measured by walking their firings from PERIOD_START,
+# for at most PERIOD_FIRINGS firings or until PERIOD_END
+PERIOD_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+PERIOD_END = datetime(2025, 2, 1, tzinfo=timezone.utc)
+PERIOD_FIRINGS = 2000
+
+def read_job_runs(lines):
+    """
+    Returns the job run records found in the given log lines. The record
+    is the JSON after the JOB_RUN prefix, anything before it (timestamps,
+    log levels, request ids) is ignored
+    """
+    runs = []
+    for line in lines:
+        index = line.find(JOB_RUN_LOG_PREFIX)
+        if index < 0:
+            continue
+        try:
+            runs.append(json.loads(line[index + len(JOB_RUN_LOG_PREFIX):]))
+        except json.JSONDecodeError:
+            print(f"Skipping malformed job run line: {line.strip()}", file=sys.stderr)
+    return runs
+
+def percentile(values, percent):
+    """
+    Returns the percentile of the values, interpolating between the two
+    nearest values
+    """
+    if len(values) < 2:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+def schedule_period_minutes(job):
+    """
+    Returns the shortest number of minutes between two firings of the
+    compiled job, or None if it fires at most once in the measured period
+    """
+    if isinstance(job.schedule, IntervalSchedule):
+        return job.schedule.period.total_seconds() / 60
+
+    shortest = None
+    previous = job.schedule.next_fire(PERIOD_START)
+    for _ in range(PERIOD_FIRINGS):
+        if previous is None or previous > PERIOD_END:
+            break
+        fire_time = job.schedule.next_fire(previous)
+        if fire_time is None:
+            break
+        gap = (fire_time - previous).total_seconds() / 60
+        shortest = gap if shortest is None else min(shortest, gap)
+        previous = fire_time
+    return shortest
+
+def summarize(runs, jobs, threshold):
+    """
+    Returns one summary per job with the number of runs, failures and async
+    runs that were still running, the p50, p95 and maximum duration in seconds
+    and whether the p95 duration is at least threshold times the time between
+    two firings of the job. The duration of a running run is only how long the
+    router waited for the trigger, so those runs are left out of the
+    durations, which are None when no run finished.
+    jobs maps job names to the compiled jobs of load_jobs
+    """
+    counts = {}
+    durations = {}
+    failures = {}
+    running = {}
+    for run in runs:
+        counts[run["job"]] = counts.get(run["job"], 0) + 1
+        job_durations = durations.setdefault(run["job"], [])
+        if run.get("status") == "running":
+            running[run["job"]] = running.get(run["job"], 0) + 1
+        else:
+            job_durations.append(run["duration"])
+        if run.get("status") == "failed":
+            failures[run["job"]] = failures.get(run["job"], 0) + 1
+
+    summaries = []
+    for job_name, job_durations in sorted(durations.items()):
+        summary = {"job": job_name,
+                   "runs": counts[job_name],
+                   "failures": failures.get(job_name, 0),
+                   "running": running.get(job_name, 0),
+                   "p50": percentile(job_durations, 50) if job_durations else None,
+                   "p95": percentile(job_durations, 95) if job_durations else None,
+                   "max": max(job_durations, default=None),
+                   "interval": None,
+                   "slow": False}
+        period = schedule_period_minutes(jobs[job_name]) if job_name in jobs else None
+        if period is not None and job_durations:
+            summary["interval"] = round(period * 60)
+            summary["slow"] = summary["p95"] >= threshold * summary["interval"]
+        summaries.append(summary)
+    return summaries
+
+def print_report(summaries):
+    """
+    Prints the summaries as a table, slow jobs are marked with SLOW
+    """
+    def seconds(value):
+        return "-" if value is None else f"{value:.1f}"
+
+    print(f"{'job':<40} {'runs':>6} {'failed':>6} {'running':>7} "
+          f"{'p50 s':>9} {'p95 s':>9} {'max s':>9} {'interval s':>10}")
+    for summary in summaries:
+        interval = summary["interval"] if summary["interval"] is not None else "-"
+        print(f"{summary['job']:<40} {summary['runs']:>6} {summary['failures']:>6} {summary['running']:>7} "
+              f"{seconds(summary['p50']):>9} {seconds(summary['p95']):>9} {seconds(summary['max']):>9} "
+              f"{interval:>10}"
+              + ("  SLOW" if summary["slow"] else ""))
+
+def get_args():
+    """
+    Parse the passed in arguments if any. Provide defaults values.
+    """
+    parser = argparse.ArgumentParser(description="Summarize job run times")
+    parser.add_argument("log_files", nargs="*", help="Log files to read, standard input when none are given.")
+    parser.add_argument("--jobs_file_name", type=str, default="../job-details.json", help="Job details file with the job schedules.")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Flag jobs whose p95 duration is at least this fraction of their interval.")
+    parser.add_argument("--json", action="store_true", help="Print the summaries as JSON.")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    """
+    Usage:
+    python3 job_report.py router.log local_scheduler.py.log
+    or
+    aws logs filter-log-events --log-group-name /aws/lambda/job-router-sit \
+        --filter-pattern JOB_RUN --output text | python3 job_report.py
+    """
+    args = get_args()
+
+    try:
+        jobs = load_jobs(args.jobs_file_name)
+    except JobDefinitionError as e:
+        print(e)
+        sys.exit(1)
+
+    job_runs = []
+    if args.log_files:
+        for log_file in args.log_files:
+            with open(log_file, encoding="UTF-8") as log:
+                job_runs.extend(read_job_runs(log))
+    else:
+        job_runs = read_job_runs(sys.stdin)
+
+    job_summaries = summarize(job_runs, jobs, args.threshold)
+    if args.json:
+        print(json.dumps(job_summaries, indent=2))
+    else:
+        print_report(job_summaries)
+    if any(job_summary["slow"] for job_summary in job_summaries):
+        sys.exit(2)
@@ -4,14 +4,63 @@ an AWS EventBridge rule and make a call to an endpoint
 for running scheduled jobs. These endpoints could be through
 a load balancer or directly to an ECS service
 """
+import functools
 import json
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 import urllib3
 from jmespath import search
 
+# How long, in seconds, an echo system token read from the parameter store is reused
+# by a warm Lambda container before it is read again.
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', '900'))
+
+# (environment, service) -> (token, time the token expires from the cache)
+token_cache = {}
+
+# Prefix of the structured log line written for every job run,
+# read back by job_report/job_report.py
+JOB_RUN_LOG_PREFIX = "JOB_RUN "
+
+# ECS DescribeTasks accepts at most 100 tasks per call
+DESCRIBE_TASKS_LIMIT = 100
+
+# Responses that are worth retrying because the node is likely to answer
+# the next request. Read timeouts are not retried because a timed out
+# refresh may still be running on the node.
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+
+# Responses that are retried for requests other than GET. The load balancer
+# answers 502 or 504 when a long refresh passes its idle timeout while the
+# node keeps running it, so retrying those would start the refresh again.
+# 429 and 503 mean the request was turned away before it was run.
+REFUSED_STATUSES = (429, 503)
+
+# How long, in seconds, to wait for a connection to a target. Connecting is
+# retried, so this is kept short to keep the retries within the Lambda timeout.
+CONNECT_TIMEOUT = float(os.getenv('ROUTER_CONNECT_TIMEOUT', '5'))
+
+# Responses that mean the token was refused, for example because it was
+# rotated while it was cached
+UNAUTHORIZED_STATUSES = (401, 403)
+
+# Job statuses that fail the invocation once the summary is logged, so that
+# Lambda error metrics, alarms and EventBridge retries see the failed job
+FAILED_JOB_STATUSES = ("failed", "partial")
+
+class JobFailedError(Exception):
+    """
+    Raised when a job failed on some or all of its targets
+    """
+    def __init__(self, summary):
+        super().__init__(f"Job {summary['endpoint']} on {summary['service']} {summary['status']}: "
+                         f"{summary['failed']} of {len(summary['targets'])} targets failed")
+        self.summary = summary
+
 def handler(event, _):
     """
     Entry point for Lambda function invocation.
@@ -30,26 +79,251 @@ def handler(event, _):
         sys.exit(1)
 
     if environment == 'local':
-        route_local(event=event)
+        summary = route_local(event=event)
     else:
-        route(environment=environment, event=event)
+        summary = route(environment=environment, event=event)
+    if summary['status'] in FAILED_JOB_STATUSES:
+        raise JobFailedError(summary)
+    return summary
 
-def send_request(request_type, token, url):
+@functools.lru_cache(maxsize=None)
+def get_client(service_name):
     """
-    Sends the request of given type with given token
-    to given url
+    Returns a boto3 client for the given AWS service. Clients are
+    created once per Lambda container and reused by warm invocations
+    """
+    return boto3.client(service_name)
+
+@functools.lru_cache(maxsize=None)
+def get_pool_manager():
+    """
+    Returns the pool manager shared by all requests so that connections
+    are reused across requests and warm invocations
+    """
+    return urllib3.PoolManager()
+
+@functools.lru_cache(maxsize=None)
+def get_load_balancer_dns_name(host):
     """
-    timeout = int(os.getenv('ROUTER_TIMEOUT', '300'))
+    Returns the DNS name of the named load balancer. The name does not
+    change for the life of the load balancer so it is only looked up once
+    per Lambda container
+    """
+    return get_client('elbv2').describe_load_balancers(Names=[host])["LoadBalancers"][0]["DNSName"]
+
+def get_token(environment, service):
+    """
+    Returns the echo system token of the service from the parameter store.
+    The token is reused for TOKEN_CACHE_TTL seconds
+    """
+    now = time.monotonic()
+    cached = token_cache.get((environment, service))
+    if cached and cached[1] > now:
+        return cached[0]
+
+    token = get_client('ssm').get_parameter(Name=f"/{environment}/{service}/CMR_ECHO_SYSTEM_TOKEN", \
+                                           WithDecryption=True)['Parameter']['Value']
+    token_cache[(environment, service)] = (token, now + TOKEN_CACHE_TTL)
+    return token
+
+def drop_token(environment, service):
+    """
+    Removes the cached token of the service so that the next get_token
+    reads it from the parameter store again
+    """
+    token_cache.pop((environment, service), None)
+
+def resend_unauthorized(environment, service, results, send):
+    """
+    Reads the token again and resends the requests of the targets that
+    answered 401 or 403, once. send takes a token and a list of urls and
+    returns their results. Returns the results with the resent ones replaced
+    """
+    unauthorized = [result['url'] for result in results
+                    if result.get('http-status') in UNAUTHORIZED_STATUSES]
+    if not unauthorized:
+        return results
+    print(f"Token refused by {len(unauthorized)} targets, reading it again")
+    drop_token(environment, service)
+    resent = dict(zip(unauthorized, send(get_token(environment, service), unauthorized)))
+    return [resent.get(result['url'], result) for result in results]
 
-    pool_manager = urllib3.PoolManager(headers={"Authorization": token, \
-                                                "Client-Id": "cmr-job-router"}, \
-                                    timeout=urllib3.Timeout(timeout))
+def clear_caches():
+    """
+    Clears everything cached across warm invocations
+    """
+    get_client.cache_clear()
+    get_pool_manager.cache_clear()
+    get_load_balancer_dns_name.cache_clear()
+    token_cache.clear()
 
-    response = pool_manager.request(request_type, url)
+def get_retry_policy(request_type="GET"):
+    """
+    Returns the retry policy for requests. Connection errors and transient
+    responses are retried ROUTER_RETRIES times (default 2) with an exponential
+    backoff starting at ROUTER_RETRY_BACKOFF seconds (default 1). Requests
+    other than GET start a job, so they are only retried when they were
+    turned away before reaching it, see REFUSED_STATUSES
+    """
+    is_get = request_type.upper() == "GET"
+    return urllib3.Retry(total=int(os.getenv('ROUTER_RETRIES', '2')),
+                         read=0,
+                         other=None if is_get else 0,
+                         status_forcelist=TRANSIENT_STATUSES if is_get else REFUSED_STATUSES,
+                         allowed_methods=None,
+                         backoff_factor=float(os.getenv('ROUTER_RETRY_BACKOFF', '1')),
+                         raise_on_status=False)
+
+def send_request(request_type, token, url, timeout=None):
+    """
+    Sends the request of given type with given token
+    to given url and returns the response. Transient errors are
+    retried. The timeout is how long to wait for the answer, it defaults
+    to ROUTER_TIMEOUT seconds. Only connecting is retried after a timeout
+    """
+    if timeout is None:
+        timeout = int(os.getenv('ROUTER_TIMEOUT', '300'))
+
+    response = get_pool_manager().request(request_type, url,
+                                          headers={"Authorization": token, \
+                                                   "Client-Id": "cmr-job-router"}, \
+                                          timeout=urllib3.Timeout(connect=min(CONNECT_TIMEOUT, timeout),
+                                                                  read=timeout),
+                                          retries=get_retry_policy(request_type))
     if response.status != 200:
         print(f"Error received sending {request_type} to {url}: " \
                 + f"{str(response.status)} reason: {response.reason}")
-        sys.exit(-1)
+    return response
+
+def is_read_timeout(error):
+    """
+    Returns True if the error means the request was sent but no
+    answer came back in time
+    """
+    if isinstance(error, urllib3.exceptions.MaxRetryError):
+        error = error.reason
+    return isinstance(error, urllib3.exceptions.ReadTimeoutError)
+
+def send_request_to_target(request_type, token, url, timeout=None, fire_and_forget=False):
+    """
+    Sends the request to one target and returns the outcome for that
+    target instead of ending the invocation. With fire_and_forget a
+    read timeout means the node accepted the request and is still
+    working on it, so the target is reported as running
+    """
+    start = time.monotonic()
+    result = {"url": url, "status": "failed", "http-status": None, "attempts": 1, "error": None}
+    try:
+        response = send_request(request_type=request_type, token=token, url=url, timeout=timeout)
+        result["http-status"] = response.status
+        result["payload-size"] = len(response.data or b"")
+        if response.retries is not None:
+            result["attempts"] = len(response.retries.history) + 1
+        if response.status == 200:
+            result["status"] = "succeeded"
+        else:
+            result["error"] = f"{response.status} reason: {response.reason}"
+    except Exception as e: # pylint: disable=broad-exception-caught; One target must not stop the others
+        if fire_and_forget and is_read_timeout(e):
+            print(f"Triggered {request_type} on {url}, it is still running")
+            result["status"] = "running"
+        else:
+            print(f"Error sending {request_type} to {url}: {e}")
+            result["error"] = str(e)
+    result["duration"] = time.monotonic() - start
+    return result
+
+def send_request_to_targets(request_type, token, urls, timeout=None, fire_and_forget=False):
+    """
+    Sends the request to all the given urls at the same time using at most
+    ROUTER_MAX_WORKERS threads. Each target gets TARGET_TIMEOUT seconds,
+    which defaults to ROUTER_TIMEOUT, unless a timeout is given.
+    Returns the results in the order of urls
+    """
+    if not urls:
+        return []
+    max_workers = int(os.getenv('ROUTER_MAX_WORKERS', '10'))
+    if timeout is None:
+        timeout = int(os.getenv('TARGET_TIMEOUT', os.getenv('ROUTER_TIMEOUT', '300')))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as executor:
+        futures = [executor.submit(send_request_to_target, request_type, token, url, timeout,
+                                   fire_and_forget)
+                   for url in urls]
+        return [future.result() for future in futures]
+
+def print_target_report(results):
+    """
+    Prints the result of each target and a summary line
+    """
+    for result in results:
+        print(f"{result['status']}: {result['url']} in {result['duration']:.3f}s")
+    failed = [result for result in results if result['status'] != "succeeded"]
+    print(f"{len(results) - len(failed)} of {len(results)} targets succeeded")
+
+def make_summary(event, results):
+    """
+    Builds the structured summary returned by the Lambda. The status is
+    failed when every target failed, partial when some failed, running
+    when some were triggered and are still running and succeeded otherwise
+    """
+    succeeded = len([result for result in results if result['status'] == "succeeded"])
+    running = [result for result in results if result['status'] == "running"]
+    failed = len(results) - succeeded - len(running)
+    if not results or failed == len(results):
+        status = "failed"
+    elif failed > 0:
+        status = "partial"
+    elif running:
+        status = "running"
+    else:
+        status = "succeeded"
+    summary = {"service": event.get('service', 'bootstrap'),
+               "endpoint": event.get('endpoint'),
+               "status": status,
+               "succeeded": succeeded,
+               "running": len(running),
+               "failed": failed,
+               "targets": results}
+    return summary
+
+def log_job_run(event, summary, duration):
+    """
+    Writes one structured log line with the duration, status and payload
+    size of a job run so that run times can be reported on later
+    """
+    record = {"job": event.get('job-name', event.get('endpoint')),
+              "service": event.get('service', 'bootstrap'),
+              "endpoint": event.get('endpoint'),
+              "status": summary['status'],
+              "duration": round(duration, 3),
+              "payload-size": sum(target.get('payload-size') or 0 for target in summary['targets']),
+              "targets": len(summary['targets']),
+              "timestamp": time.time()}
+    print(JOB_RUN_LOG_PREFIX + json.dumps(record))
+    return record
+
+def get_task_ips(client, environment, service):
+    """
+    Returns the private IP address of every task of the service,
+    paging through list_tasks and describing the tasks in batches
+    """
+    cluster = f"cmr-service-{environment}"
+    task_arns = []
+    for page in client.get_paginator('list_tasks').paginate(cluster=cluster,
+                                                            serviceName=f"{service}-{environment}"):
+        task_arns.extend(page['taskArns'])
+
+    task_ips = []
+    for start in range(0, len(task_arns), DESCRIBE_TASKS_LIMIT):
+        response = client.describe_tasks(
+            cluster=cluster,
+            tasks=task_arns[start:start + DESCRIBE_TASKS_LIMIT]
+        )
+        ips = search("tasks[*].attachments[0].details[?name=='privateIPv4Address'].value",\
+                                    response)
+        task_ips.extend(search("[]", ips) or [])
+    return task_ips
 
 def route_local(event):
     """
@@ -65,60 +339,63 @@ def route_local(event):
         token = 'mock-echo-system-token'
 
         print(f"Sending to: host.docker.internal:{service_ports[service]}/{endpoint}")
-        try:
-            send_request(request_type=request_type,
-                            token=token,
-                            url=f"host.docker.internal:{service_ports[service]}/{endpoint}")
-        except Exception as e: # pylint: disable=broad-exception-caught; Not worried about this being too broad
-            print("Ran into an error!")
-            print(e)
-            sys.exit(-1)
+        start = time.monotonic()
+        result = send_request_to_target(request_type=request_type,
+                                        token=token,
+                                        url=f"host.docker.internal:{service_ports[service]}/{endpoint}",
+                                        timeout=event.get('timeout'))
+        summary = make_summary(event, [result])
+        log_job_run(event, summary, time.monotonic() - start)
+        return summary
 
 def route(environment, event):
     """
     Handles routing for single target and multi target requests
-    on a deployed environment
+    on a deployed environment. Returns a summary with the outcome
+    of every target
     """
     host = os.getenv('CMR_LB_NAME')
     service = event.get('service', 'bootstrap')
     endpoint = event.get('endpoint')
     single_target = event.get('single-target', True)
     request_type = event.get('request-type', "GET")
+    # In async mode the request only waits trigger-timeout seconds for an answer
+    fire_and_forget = event.get('async', False)
+    trigger_timeout = float(event.get('trigger-timeout', os.getenv('ASYNC_TRIGGER_TIMEOUT', '10')))
+    # A job can wait for its answer longer or shorter than the default
+    timeout = trigger_timeout if fire_and_forget else event.get('timeout')
+    start = time.monotonic()
 
-    client = boto3.client('ecs')
-    ssm_client = boto3.client('ssm')
-    elb_client = boto3.client('elbv2')
+    client = get_client('ecs')
 
-    cmr_url = elb_client.describe_load_balancers(Names=[host])["LoadBalancers"][0]["DNSName"]
+    cmr_url = get_load_balancer_dns_name(host)
 
-    token = ssm_client.get_parameter(Name=f"/{environment}/{service}/CMR_ECHO_SYSTEM_TOKEN", \
-                                    WithDecryption=True)['Parameter']['Value']
+    token = get_token(environment, service)
+
+    def send(token, urls):
+        if single_target:
+            return [send_request_to_target(request_type=request_type,
+                                           token=token,
+                                           url=urls[0],
+                                           timeout=timeout,
+                                           fire_and_forget=fire_and_forget)]
+        return send_request_to_targets(request_type=request_type, token=token, urls=urls,
+                                       timeout=timeout,
+                                       fire_and_forget=fire_and_forget)
 
     if single_target:
         print(f"Running {request_type} on URL: {cmr_url}/{service}/{endpoint}")
-
-        send_request(request_type=request_type,
-                    token=token,
-                    url=f"{cmr_url}/{service}/{endpoint}")
+        hosts = [cmr_url]
     else:
-        #Multi-target functionality is not fully implemented.
-        #CMR-9688 has been made to finish this part out
-        response = client.list_tasks(
-            cluster=f"cmr-service-{environment}",
-            serviceName=f"{service}-{environment}"
-        )['taskArns']
-
-        response = client.describe_tasks(
-            cluster=f"cmr-service-{environment}",
-            tasks=response
-        )
-        task_ips = search("tasks[*].attachments[0].details[?name=='privateIPv4Address'].value",\
-                                    response)
-        task_ips = search("[]", task_ips)
+        hosts = get_task_ips(client, environment, service)
+        print(f"Running {request_type} on {len(hosts)} targets: "
+              f"{[f'{task}/{service}/{endpoint}' for task in hosts]}")
+    urls = [f"{host}/{service}/{endpoint}" for host in hosts]
 
-        for task in task_ips:
-            print(f"Running POST on URL: {task}/{service}/{endpoint}")
+    results = resend_unauthorized(environment, service, send(token, urls), send)
 
-            send_request(request_type=request_type,
-                        token=token,
-                        url=f"{task}/{service}/{endpoint}")
+    print_target_report(results)
+    summary = make_summary(event, results)
+    print(json.dumps(summary))
+    log_job_run(event, summary, time.monotonic() - start)
+    return summary
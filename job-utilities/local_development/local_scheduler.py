@@ -2,9 +2,9 @@
 
 """
 local_scheduler takes the job details json file to create
-a simple schedule with the Python schedule library.
-Interval jobs are simply translated unto the library,
-cron jobs are assumed to run at a given HH:MM every day.
+a local schedule. Cron jobs fire at the times matching all
+of their cron fields in UTC, like in AWS EventBridge, and
+interval jobs fire every given number of minutes.
 """
 import argparse
 import logging
@@ -14,8 +14,12 @@ import os
 import sys
 
 # pylint: disable=import-error
-import schedule
 import urllib3
+from scheduler_engine import JobRunner, SchedulerEngine
+
+# The job definitions loader is shared with the other job utilities
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from job_definitions.job_definitions import JobDefinitionError, load_jobs # pylint: disable=wrong-import-position
 
 # setup logger
 logging.basicConfig(level=logging.INFO,
@@ -26,8 +30,18 @@ logger: logging.Logger = logging.getLogger(__name__)
 service_ports_file_name = os.getenv("SERVICE_PORTS_FILE", "service-ports.json")
 job_details_file_name = os.getenv("JOB_DETAILS_FILE", "../job-details.json")
 cmr_host_name: str = os.getenv("CMR_HOST_NAME", "localhost")
+# Number of jobs that can run at the same time
+job_workers: int = int(os.getenv("JOB_WORKERS", "4"))
+# Seconds a job request may take before it is failed, a job can override this
+# with a "timeout" in its target
+job_timeout: float = float(os.getenv("JOB_TIMEOUT", "600"))
+
+# Prefix of the structured log line written for every job run
+JOB_RUN_LOG_PREFIX = "JOB_RUN "
 
-pool_manager = urllib3.PoolManager(headers={"Authorization" : "mock-echo-system-token",
+pool_manager = urllib3.PoolManager(maxsize=job_workers,
+                                   retries=False,
+                                   headers={"Authorization" : "mock-echo-system-token",
                                             "client-id": f'{__file__}'})
 
 with open(service_ports_file_name, encoding="UTF-8") as service_ports_file:
@@ -44,42 +58,58 @@ def build_endpoint(host_name, job):
 def run_job(job_details: dict, job_name :str):
     """
     Takes the job details and runs a REST request on the job endpoint.
+    The duration, status and payload size of the run are logged as one
+    structured line that job_report/job_report.py can summarize.
     """
     logger.info('send ' + job_details["target"]["request-type"] + \
           ' to ' + job_details["target"]["endpoint"] + ' for job ' + job_name)
     url: str = build_endpoint(cmr_host_name, job_details)
-    pool_manager.request(job_details["target"]["request-type"], url)
+    start = time.monotonic()
+    status = "failed"
+    payload_size = 0
+    try:
+        timeout = job_details["target"].get("timeout", job_timeout)
+        response = pool_manager.request(job_details["target"]["request-type"], url,
+                                        timeout=urllib3.Timeout(connect=min(10, timeout), total=timeout))
+        payload_size = len(response.data or b"")
+        if response.status == 200:
+            status = "succeeded"
+        else:
+            logger.error("Job %s failed with status %d", job_name, response.status)
+    except urllib3.exceptions.HTTPError as e:
+        logger.error("Job %s failed: %s", job_name, e)
+    record = {"job": job_name,
+              "service": job_details["target"]["service"],
+              "endpoint": job_details["target"]["endpoint"],
+              "status": status,
+              "duration": round(time.monotonic() - start, 3),
+              "payload-size": payload_size,
+              "targets": 1,
+              "timestamp": time.time()}
+    logger.info(JOB_RUN_LOG_PREFIX + json.dumps(record))
 
-def create_schedule():
+def create_schedule(engine, runner):
     """
-    Uses the job-details file to create local schedule using
-    the schedule python library
+    Uses the job-details file to add every job to the scheduler engine.
+    When a job fires it is handed to the runner so the engine is not
+    blocked while the job runs.
     """
-    with open(job_details_file_name, encoding="UTF-8") as json_file:
-        jobs_map = json.load(json_file)
-        for job_name, job_details in jobs_map.items():
-            #Cron scheduling will assume it is scheduled to run at a certain time every day
-            if job_details["scheduling"]["type"] == "cron":
-                hours = str(job_details["scheduling"]["timing"]["hours"]).zfill(2)
-                minutes = str(job_details["scheduling"]["timing"]["minutes"]).zfill(2)
-                logger.info("Scheduling job " + job_name + " at " + hours + ":" + minutes)
-
-                schedule.every().day.at(hours + ":" + minutes).do(run_job,
-                                                      job_details=job_details, job_name=job_name)
-            elif job_details["scheduling"]["type"] == "interval":
-                minutes = job_details["scheduling"]["timing"].get("minutes", 0)
-                hours = job_details["scheduling"]["timing"].get("hours", 0)
-                total_minutes = minutes + hours*60
-                logger.info("Scheduling job for every %d minutes", total_minutes)
-
-                schedule.every(total_minutes).seconds.do(run_job, job_details=job_details,
-                                                         job_name=job_name)
+    for job_name, job in load_jobs(job_details_file_name, services=service_port_map).items():
+        def submit_job(name, job_details=job.details):
+            runner.submit(name, run_job, job_details, name)
+
+        fire_time = engine.add(job_name, job.schedule, submit_job)
+        logger.info("Scheduling job %s, first run at %s", job_name, fire_time)
 
 def main():
     """ The primary interface for this script. """
     parser = argparse.ArgumentParser(description="External CMR scheduler")
     parser.add_argument('-t', '--test', action='store_true',
                         help='Do a test run of RefreashKMSCache and exit.')
+    parser.add_argument('-w', '--workers', type=int, default=job_workers,
+                        help='Number of jobs that can run at the same time.')
+    parser.add_argument('--allow-overlap', action='store_true',
+                        help='Run a job again even if its previous run has not finished.')
     args = parser.parse_args()
 
     if args.test:
@@ -91,10 +121,20 @@ def main():
         run_job(test_detail, "RefreshKMSCache")
         sys.exit()
 
-    create_schedule()
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    engine = SchedulerEngine()
+    runner = JobRunner(max_workers=args.workers, allow_overlap=args.allow_overlap)
+    try:
+        create_schedule(engine, runner)
+    except JobDefinitionError as e:
+        logger.error(str(e))
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    try:
+        engine.run()
+    except KeyboardInterrupt:
+        engine.stop()
+    finally:
+        runner.shutdown(wait=False)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,146 @@
+"""
+scheduler_engine runs jobs from a heap of next fire times. The schedules
+come from job_definitions, which evaluates cron and interval timings the way
+AWS EventBridge does, in UTC. The engine sleeps until the next job is due
+instead of polling.
+"""
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+def utc_now():
+    """
+    Returns the current time in UTC
+    """
+    return datetime.now(timezone.utc)
+
+class SchedulerEngine:
+    """
+    Keeps the next fire time of every job in a heap. run waits until the
+    earliest job is due, calls it and puts it back with its following fire
+    time, so the engine only wakes up when there is something to run.
+
+    Example Use of this class
+    engine = SchedulerEngine()
+    engine.add("RefreshKMSCache", job.schedule, run_job)
+    engine.run()
+    """
+    def __init__(self, clock=utc_now):
+        self.clock = clock
+        self.heap = []
+        self.counter = itertools.count()
+        self.stopped = threading.Event()
+
+    def add(self, job_name, schedule, callback):
+        """
+        Schedules the callback to be called with the job name at every fire
+        time. Returns the first fire time
+        """
+        fire_time = schedule.next_fire(self.clock())
+        self.push(job_name, schedule, callback, fire_time)
+        return fire_time
+
+    def push(self, job_name, schedule, callback, fire_time):
+        """
+        Puts the job on the heap unless it never fires again
+        """
+        if fire_time is not None:
+            # The counter keeps jobs due at the same time in the order they were added
+            heapq.heappush(self.heap, (fire_time, next(self.counter), job_name, schedule, callback))
+
+    def next_fire_time(self):
+        """
+        Returns the time the next job is due, or None if there are no jobs
+        """
+        return self.heap[0][0] if self.heap else None
+
+    def run_pending(self):
+        """
+        Calls every job that is due and reschedules it. Returns the names of
+        the jobs that were called
+        """
+        now = self.clock()
+        called = []
+        while self.heap and self.heap[0][0] <= now:
+            fire_time, _, job_name, schedule, callback = heapq.heappop(self.heap)
+            callback(job_name)
+            called.append(job_name)
+            # A job whose run took longer than its period is not fired for the missed times
+            next_fire = schedule.next_fire(fire_time)
+            while next_fire is not None and next_fire <= now:
+                next_fire = schedule.next_fire(next_fire)
+            self.push(job_name, schedule, callback, next_fire)
+        return called
+
+    def run(self):
+        """
+        Runs jobs as they become due until stop is called or no job is left
+        """
+        while not self.stopped.is_set() and self.heap:
+            delay = (self.next_fire_time() - self.clock()).total_seconds()
+            if delay > 0 and self.stopped.wait(delay):
+                break
+            self.run_pending()
+
+    def stop(self):
+        """
+        Wakes the engine up and makes run return
+        """
+        self.stopped.set()
+
+class JobRunner:
+    """
+    Runs jobs on a bounded thread pool so that a slow job does not hold up
+    the engine or the other due jobs. Unless overlapping runs are allowed,
+    a job that is still running from its previous firing is skipped.
+
+    Example Use of this class
+    runner = JobRunner(max_workers=4)
+    engine.add(job_name, schedule, lambda name: runner.submit(name, run_job, job_details, name))
+    """
+    def __init__(self, max_workers=4, allow_overlap=False):
+        self.allow_overlap = allow_overlap
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.running = {}
+        self.lock = threading.Lock()
+
+    def submit(self, job_name, function, *args):
+        """
+        Queues function(*args) on the pool. Returns the future, or None if
+        the job was skipped because it is still running
+        """
+        with self.lock:
+            if not self.allow_overlap and self.running.get(job_name, 0) > 0:
+                logger.warning("Skipping job %s, its previous run has not finished", job_name)
+                return None
+            self.running[job_name] = self.running.get(job_name, 0) + 1
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(lambda future: self.finished(job_name, future))
+        return future
+
+    def finished(self, job_name, future):
+        """
+        Marks a run of the job as finished and logs any error it raised
+        """
+        with self.lock:
+            self.running[job_name] -= 1
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Job %s raised %r", job_name, future.exception())
+
+    def is_running(self, job_name):
+        """
+        Returns True if a run of the job has not finished yet
+        """
+        with self.lock:
+            return self.running.get(job_name, 0) > 0
+
+    def shutdown(self, wait=True):
+        """
+        Stops taking jobs and, when wait is True, waits for the running ones
+        """
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -5,6 +5,7 @@ import unittest
 from unittest.mock import patch, mock_open, Mock, MagicMock
 import json
 import os
+import tempfile
 from botocore.exceptions import ClientError
 from eventbridge_schedule import deploy_schedule
 
@@ -59,10 +60,29 @@ test_error_response = {
     }
 }
 
+LAMBDA_ARN = "arn:aws:lambda:us-east-1:123:function:job-router-test"
+
+def deployed_target(job_name):
+    """
+    Makes the target the deployment puts on the rule of a job
+    """
+    return {"Id" : "job-router-test",
+            "Arn" : LAMBDA_ARN,
+            "Input" : json.dumps(deploy_schedule.make_target_input(job_name, test_job_data[job_name]))}
+
 class TestDeploySchedule(unittest.TestCase):
     """
     Unittest class
     """
+    def setUp(self):
+        deploy_schedule.environment = "test"
+        deploy_schedule.lambda_client = None
+        deploy_schedule.events_client = None
+
+    def tearDown(self):
+        deploy_schedule.lambda_client = None
+        deploy_schedule.events_client = None
+
     def test_make_cron_expression(self):
         """
         Test the make_cron_expression function creates an expression of the correct format
@@ -86,6 +106,17 @@ class TestDeploySchedule(unittest.TestCase):
         self.assertEqual(deploy_schedule.make_schedule_expression(test_job_data["ScheduleSingleTargetJob"]),
                          "rate(95 minutes)")
 
+    def test_make_target_input(self):
+        """
+        Test that the lambda input is the job target plus the job name
+        """
+        self.assertEqual(deploy_schedule.make_target_input("CronSingleTargetJob",
+                                                           test_job_data["CronSingleTargetJob"]),
+                         {"endpoint" : "cron/job/endpoint",
+                          "service" : "cool-service",
+                          "single-target" : True,
+                          "job-name" : "CronSingleTargetJob"})
+
     @patch('builtins.open', new_callable=mock_open, read_data=json.dumps(test_job_data))
     @patch.dict(os.environ, {}, clear=True)
     def test_wrong_environment_variables(self, _mock_file):
@@ -112,5 +143,169 @@ class TestDeploySchedule(unittest.TestCase):
         with self.assertRaises(SystemExit):
             deploy_schedule.get_lambda_function()
 
+    def test_make_deploy_plan(self):
+        """
+        Test that only the rules, permissions and targets that differ from what is deployed are planned
+        """
+        existing_rules = {
+            "CronSingleTargetJob" : {"Name" : "CronSingleTargetJob", "State" : "ENABLED",
+                                     "ScheduleExpression" : "cron(1 2 * * ? *)"},
+            "ScheduleSingleTargetJob" : {"Name" : "ScheduleSingleTargetJob", "State" : "ENABLED",
+                                         "ScheduleExpression" : "rate(60 minutes)"}
+        }
+        existing_targets = {"CronSingleTargetJob" : [deployed_target("CronSingleTargetJob")],
+                            "ScheduleSingleTargetJob" : [{"Id" : "job-router-test", "Arn" : LAMBDA_ARN,
+                                                          "Input" : "{}"}]}
+        existing_permissions = {"InvokeJobRouter_CronSingleTargetJob"}
+
+        plan = deploy_schedule.make_deploy_plan(test_job_data, existing_rules, existing_targets,
+                                                existing_permissions, LAMBDA_ARN)
+        self.assertEqual(plan, {"rules" : ["ScheduleSingleTargetJob"],
+                                "permissions" : ["ScheduleSingleTargetJob"],
+                                "targets" : ["ScheduleSingleTargetJob"],
+                                "unchanged" : ["CronSingleTargetJob"]})
+
+    def test_make_deploy_plan_disabled_rule(self):
+        """
+        Test that a disabled rule is put again even when its schedule is unchanged
+        """
+        existing_rules = {"CronSingleTargetJob" : {"Name" : "CronSingleTargetJob", "State" : "DISABLED",
+                                                   "ScheduleExpression" : "cron(1 2 * * ? *)"}}
+        jobs_map = {"CronSingleTargetJob" : test_job_data["CronSingleTargetJob"]}
+        plan = deploy_schedule.make_deploy_plan(jobs_map, existing_rules,
+                                                {"CronSingleTargetJob" : [deployed_target("CronSingleTargetJob")]},
+                                                {"InvokeJobRouter_CronSingleTargetJob"}, LAMBDA_ARN)
+        self.assertEqual(plan["rules"], ["CronSingleTargetJob"])
+        self.assertEqual(plan["targets"], [])
+
+    def set_up_clients(self, rules, targets, policy_statements):
+        """
+        Sets up lambda and events clients that return the given deployed state
+        """
+        lambda_client = MagicMock()
+        lambda_client.get_function.return_value = {"Configuration" : {"FunctionArn" : LAMBDA_ARN}}
+        lambda_client.get_policy.return_value = {
+            "Policy" : json.dumps({"Statement" : [{"Sid" : sid} for sid in policy_statements]})}
+
+        events_client = MagicMock()
+        rules_paginator = MagicMock()
+        rules_paginator.paginate.return_value = [{"Rules" : rules}]
+        targets_paginator = MagicMock()
+        targets_paginator.paginate.side_effect = lambda Rule: [{"Targets" : targets.get(Rule, [])}]
+        events_client.get_paginator.side_effect = \
+            lambda name: rules_paginator if name == "list_rules" else targets_paginator
+        events_client.put_rule.side_effect = \
+            lambda Name, ScheduleExpression, State: {"RuleArn" : "arn:rule/" + Name}
+
+        deploy_schedule.lambda_client = lambda_client
+        deploy_schedule.events_client = events_client
+        return lambda_client, events_client
+
+    def test_deploy_schedules_applies_changes(self):
+        """
+        Test that only the new job is deployed and the unchanged job is left alone
+        """
+        rules = [{"Name" : "CronSingleTargetJob", "Arn" : "arn:rule/CronSingleTargetJob",
+                  "State" : "ENABLED", "ScheduleExpression" : "cron(1 2 * * ? *)"}]
+        lambda_client, events_client = self.set_up_clients(
+            rules, {"CronSingleTargetJob" : [deployed_target("CronSingleTargetJob")]},
+            ["InvokeJobRouter_CronSingleTargetJob"])
+
+        deploy_schedule.deploy_schedules(test_job_data, max_workers=2)
+
+        events_client.put_rule.assert_called_once_with(Name="ScheduleSingleTargetJob",
+                                                       ScheduleExpression="rate(95 minutes)",
+                                                       State="ENABLED")
+        lambda_client.add_permission.assert_called_once()
+        self.assertEqual(lambda_client.add_permission.call_args.kwargs["SourceArn"],
+                         "arn:rule/ScheduleSingleTargetJob")
+        events_client.put_targets.assert_called_once_with(Rule="ScheduleSingleTargetJob",
+                                                          Targets=[deployed_target("ScheduleSingleTargetJob")])
+
+    def test_deploy_schedules_dry_run(self):
+        """
+        Test that a dry run makes no changes when there is no lambda policy yet
+        """
+        lambda_client, events_client = self.set_up_clients([], {}, [])
+        lambda_client.get_policy.side_effect = ClientError(
+            {"Error" : {"Code" : "ResourceNotFoundException", "Message" : "No policy"}}, "get_policy")
+
+        plan = deploy_schedule.deploy_schedules(test_job_data, dry_run=True)
+
+        self.assertEqual(sorted(plan["rules"]), sorted(test_job_data))
+        self.assertEqual(sorted(plan["permissions"]), sorted(test_job_data))
+        events_client.put_rule.assert_not_called()
+        events_client.put_targets.assert_not_called()
+        lambda_client.add_permission.assert_not_called()
+
+    def test_firing_minutes(self):
+        """
+        Test that cron jobs are expanded over the analyzed week and interval jobs are not
+        """
+        self.assertEqual(deploy_schedule.firing_minutes(test_job_data["CronSingleTargetJob"])[:2],
+                         [2 * 60 + 1, 24 * 60 + 2 * 60 + 1])
+        self.assertEqual(len(deploy_schedule.firing_minutes(test_job_data["CronSingleTargetJob"])), 7)
+        self.assertIsNone(deploy_schedule.firing_minutes(test_job_data["ScheduleSingleTargetJob"]))
+
+        weekly_job = deploy_schedule.with_minute(test_job_data["CronSingleTargetJob"], 0)
+        weekly_job["scheduling"]["timing"].update({"day-of-month" : "?", "day-of-week" : "SUN"})
+        # The analyzed week starts on a Monday, so Sunday is its last day
+        self.assertEqual(deploy_schedule.firing_minutes(weekly_job), [6 * 24 * 60 + 2 * 60])
+
+    def test_find_overlaps_and_suggest_offsets(self):
+        """
+        Test that jobs of a service firing at the same minute are found and one of them is moved
+        """
+        hourly_job = deploy_schedule.with_minute(test_job_data["CronSingleTargetJob"], 10)
+        hourly_job["scheduling"]["timing"]["hours"] = "*"
+        other_service_job = json.loads(json.dumps(hourly_job))
+        other_service_job["target"]["service"] = "other-service"
+        jobs_map = {"FirstJob" : hourly_job, "SecondJob" : hourly_job, "OtherJob" : other_service_job}
+
+        overlaps = deploy_schedule.find_overlaps(jobs_map)
+        self.assertEqual(len(overlaps["cool-service"]), 7 * 24)
+        self.assertEqual(overlaps["cool-service"][10], ["FirstJob", "SecondJob"])
+        self.assertEqual(overlaps["other-service"], {})
+
+        offsets = deploy_schedule.suggest_offsets(jobs_map)
+        # The second job is moved half an hour away from the first
+        self.assertEqual(offsets, {"SecondJob" : 40})
+        self.assertEqual(deploy_schedule.find_overlaps(deploy_schedule.apply_offsets(jobs_map, offsets)),
+                         {"cool-service" : {}, "other-service" : {}})
+
+    def test_interval_jobs_do_not_move_cron_jobs(self):
+        """
+        Test that an interval job, whose start time is not known, is not counted as colliding
+        with a cron job
+        """
+        hourly_job = deploy_schedule.with_minute(test_job_data["CronSingleTargetJob"], 0)
+        hourly_job["scheduling"]["timing"]["hours"] = "*"
+        interval_job = json.loads(json.dumps(test_job_data["ScheduleSingleTargetJob"]))
+        interval_job["scheduling"]["timing"] = {"minutes" : 60}
+        jobs_map = {"CronJob" : hourly_job, "IntervalJob" : interval_job}
+
+        self.assertEqual(deploy_schedule.find_overlaps(jobs_map), {"cool-service" : {}})
+        self.assertEqual(deploy_schedule.suggest_offsets(jobs_map), {})
+        with patch('builtins.print') as mock_print:
+            deploy_schedule.print_schedule_analysis(jobs_map)
+        mock_print.assert_any_call("cool-service: unknown phase, not analyzed: IntervalJob")
+
+    def test_write_offsets_keeps_file_layout(self):
+        """
+        Test that staggering only changes the moved minutes of the jobs file
+        """
+        text = json.dumps(test_job_data, indent=4).replace('": ', '" : ')
+        text = text.replace('"minutes" : 1,', '"minutes" : "1",', 1)
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, "job-details.json")
+            with open(file_name, "w", encoding="UTF-8") as jobs_file:
+                jobs_file.write(text)
+
+            deploy_schedule.write_offsets(file_name, {"CronSingleTargetJob" : 31})
+
+            with open(file_name, encoding="UTF-8") as jobs_file:
+                written = jobs_file.read()
+        self.assertEqual(written, text.replace('"minutes" : "1",', '"minutes" : "31",', 1))
+
 if __name__ == '__main__':
     unittest.main()
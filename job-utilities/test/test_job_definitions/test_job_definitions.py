@@ -0,0 +1,173 @@
+"""
+Test module for unit testing job_definitions/job_definitions.py
+"""
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+from job_definitions import job_definitions
+
+def utc(*args):
+    """
+    Makes a UTC datetime
+    """
+    return datetime(*args, tzinfo=timezone.utc)
+
+def cron_timing(minutes, hours="*", day_of_month="?", month="*", day_of_week="*", year="*"):
+    """
+    Makes the timing of a cron job
+    """
+    return {"minutes" : minutes, "hours" : hours, "day-of-month" : day_of_month,
+            "month" : month, "day-of-week" : day_of_week, "year" : year}
+
+def cron_job(timing):
+    """
+    Makes a cron job with the given timing
+    """
+    return {"target" : {"endpoint" : "caches/refresh/kms", "service" : "bootstrap",
+                        "single-target" : True, "request-type" : "POST"},
+            "scheduling" : {"type" : "cron", "timing" : timing}}
+
+class TestSchedules(unittest.TestCase):
+    """
+    Unittest class
+    """
+    def test_expand_cron_field(self):
+        """
+        Test that wildcards, ranges, steps, lists and names are expanded and bad values rejected
+        """
+        self.assertEqual(job_definitions.expand_cron_field("0/20", 0, 59), [0, 20, 40])
+        self.assertEqual(job_definitions.expand_cron_field("5-7,1", 0, 23), [1, 5, 6, 7])
+        self.assertEqual(job_definitions.expand_cron_field("MON,FRI", 1, 7, job_definitions.DAY_NAMES), [2, 6])
+        with self.assertRaises(ValueError):
+            job_definitions.expand_cron_field(60, 0, 59)
+
+    def test_wildcard_hour_cron(self):
+        """
+        Test that a cron job with a wildcard hour fires every hour, not once a day
+        """
+        schedule = job_definitions.CronSchedule(cron_timing(10))
+        self.assertEqual(schedule.next_fire(utc(2025, 3, 4, 5, 9, 30)), utc(2025, 3, 4, 5, 10))
+        self.assertEqual(schedule.next_fire(utc(2025, 3, 4, 5, 10)), utc(2025, 3, 4, 6, 10))
+        self.assertEqual(schedule.next_fire(utc(2025, 12, 31, 23, 10)), utc(2026, 1, 1, 0, 10))
+
+    def test_day_and_month_cron(self):
+        """
+        Test the day of week, day of month, month and year fields
+        """
+        # 2025-03-04 is a Tuesday, the next Monday is 2025-03-10
+        mondays = job_definitions.CronSchedule(cron_timing(0, 7, day_of_week="MON"))
+        self.assertEqual(mondays.next_fire(utc(2025, 3, 4)), utc(2025, 3, 10, 7, 0))
+
+        first_of_june = job_definitions.CronSchedule(cron_timing(30, 1, day_of_month=1, month="JUN",
+                                                                  day_of_week="?"))
+        self.assertEqual(first_of_june.next_fire(utc(2025, 6, 1, 2)), utc(2026, 6, 1, 1, 30))
+
+        only_2025 = job_definitions.CronSchedule(cron_timing(0, 0, day_of_month="*", day_of_week="?",
+                                                              year=2025))
+        self.assertIsNone(only_2025.next_fire(utc(2025, 12, 31, 1)))
+
+    def test_interval_is_in_minutes(self):
+        """
+        Test that the interval is the hours and minutes of the timing
+        """
+        schedule = job_definitions.make_schedule({"scheduling" : {"type" : "interval",
+                                                                   "timing" : {"minutes" : 5, "hours" : 1}}})
+        self.assertEqual(schedule.next_fire(utc(2025, 1, 1)), utc(2025, 1, 1, 1, 5))
+
+class TestLoadJobs(unittest.TestCase):
+    """
+    Unittest class
+    """
+    def setUp(self):
+        job_definitions.cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, "job-details.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_jobs(self, jobs_map):
+        """
+        Writes the jobs file and moves its modification time so the change is seen
+        """
+        with open(self.file_name, "w", encoding="UTF-8") as jobs_file:
+            json.dump(jobs_map, jobs_file)
+        stat = os.stat(self.file_name)
+        os.utime(self.file_name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+
+    def test_repository_job_details_are_valid(self):
+        """
+        Test that the job details file in the repository loads
+        """
+        file_name = os.path.join(os.path.dirname(__file__), "..", "..", "job-details.json")
+        jobs = job_definitions.load_jobs(file_name)
+        self.assertIn("RefreshKMSCache", jobs)
+        self.assertIsInstance(jobs["RefreshKMSCache"].schedule, job_definitions.CronSchedule)
+
+    def test_invalid_jobs_are_all_reported(self):
+        """
+        Test that every problem in the file is reported at once
+        """
+        jobs_map = {
+            "MissingTarget" : {"scheduling" : {"type" : "interval", "timing" : {"minutes" : 5}}},
+            "BadMinute" : cron_job(cron_timing(75)),
+            "BothDays" : cron_job(cron_timing(0, day_of_month="*", day_of_week="*")),
+            "BadTypes" : {"target" : {"endpoint" : 5, "service" : "bootstrap", "single-target" : "yes",
+                                      "request-type" : "PATCH"},
+                          "scheduling" : {"type" : "interval", "timing" : {"minutes" : True}}},
+            "BadType" : {"target" : {"endpoint" : "e", "service" : "s"},
+                         "scheduling" : {"type" : "weekly", "timing" : {}}}
+        }
+        with self.assertRaises(job_definitions.JobDefinitionError) as context:
+            job_definitions.compile_jobs(jobs_map, services=job_definitions.known_services())
+        self.assertEqual(context.exception.errors, [
+            "MissingTarget is missing target",
+            "BadMinute.scheduling.timing is invalid: Cron field 75 is outside of 0-59",
+            "BothDays.scheduling.timing needs ? in exactly one of day-of-month and day-of-week",
+            "BadTypes.target.endpoint must be of type str",
+            "BadTypes.target.single-target must be of type bool",
+            "BadTypes.target.request-type must be one of GET, POST, PUT, DELETE",
+            "BadTypes.scheduling.timing.minutes must be of type int",
+            "BadType.target.service must be one of access-control, bootstrap, indexer, ingest, "
+            "metadata-db, search, virtual-product",
+            "BadType.scheduling.type must be cron or interval"])
+
+    def test_optional_fields_get_defaults(self):
+        """
+        Test that the compiled jobs have every optional field the programs read
+        """
+        job = cron_job(cron_timing(10))
+        del job["target"]["request-type"]
+        del job["scheduling"]["timing"]["year"]
+        details = job_definitions.compile_jobs({"Hourly" : job})["Hourly"].details
+        self.assertEqual(details["target"]["request-type"], "GET")
+        self.assertEqual(details["scheduling"]["timing"]["year"], "*")
+        self.assertNotIn("year", job["scheduling"]["timing"])
+
+    def test_load_jobs_is_cached_until_the_file_changes(self):
+        """
+        Test that an unchanged file is not parsed again
+        """
+        self.write_jobs({"Hourly" : cron_job(cron_timing(10))})
+        jobs = job_definitions.load_jobs(self.file_name)
+        self.assertIs(job_definitions.load_jobs(self.file_name), jobs)
+
+        self.write_jobs({"Hourly" : cron_job(cron_timing(20))})
+        jobs = job_definitions.load_jobs(self.file_name)
+        self.assertEqual(jobs["Hourly"].schedule.minutes, [20])
+        self.assertEqual(job_definitions.load_jobs_map(self.file_name)["Hourly"]["scheduling"]["timing"]["minutes"], 20)
+
+    def test_malformed_json(self):
+        """
+        Test that a file that is not JSON raises a JobDefinitionError
+        """
+        with open(self.file_name, "w", encoding="UTF-8") as jobs_file:
+            jobs_file.write("{")
+        with self.assertRaises(job_definitions.JobDefinitionError):
+            job_definitions.load_jobs(self.file_name)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""
+Test module for unit testing job_report/job_report.py
+"""
+import io
+import json
+import unittest
+from contextlib import redirect_stdout
+
+from job_definitions.job_definitions import compile_jobs
+from job_report import job_report
+
+test_job_data = {
+    "HourlyCronJob" : {
+        "target" : {"endpoint" : "hourly", "service" : "bootstrap"},
+        "scheduling" : {
+            "type" : "cron",
+            "timing" : {"minutes" : 10, "hours" : "*", "day-of-month" : "?",
+                        "month" : "*", "day-of-week" : "*", "year" : "*"}
+        }
+    },
+    "DailyCronJob" : {
+        "target" : {"endpoint" : "daily", "service" : "bootstrap"},
+        "scheduling" : {
+            "type" : "cron",
+            "timing" : {"minutes" : 0, "hours" : 7, "day-of-month" : "*",
+                        "month" : "*", "day-of-week" : "?", "year" : "*"}
+        }
+    },
+    "IntervalJob" : {
+        "target" : {"endpoint" : "interval", "service" : "bootstrap"},
+        "scheduling" : {"type" : "interval", "timing" : {"minutes" : 35, "hours" : 1}}
+    },
+    "EveryMinuteRangeJob" : {
+        "target" : {"endpoint" : "range", "service" : "bootstrap"},
+        "scheduling" : {
+            "type" : "cron",
+            "timing" : {"minutes" : "0-59", "hours" : "*", "day-of-month" : "?",
+                        "month" : "*", "day-of-week" : "*", "year" : "*"}
+        }
+    },
+    "HourRangeJob" : {
+        "target" : {"endpoint" : "hours", "service" : "bootstrap"},
+        "scheduling" : {
+            "type" : "cron",
+            "timing" : {"minutes" : 0, "hours" : "1-5", "day-of-month" : "?",
+                        "month" : "*", "day-of-week" : "*", "year" : "*"}
+        }
+    },
+    "MonthlyJob" : {
+        "target" : {"endpoint" : "monthly", "service" : "bootstrap"},
+        "scheduling" : {
+            "type" : "cron",
+            "timing" : {"minutes" : 0, "hours" : 0, "day-of-month" : 1,
+                        "month" : "*", "day-of-week" : "?", "year" : "*"}
+        }
+    }
+}
+test_jobs = compile_jobs(test_job_data)
+
+def job_run_line(job, duration, status="succeeded"):
+    """
+    Makes a log line like the ones the router writes
+    """
+    record = {"job": job, "status": status, "duration": duration}
+    return f"2025-01-01T00:00:00Z abc-123 {job_report.JOB_RUN_LOG_PREFIX}{json.dumps(record)}\n"
+
+class TestJobReport(unittest.TestCase):
+    """
+    Unittest class
+    """
+    def test_read_job_runs(self):
+        """
+        Test that only job run lines are read and the log prefix is ignored
+        """
+        lines = ["START RequestId: abc-123\n",
+                 job_run_line("HourlyCronJob", 12.5),
+                 "2025-01-01 JOB_RUN {not json\n"]
+        runs = job_report.read_job_runs(lines)
+        self.assertEqual(runs, [{"job": "HourlyCronJob", "status": "succeeded", "duration": 12.5}])
+
+    def test_schedule_period_minutes(self):
+        """
+        Test the time between firings of cron and interval jobs
+        """
+        self.assertEqual(job_report.schedule_period_minutes(test_jobs["HourlyCronJob"]), 60)
+        self.assertEqual(job_report.schedule_period_minutes(test_jobs["DailyCronJob"]), 1440)
+        self.assertEqual(job_report.schedule_period_minutes(test_jobs["IntervalJob"]), 95)
+        self.assertEqual(job_report.schedule_period_minutes(test_jobs["EveryMinuteRangeJob"]), 1)
+        self.assertEqual(job_report.schedule_period_minutes(test_jobs["HourRangeJob"]), 60)
+        self.assertEqual(job_report.schedule_period_minutes(test_jobs["MonthlyJob"]), 28 * 24 * 60)
+
+    def test_summarize_flags_slow_jobs(self):
+        """
+        Test the percentiles and that a job running close to its interval is flagged
+        """
+        lines = [job_run_line("HourlyCronJob", duration) for duration in range(3000, 3100)]
+        lines += [job_run_line("DailyCronJob", 60), job_run_line("DailyCronJob", 120, "failed")]
+        lines += [job_run_line("UnknownJob", 1)]
+        summaries = {summary["job"]: summary
+                     for summary in job_report.summarize(job_report.read_job_runs(lines), test_jobs, 0.8)}
+
+        hourly = summaries["HourlyCronJob"]
+        self.assertEqual(hourly["runs"], 100)
+        self.assertEqual(hourly["p50"], 3049.5)
+        self.assertAlmostEqual(hourly["p95"], 3094.05)
+        self.assertEqual(hourly["interval"], 3600)
+        self.assertTrue(hourly["slow"])
+
+        daily = summaries["DailyCronJob"]
+        self.assertEqual(daily["failures"], 1)
+        self.assertFalse(daily["slow"])
+
+        self.assertIsNone(summaries["UnknownJob"]["interval"])
+        self.assertFalse(summaries["UnknownJob"]["slow"])
+
+    def test_summarize_leaves_out_running_runs(self):
+        """
+        Test that async runs that were still running are counted but do not
+        lower the durations of the runs that finished
+        """
+        lines = [job_run_line("HourlyCronJob", 10, "running") for _ in range(20)]
+        lines += [job_run_line("HourlyCronJob", 3500), job_run_line("HourlyCronJob", 3300)]
+        lines += [job_run_line("DailyCronJob", 10, "running")]
+        summaries = {summary["job"]: summary
+                     for summary in job_report.summarize(job_report.read_job_runs(lines), test_jobs, 0.8)}
+
+        hourly = summaries["HourlyCronJob"]
+        self.assertEqual(hourly["runs"], 22)
+        self.assertEqual(hourly["running"], 20)
+        self.assertEqual(hourly["p50"], 3400)
+        self.assertEqual(hourly["max"], 3500)
+        self.assertTrue(hourly["slow"])
+
+        daily = summaries["DailyCronJob"]
+        self.assertEqual(daily["running"], 1)
+        self.assertIsNone(daily["p95"])
+        self.assertFalse(daily["slow"])
+        report = io.StringIO()
+        with redirect_stdout(report):
+            job_report.print_report(summaries.values())
+        self.assertRegex(report.getvalue(), r"DailyCronJob +1 +0 +1 +- +- +- +-")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,14 @@
 """
 Test module for unit testing job_router/lambda_function.py
 """
+import json
+import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 import os
 
+import urllib3
+
 
 from job_router import lambda_function
 
@@ -13,6 +17,12 @@ class TestLambdaFunction(unittest.TestCase):
     """
     Unittest class
     """
+    def setUp(self):
+        lambda_function.clear_caches()
+
+    def tearDown(self):
+        lambda_function.clear_caches()
+
     @patch.dict(os.environ, {}, clear=True)
     def test_cmr_environment_not_set(self, _mock_client):
         with self.assertRaises(SystemExit):
@@ -23,5 +33,321 @@ class TestLambdaFunction(unittest.TestCase):
         with self.assertRaises(SystemExit):
             lambda_function.handler({}, {})
 
+    @patch('urllib3.PoolManager')
+    @patch.dict(os.environ, {"CMR_ENVIRONMENT": "test", "CMR_LB_NAME": "cmr-lb"}, clear=True)
+    def test_warm_invocations_reuse_clients_and_lookups(self, mock_pool_manager, mock_client):
+        """
+        Test that a warm container looks up the load balancer and token once
+        and reuses the clients and the pool manager
+        """
+        aws_client = MagicMock()
+        aws_client.describe_load_balancers.return_value = {"LoadBalancers": [{"DNSName": "cmr.lb"}]}
+        aws_client.get_parameter.return_value = {"Parameter": {"Value": "token"}}
+        mock_client.return_value = aws_client
+        mock_pool_manager.return_value.request.return_value.status = 200
+
+        event = {"service": "bootstrap", "endpoint": "caches/refresh/kms", "request-type": "POST"}
+        lambda_function.handler(event, {})
+        lambda_function.handler(event, {})
+
+        self.assertEqual(aws_client.describe_load_balancers.call_count, 1)
+        self.assertEqual(aws_client.get_parameter.call_count, 1)
+        self.assertEqual(mock_client.call_count, 3)
+        mock_pool_manager.assert_called_once()
+        request = mock_pool_manager.return_value.request
+        self.assertEqual(request.call_count, 2)
+        self.assertEqual(request.call_args.args, ("POST", "cmr.lb/bootstrap/caches/refresh/kms"))
+        self.assertEqual(request.call_args.kwargs["headers"],
+                         {"Authorization": "token", "Client-Id": "cmr-job-router"})
+
+    @patch('job_router.lambda_function.time.monotonic')
+    def test_token_expires(self, mock_monotonic, mock_client):
+        """
+        Test that the token is read again once TOKEN_CACHE_TTL has passed
+        """
+        aws_client = MagicMock()
+        aws_client.get_parameter.side_effect = [{"Parameter": {"Value": "token1"}},
+                                                {"Parameter": {"Value": "token2"}}]
+        mock_client.return_value = aws_client
+
+        mock_monotonic.return_value = 1000
+        self.assertEqual(lambda_function.get_token("test", "bootstrap"), "token1")
+        mock_monotonic.return_value = 1000 + lambda_function.TOKEN_CACHE_TTL - 1
+        self.assertEqual(lambda_function.get_token("test", "bootstrap"), "token1")
+        mock_monotonic.return_value = 1000 + lambda_function.TOKEN_CACHE_TTL
+        self.assertEqual(lambda_function.get_token("test", "bootstrap"), "token2")
+
+    @patch('job_router.lambda_function.send_request_to_targets')
+    @patch('job_router.lambda_function.get_task_ips')
+    @patch.dict(os.environ, {"CMR_ENVIRONMENT": "test", "CMR_LB_NAME": "cmr-lb"}, clear=True)
+    def test_rotated_token_is_read_again(self, mock_get_task_ips, mock_send_request_to_targets, mock_client):
+        """
+        Test that a cached token refused with 401 is dropped, read again and
+        used to resend only the refused targets
+        """
+        aws_client = MagicMock()
+        aws_client.describe_load_balancers.return_value = {"LoadBalancers": [{"DNSName": "cmr.lb"}]}
+        aws_client.get_parameter.side_effect = [{"Parameter": {"Value": "old-token"}},
+                                                {"Parameter": {"Value": "new-token"}}]
+        mock_client.return_value = aws_client
+        mock_get_task_ips.return_value = ["ip1", "ip2"]
+
+        def send_request_to_targets(request_type, token, urls, timeout, fire_and_forget):
+            return [{"url": url, "status": "succeeded" if token == "new-token" or url.startswith("ip2") else "failed",
+                     "http-status": 200 if token == "new-token" or url.startswith("ip2") else 401,
+                     "duration": 0.1}
+                    for url in urls]
+        mock_send_request_to_targets.side_effect = send_request_to_targets
+
+        event = {"service": "search", "endpoint": "endpoint", "single-target": False}
+        summary = lambda_function.handler(event, {})
+
+        self.assertEqual(summary["status"], "succeeded")
+        self.assertEqual(aws_client.get_parameter.call_count, 2)
+        self.assertEqual(mock_send_request_to_targets.call_args.kwargs["urls"], ["ip1/search/endpoint"])
+        self.assertEqual(lambda_function.get_token("test", "search"), "new-token")
+
+    def test_get_task_ips_pages_and_batches(self, _mock_client):
+        """
+        Test that all pages of list_tasks are read and describe_tasks is
+        called with at most 100 tasks at a time
+        """
+        ecs_client = MagicMock()
+        ecs_client.get_paginator.return_value.paginate.return_value = [
+            {"taskArns": [f"task{index}" for index in range(100)]},
+            {"taskArns": ["task100"]}]
+
+        def describe_tasks(cluster, tasks):
+            return {"tasks": [{"attachments": [{"details": [
+                {"name": "subnetId", "value": "subnet"},
+                {"name": "privateIPv4Address", "value": f"ip-{task}"}]}]} for task in tasks]}
+        ecs_client.describe_tasks.side_effect = describe_tasks
+
+        task_ips = lambda_function.get_task_ips(ecs_client, "test", "search")
+
+        ecs_client.get_paginator.return_value.paginate.assert_called_once_with(
+            cluster="cmr-service-test", serviceName="search-test")
+        self.assertEqual(ecs_client.describe_tasks.call_count, 2)
+        self.assertEqual(len(task_ips), 101)
+        self.assertEqual(task_ips[-1], "ip-task100")
+
+    @patch('job_router.lambda_function.send_request')
+    @patch.dict(os.environ, {"ROUTER_MAX_WORKERS": "4", "TARGET_TIMEOUT": "5"}, clear=True)
+    def test_send_request_to_targets_runs_concurrently(self, mock_send_request, _mock_client):
+        """
+        Test that the targets are called at the same time and a failing
+        target does not stop the others
+        """
+        def send_request(request_type, token, url, timeout):
+            time.sleep(0.2)
+            if url == "ip2/search/endpoint":
+                raise Exception("connection refused")
+            return MagicMock(status=200)
+        mock_send_request.side_effect = send_request
+
+        urls = [f"ip{index}/search/endpoint" for index in range(4)]
+        start = time.monotonic()
+        results = lambda_function.send_request_to_targets("POST", "token", urls)
+
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual([result["url"] for result in results], urls)
+        self.assertEqual([result["status"] for result in results],
+                         ["succeeded", "succeeded", "failed", "succeeded"])
+        self.assertEqual(mock_send_request.call_args.kwargs["timeout"], 5)
+
+    @patch('job_router.lambda_function.send_request_to_targets')
+    @patch('job_router.lambda_function.get_task_ips')
+    @patch.dict(os.environ, {"CMR_ENVIRONMENT": "test", "CMR_LB_NAME": "cmr-lb"}, clear=True)
+    def test_multi_target_partial_failure(self, mock_get_task_ips, mock_send_request_to_targets, mock_client):
+        """
+        Test that a failing target is reported in the summary and fails the
+        invocation once every target has answered
+        """
+        mock_client.return_value.get_parameter.return_value = {"Parameter": {"Value": "token"}}
+        mock_get_task_ips.return_value = ["ip1", "ip2"]
+        mock_send_request_to_targets.return_value = [
+            {"url": "ip1/search/endpoint", "status": "succeeded", "duration": 1.0},
+            {"url": "ip2/search/endpoint", "status": "failed", "duration": 1.0}]
+
+        event = {"service": "search", "endpoint": "endpoint", "single-target": False}
+        with self.assertRaises(lambda_function.JobFailedError) as context:
+            lambda_function.handler(event, {})
+        summary = context.exception.summary
+
+        mock_send_request_to_targets.assert_called_once_with(
+            request_type="GET", token="token",
+            urls=["ip1/search/endpoint", "ip2/search/endpoint"],
+            timeout=None, fire_and_forget=False)
+        self.assertEqual(summary["status"], "partial")
+        self.assertEqual(summary["succeeded"], 1)
+        self.assertEqual(summary["failed"], 1)
+        self.assertEqual(summary["targets"], mock_send_request_to_targets.return_value)
+
+    @patch('job_router.lambda_function.send_request_to_target')
+    @patch.dict(os.environ, {"CMR_ENVIRONMENT": "test", "CMR_LB_NAME": "cmr-lb"}, clear=True)
+    def test_job_timeout(self, mock_send_request_to_target, mock_client):
+        """
+        Test that the timeout of the job target is used for its request
+        """
+        mock_client.return_value.describe_load_balancers.return_value = {"LoadBalancers": [{"DNSName": "cmr.lb"}]}
+        mock_client.return_value.get_parameter.return_value = {"Parameter": {"Value": "token"}}
+        mock_send_request_to_target.return_value = {"url": "cmr.lb/bootstrap/caches/refresh/kms",
+                                                    "status": "succeeded", "duration": 1.0}
+
+        event = {"service": "bootstrap", "endpoint": "caches/refresh/kms", "timeout": 1200}
+        lambda_function.handler(event, {})
+
+        self.assertEqual(mock_send_request_to_target.call_args.kwargs["timeout"], 1200)
+
+    @patch('builtins.print')
+    @patch('job_router.lambda_function.send_request_to_target')
+    @patch.dict(os.environ, {"CMR_ENVIRONMENT": "test", "CMR_LB_NAME": "cmr-lb"}, clear=True)
+    def test_failed_job_fails_invocation(self, mock_send_request_to_target, mock_print, mock_client):
+        """
+        Test that a job that failed on every target fails the invocation
+        after its summary and job run line are logged
+        """
+        mock_client.return_value.describe_load_balancers.return_value = {"LoadBalancers": [{"DNSName": "cmr.lb"}]}
+        mock_client.return_value.get_parameter.return_value = {"Parameter": {"Value": "token"}}
+        mock_send_request_to_target.return_value = {"url": "cmr.lb/bootstrap/caches/refresh/kms",
+                                                    "status": "failed", "http-status": 500, "duration": 1.0}
+
+        event = {"service": "bootstrap", "endpoint": "caches/refresh/kms", "request-type": "POST"}
+        with self.assertRaises(lambda_function.JobFailedError) as context:
+            lambda_function.handler(event, {})
+
+        self.assertEqual(context.exception.summary["status"], "failed")
+        self.assertEqual(context.exception.summary["failed"], 1)
+        logged = [call.args[0] for call in mock_print.call_args_list
+                  if call.args and str(call.args[0]).startswith(lambda_function.JOB_RUN_LOG_PREFIX)]
+        self.assertEqual(json.loads(logged[0][len(lambda_function.JOB_RUN_LOG_PREFIX):])["status"], "failed")
+
+    @patch('job_router.lambda_function.send_request')
+    def test_send_request_to_target(self, mock_send_request, _mock_client):
+        """
+        Test the outcome of a target that answered, failed and raised
+        """
+        response = MagicMock(status=200, reason="OK")
+        response.retries.history = ("first attempt",)
+        mock_send_request.return_value = response
+        result = lambda_function.send_request_to_target("POST", "token", "ip1/search/endpoint")
+        self.assertEqual(result["status"], "succeeded")
+        self.assertEqual(result["http-status"], 200)
+        self.assertEqual(result["attempts"], 2)
+
+        mock_send_request.return_value = MagicMock(status=500, reason="Internal Server Error")
+        result = lambda_function.send_request_to_target("POST", "token", "ip1/search/endpoint")
+        self.assertEqual(result["status"], "failed")
+        self.assertEqual(result["error"], "500 reason: Internal Server Error")
+
+        mock_send_request.side_effect = Exception("connection refused")
+        result = lambda_function.send_request_to_target("POST", "token", "ip1/search/endpoint")
+        self.assertEqual(result["status"], "failed")
+        self.assertIsNone(result["http-status"])
+        self.assertEqual(result["error"], "connection refused")
+
+    @patch('urllib3.PoolManager')
+    @patch.dict(os.environ, {"ROUTER_RETRIES": "3"}, clear=True)
+    def test_send_request_retries_transient_errors(self, mock_pool_manager, _mock_client):
+        """
+        Test that send_request returns the response with a retry policy
+        for transient errors instead of exiting
+        """
+        mock_pool_manager.return_value.request.return_value.status = 503
+
+        response = lambda_function.send_request("POST", "token", "ip1/search/endpoint")
+
+        self.assertEqual(response.status, 503)
+        retries = mock_pool_manager.return_value.request.call_args.kwargs["retries"]
+        self.assertEqual(retries.total, 3)
+        self.assertEqual(retries.read, 0)
+        self.assertIn(503, retries.status_forcelist)
+        self.assertTrue(retries.is_retry("POST", 503))
+        timeout = mock_pool_manager.return_value.request.call_args.kwargs["timeout"]
+        self.assertEqual(timeout.connect_timeout, lambda_function.CONNECT_TIMEOUT)
+        self.assertEqual(timeout.read_timeout, 300)
+
+    def test_retry_policy_does_not_repeat_jobs(self, _mock_client):
+        """
+        Test that a POST that may have reached the node is not sent again
+        while a GET is retried on every transient response
+        """
+        post = lambda_function.get_retry_policy("POST")
+        self.assertFalse(post.is_retry("POST", 504))
+        self.assertFalse(post.is_retry("POST", 502))
+        self.assertTrue(post.is_retry("POST", 429))
+        self.assertEqual(post.other, 0)
+        get = lambda_function.get_retry_policy("GET")
+        self.assertTrue(get.is_retry("GET", 504))
+        self.assertTrue(get.is_retry("GET", 502))
+
+    def test_make_summary(self, _mock_client):
+        """
+        Test the summary status for all, some and no successful targets
+        """
+        succeeded = {"status": "succeeded"}
+        failed = {"status": "failed"}
+        event = {"service": "search", "endpoint": "endpoint"}
+        self.assertEqual(lambda_function.make_summary(event, [succeeded, succeeded])["status"], "succeeded")
+        self.assertEqual(lambda_function.make_summary(event, [succeeded, failed])["status"], "partial")
+        self.assertEqual(lambda_function.make_summary(event, [failed])["status"], "failed")
+        self.assertEqual(lambda_function.make_summary(event, [])["status"], "failed")
+
+    @patch('job_router.lambda_function.send_request')
+    def test_fire_and_forget_read_timeout_is_running(self, mock_send_request, _mock_client):
+        """
+        Test that a read timeout in async mode means the target is still running
+        """
+        mock_send_request.side_effect = urllib3.exceptions.MaxRetryError(
+            None, "ip1/bootstrap/endpoint",
+            urllib3.exceptions.ReadTimeoutError(None, "ip1/bootstrap/endpoint", "Read timed out."))
+
+        result = lambda_function.send_request_to_target("POST", "token", "ip1/bootstrap/endpoint",
+                                                        timeout=10, fire_and_forget=True)
+        self.assertEqual(result["status"], "running")
+
+        result = lambda_function.send_request_to_target("POST", "token", "ip1/bootstrap/endpoint",
+                                                        timeout=10)
+        self.assertEqual(result["status"], "failed")
+
+    @patch('job_router.lambda_function.send_request_to_target')
+    @patch.dict(os.environ, {"CMR_ENVIRONMENT": "test", "CMR_LB_NAME": "cmr-lb"}, clear=True)
+    def test_async_route_returns_running(self, mock_send_request_to_target, mock_client):
+        """
+        Test that an async request only waits the trigger timeout and reports the job as running
+        """
+        mock_client.return_value.describe_load_balancers.return_value = {"LoadBalancers": [{"DNSName": "cmr.lb"}]}
+        mock_client.return_value.get_parameter.return_value = {"Parameter": {"Value": "token"}}
+        mock_send_request_to_target.return_value = {"url": "cmr.lb/bootstrap/caches/refresh/granule-counts-cache",
+                                                    "status": "running", "duration": 5.0}
+
+        event = {"service": "bootstrap", "endpoint": "caches/refresh/granule-counts-cache",
+                 "request-type": "POST", "async": True, "trigger-timeout": 0.5}
+        summary = lambda_function.handler(event, {})
+
+        self.assertEqual(mock_send_request_to_target.call_args.kwargs["timeout"], 0.5)
+        self.assertTrue(mock_send_request_to_target.call_args.kwargs["fire_and_forget"])
+        self.assertEqual(summary["status"], "running")
+        self.assertEqual(summary["running"], 1)
+
+    @patch('builtins.print')
+    def test_log_job_run(self, mock_print, _mock_client):
+        """
+        Test the structured job run line
+        """
+        event = {"job-name": "RefreshKMSCache", "service": "bootstrap", "endpoint": "caches/refresh/kms"}
+        summary = {"status": "succeeded",
+                   "targets": [{"payload-size": 10}, {"payload-size": 5}]}
+
+        record = lambda_function.log_job_run(event, summary, 1.23456)
+
+        self.assertEqual(record["job"], "RefreshKMSCache")
+        self.assertEqual(record["duration"], 1.235)
+        self.assertEqual(record["payload-size"], 15)
+        self.assertEqual(record["targets"], 2)
+        line = mock_print.call_args.args[0]
+        self.assertTrue(line.startswith(lambda_function.JOB_RUN_LOG_PREFIX))
+        self.assertEqual(json.loads(line[len(lambda_function.JOB_RUN_LOG_PREFIX):]), record)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,139 @@
+"""
+Test module for unit testing local_development/scheduler_engine.py
+"""
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from job_definitions import job_definitions
+from local_development import scheduler_engine
+
+def utc(*args):
+    """
+    Makes a UTC datetime
+    """
+    return datetime(*args, tzinfo=timezone.utc)
+
+def cron_timing(minutes, hours="*", day_of_month="?", month="*", day_of_week="*", year="*"):
+    """
+    Makes the timing of a cron job
+    """
+    return {"minutes" : minutes, "hours" : hours, "day-of-month" : day_of_month,
+            "month" : month, "day-of-week" : day_of_week, "year" : year}
+
+class FakeClock:
+    """
+    A clock that only moves when told to
+    """
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class TestSchedulerEngine(unittest.TestCase):
+    """
+    Unittest class
+    """
+    def test_run_pending(self):
+        """
+        Test that due jobs are called in fire time order and rescheduled without catching up
+        """
+        clock = FakeClock(utc(2025, 1, 1, 0, 0))
+        engine = scheduler_engine.SchedulerEngine(clock=clock)
+        called = []
+        engine.add("Hourly", job_definitions.CronSchedule(cron_timing(10)), called.append)
+        engine.add("Interval", job_definitions.IntervalSchedule({"minutes" : 5}), called.append)
+        self.assertEqual(engine.next_fire_time(), utc(2025, 1, 1, 0, 5))
+
+        self.assertEqual(engine.run_pending(), [])
+        clock.now = utc(2025, 1, 1, 0, 12)
+        self.assertEqual(engine.run_pending(), ["Interval", "Hourly"])
+        # The interval job missed its 00:10 firing and is due next at 00:15
+        self.assertEqual(engine.next_fire_time(), utc(2025, 1, 1, 0, 15))
+
+    def test_run_sleeps_until_due(self):
+        """
+        Test that run waits for the next fire time and returns once stopped
+        """
+        clock = FakeClock(utc(2025, 1, 1))
+        engine = scheduler_engine.SchedulerEngine(clock=clock)
+        waits = []
+
+        def wait(delay):
+            waits.append(delay)
+            clock.now += timedelta(seconds=delay)
+            return len(waits) > 1
+
+        engine.stopped.wait = wait
+        called = []
+        engine.add("Interval", job_definitions.IntervalSchedule({"minutes" : 5}), called.append)
+        engine.run()
+        self.assertEqual(waits, [300, 300])
+        self.assertEqual(called, ["Interval"])
+
+class TestJobRunner(unittest.TestCase):
+    """
+    Unittest class
+    """
+    def setUp(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def slow_job(self, result):
+        """
+        A job that runs until the test releases it
+        """
+        self.started.set()
+        self.release.wait(5)
+        return result
+
+    def test_slow_job_does_not_block_others(self):
+        """
+        Test that a job runs while a slow job is still running
+        """
+        runner = scheduler_engine.JobRunner(max_workers=2)
+        slow = runner.submit("Slow", self.slow_job, "slow")
+        self.assertTrue(self.started.wait(5))
+        fast = runner.submit("Fast", lambda: "fast")
+        self.assertEqual(fast.result(timeout=5), "fast")
+        self.assertFalse(slow.done())
+        self.release.set()
+        self.assertEqual(slow.result(timeout=5), "slow")
+        runner.shutdown()
+
+    def test_no_overlap(self):
+        """
+        Test that a job still running from its previous firing is skipped unless overlap is allowed
+        """
+        runner = scheduler_engine.JobRunner(max_workers=2)
+        first = runner.submit("Slow", self.slow_job, 1)
+        self.assertTrue(self.started.wait(5))
+        with self.assertLogs(scheduler_engine.logger, level="WARNING"):
+            self.assertIsNone(runner.submit("Slow", self.slow_job, 2))
+        self.release.set()
+        first.result(timeout=5)
+        runner.shutdown()
+        self.assertFalse(runner.is_running("Slow"))
+
+        overlapping_runner = scheduler_engine.JobRunner(max_workers=2, allow_overlap=True)
+        futures = [overlapping_runner.submit("Slow", self.slow_job, run) for run in (1, 2)]
+        self.assertEqual([future.result(timeout=5) for future in futures], [1, 2])
+        overlapping_runner.shutdown()
+
+    def test_failed_job_is_finished(self):
+        """
+        Test that a job that raises is logged and no longer counted as running
+        """
+        def failing_job():
+            raise RuntimeError("boom")
+
+        runner = scheduler_engine.JobRunner(max_workers=1)
+        with self.assertLogs(scheduler_engine.logger, level="ERROR"):
+            future = runner.submit("Failing", failing_job)
+            runner.shutdown()
+        self.assertIsInstance(future.exception(), RuntimeError)
+        self.assertFalse(runner.is_running("Failing"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,17 +2,25 @@
   "Namespace to test embedded redis server"
   (:require
    [cmr.common.lifecycle :as lifecycle]
+   [cmr.redis-utils.config :as redis-config]
    [cmr.redis-utils.embedded-redis-server :as embedded-redis-server]
    [taoensso.carmine :as carmine :refer [wcar]]))
 
+(defn- test-conn-opts
+  "Connection to the configured redis port, which the unit test runner sets to a
+  private port for modules that run in parallel with other redis users."
+  []
+  {:spec {:host (redis-config/redis-host)
+          :port (redis-config/redis-port)}})
+
 (defn embedded-redis-server-fixture
   [f]
   (try
     ;; Check if server is already running.
-    (wcar {} (carmine/ping))
+    (wcar (test-conn-opts) (carmine/ping))
     (f)
     (catch Exception _
-      (let [redis-server (embedded-redis-server/create-redis-server)
+      (let [redis-server (embedded-redis-server/create-redis-server (redis-config/redis-port))
             started-redis-server (lifecycle/start redis-server nil)]
         (f)
         (lifecycle/stop started-redis-server nil)))))
@@ -20,5 +28,5 @@
 
 (defn reset-redis-fixture
   [f]
-  (wcar {} (carmine/flushall))
+  (wcar (test-conn-opts) (carmine/flushall))
   (f))
@@ -0,0 +1,147 @@
+"""
+Validate a large set of metadata records against one schema version before
+ingest. Records are read from newline delimited JSON files (.ndjson, .jsonl or
+standard input) or from directory trees of .json files, one record per file.
+They are streamed in chunks to a process pool, with a bounded number of chunks
+in flight, so memory use does not grow with the number of records. Every invalid
+record is written as one JSON line to the report, for example:
+
+  {"source": "records.ndjson", "line": 12, "errors": [{"path": "Name", "message": "..."}]}
+
+Usage, from this directory:
+
+  python3 bulk_validate.py grid/v0.0.1 records.ndjson more-records/ --report errors.ndjson
+  cat records.ndjson | python3 bulk_validate.py visualization/v1.1.0 -
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+from schema_registry import SchemaRegistry
+
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+
+# The validator of the worker process, set by start_worker
+validator = None
+
+def start_worker(schema_file):
+  "Compile the schema once in each worker process"
+  global validator # pylint: disable=global-statement
+  validator = SchemaRegistry().validator(schema_file)
+
+def read_records(inputs):
+  """Yield (source, line, text) for every record of the inputs. line is the line
+  number in a newline delimited file and None for a record read from a .json file."""
+  for name in inputs:
+    if name == "-":
+      for line, text in enumerate(sys.stdin, 1):
+        if text.strip():
+          yield ("-", line, text)
+    elif os.path.isdir(name):
+      for directory, directories, files in os.walk(name):
+        directories.sort()
+        for file_name in sorted(files):
+          path = os.path.join(directory, file_name)
+          if file_name.endswith(NDJSON_EXTENSIONS):
+            yield from read_records([path])
+          elif file_name.endswith(".json"):
+            with open(path, encoding="utf-8") as file:
+              yield (path, None, file.read())
+    elif name.endswith(".json"):
+      with open(name, encoding="utf-8") as file:
+        yield (name, None, file.read())
+    else:
+      with open(name, encoding="utf-8") as file:
+        for line, text in enumerate(file, 1):
+          if text.strip():
+            yield (name, line, text)
+
+def validate_chunk(chunk):
+  "Validate a chunk of records, returning the number checked and the failures"
+  failures = []
+  for source, line, text in chunk:
+    try:
+      record = json.loads(text)
+    except ValueError as e:
+      failures.append({"source": source, "line": line, "errors": [{"path": "", "message": f"Invalid JSON: {e}"}]})
+      continue
+    errors = [{"path": "/".join(str(p) for p in e.absolute_path), "message": e.message}
+              for e in validator.iter_errors(record)]
+    if errors:
+      failures.append({"source": source, "line": line, "errors": errors})
+  return len(chunk), failures
+
+def chunks(records, size):
+  "Split the records into lists of at most size records"
+  records = iter(records)
+  while True:
+    chunk = list(islice(records, size))
+    if not chunk:
+      return
+    yield chunk
+
+def bounded_map(executor, function, items, in_flight):
+  """Run function on every item in the executor with at most in_flight items
+  submitted and not yet done, yielding the results as they complete, so the
+  items are not all read into memory up front"""
+  pending = set()
+  for item in items:
+    pending.add(executor.submit(function, item))
+    while len(pending) >= in_flight:
+      done, pending = wait(pending, return_when=FIRST_COMPLETED)
+      for future in done:
+        yield future.result()
+  for future in pending:
+    yield future.result()
+
+def bulk_validate(schema_file, inputs, report, workers=None, chunk_size=500):
+  """Validate every record of the inputs, writing each failure to report as it
+  is found. Returns the number of records and the number of invalid records."""
+  workers = workers or os.cpu_count() or 1
+  total = 0
+  invalid = 0
+  with ProcessPoolExecutor(max_workers=workers, initializer=start_worker,
+                           initargs=(schema_file,)) as executor:
+    # Keep at most two chunks per worker in flight
+    for count, failures in bounded_map(executor, validate_chunk, chunks(read_records(inputs), chunk_size),
+                                       workers * 2):
+      total, invalid = total + count, invalid + len(failures)
+      for failure in failures:
+        report.write(json.dumps(failure) + "\n")
+  return total, invalid
+
+def main():
+  parser = argparse.ArgumentParser(description="Validate many metadata records against a schema version")
+  parser.add_argument("version", help="Version directory with the schema.json, for example grid/v0.0.1")
+  parser.add_argument("inputs", nargs="+",
+                      help="Newline delimited JSON files, .json files, directories or - for standard input")
+  parser.add_argument("--report", default="-", help="File the failures are written to, standard output by default")
+  parser.add_argument("--workers", type=int, default=None, help="Number of processes, defaults to the number of CPUs")
+  parser.add_argument("--chunk-size", type=int, default=500, help="Number of records sent to a process at a time")
+  args = parser.parse_args()
+
+  schema_file = os.path.join(args.version, "schema.json")
+  if not os.path.exists(schema_file):
+    print(f"{schema_file} does not exist", file=sys.stderr)
+    sys.exit(2)
+
+  start = time.perf_counter()
+  report = sys.stdout if args.report == "-" else open(args.report, "w", encoding="utf-8")
+  try:
+    total, invalid = bulk_validate(schema_file, args.inputs, report, args.workers, args.chunk_size)
+  finally:
+    if report is not sys.stdout:
+      report.close()
+  seconds = time.perf_counter() - start
+  print(f"Validated {total} records in {seconds:.2f} seconds ({total / max(seconds, 1e-9):.0f} records/s), "
+        f"{invalid} invalid", file=sys.stderr)
+  if invalid:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
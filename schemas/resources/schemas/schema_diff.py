@@ -0,0 +1,230 @@
+"""
+Compare two versions of a schema to find out whether records valid against
+the old version stay valid against the new one. The schemas are walked
+together, following their $refs, and every difference that can reject an old
+record is reported as breaking: a newly required field, a removed field that
+is no longer allowed, a narrowed type, removed enum values or tighter limits.
+Differences inside oneOf, anyOf and if/then/else are not walked, so a sample
+corpus of records can also be replayed through both compiled validators in a
+process pool to flag the records that would break.
+
+Usage, from this directory:
+
+  python3 schema_diff.py visualization/v1.0.0 visualization/v1.1.0
+  python3 schema_diff.py visualization/v1.0.0 visualization/v1.1.0 --corpus records.ndjson --json
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from referencing import Registry, Resource
+from referencing.jsonschema import DRAFT7
+
+from bulk_validate import bounded_map, chunks, read_records
+from schema_registry import SchemaRegistry
+
+# Keywords whose larger value accepts less
+LOWER_BOUNDS = ("minimum", "exclusiveMinimum", "minLength", "minItems", "minProperties")
+# Keywords whose smaller value accepts less
+UPPER_BOUNDS = ("maximum", "exclusiveMaximum", "maxLength", "maxItems", "maxProperties")
+# How many levels of nested objects are compared
+MAX_DEPTH = 40
+
+class SchemaWalker:
+  "Resolves the $refs of a schema bundle from schema_registry"
+
+  def __init__(self, bundle):
+    self.root = bundle["resources"][bundle["root"]]
+    self.registry = Registry().with_resources(
+      (uri, Resource.from_contents(contents, default_specification=DRAFT7))
+      for uri, contents in bundle["resources"].items()).crawl()
+    self.resolver = self.registry.resolver(bundle["root"])
+
+  def resolve(self, node, resolver):
+    """Follow $refs and merge allOf, returning the schema and the resolver for
+    the references in it"""
+    seen = set()
+    while isinstance(node, dict) and "$ref" in node and node["$ref"] not in seen:
+      seen.add(node["$ref"])
+      resolved = resolver.lookup(node["$ref"])
+      node, resolver = resolved.contents, resolved.resolver
+    if isinstance(node, dict) and "allOf" in node:
+      merged = {key: value for key, value in node.items() if key != "allOf"}
+      for part in node["allOf"]:
+        part, _ = self.resolve(part, resolver)
+        if not isinstance(part, dict):
+          continue
+        merged.setdefault("properties", {})
+        merged["properties"] = dict(part.get("properties", {}), **merged["properties"])
+        merged["required"] = sorted(set(merged.get("required", [])) | set(part.get("required", [])))
+        for key, value in part.items():
+          merged.setdefault(key, value)
+      node = merged
+    return node, resolver
+
+def types_of(schema):
+  "The set of JSON types a schema allows, None when it does not say"
+  if "type" not in schema:
+    return None
+  types = set(schema["type"] if isinstance(schema["type"], list) else [schema["type"]])
+  if "number" in types:
+    types.add("integer")
+  return types
+
+def diff_schemas(old_walker, new_walker):
+  "Walk both schemas together, returning the list of differences"
+  changes = []
+
+  def change(path, kind, message, breaking):
+    changes.append({"path": "/".join(path) or "(root)", "kind": kind, "message": message, "breaking": breaking})
+
+  def walk(old, old_resolver, new, new_resolver, path, seen):
+    old, old_resolver = old_walker.resolve(old, old_resolver)
+    new, new_resolver = new_walker.resolve(new, new_resolver)
+    if not isinstance(old, dict) or not isinstance(new, dict) or len(path) > MAX_DEPTH:
+      return
+    key = (id(old), id(new))
+    if key in seen:
+      return
+    seen = seen | {key}
+
+    old_types, new_types = types_of(old), types_of(new)
+    if new_types is not None and (old_types is None or not old_types <= new_types):
+      removed = sorted((old_types or {"any"}) - new_types)
+      change(path, "type", f"type narrowed, {', '.join(removed)} no longer allowed", True)
+    elif old_types is not None and (new_types is None or new_types > old_types):
+      change(path, "type", "type widened", False)
+
+    if "enum" in new and new.get("enum") != old.get("enum"):
+      if "enum" not in old:
+        change(path, "enum", "enum added", True)
+      else:
+        removed = [value for value in old["enum"] if value not in new["enum"]]
+        added = [value for value in new["enum"] if value not in old["enum"]]
+        if removed:
+          change(path, "enum", f"enum values removed: {json.dumps(removed)}", True)
+        if added:
+          change(path, "enum", f"enum values added: {json.dumps(added)}", False)
+    if "const" in new and new.get("const") != old.get("const"):
+      change(path, "const", f"const is now {json.dumps(new['const'])}", True)
+
+    for bound in LOWER_BOUNDS + UPPER_BOUNDS:
+      if bound in new and new.get(bound) != old.get(bound):
+        tighter = bound not in old or (new[bound] > old[bound] if bound in LOWER_BOUNDS else new[bound] < old[bound])
+        change(path, bound, f"{bound} changed from {old.get(bound)} to {new[bound]}", tighter)
+    if "pattern" in new and new.get("pattern") != old.get("pattern"):
+      change(path, "pattern", f"pattern changed to {new['pattern']}", True)
+
+    old_required, new_required = set(old.get("required", [])), set(new.get("required", []))
+    for field in sorted(new_required - old_required):
+      change(path + [field], "required", "field is now required", True)
+    for field in sorted(old_required - new_required):
+      change(path + [field], "required", "field is no longer required", False)
+
+    old_properties, new_properties = old.get("properties", {}), new.get("properties", {})
+    closed = new.get("additionalProperties") is False
+    if closed and old.get("additionalProperties") is not False:
+      change(path, "additionalProperties", "additional properties are no longer allowed", True)
+    for field in sorted(set(old_properties) - set(new_properties)):
+      change(path + [field], "property", "field removed", closed)
+    for field in sorted(set(new_properties) - set(old_properties)):
+      change(path + [field], "property", "field added", False)
+    for field in sorted(set(old_properties) & set(new_properties)):
+      walk(old_properties[field], old_resolver, new_properties[field], new_resolver, path + [field], seen)
+    if isinstance(old.get("items"), dict) and isinstance(new.get("items"), dict):
+      walk(old["items"], old_resolver, new["items"], new_resolver, path + ["[]"], seen)
+
+  walk(old_walker.root, old_walker.resolver, new_walker.root, new_walker.resolver, [], frozenset())
+  return changes
+
+# The validators of the worker process, set by start_worker
+validators = None
+
+def start_worker(old_schema, new_schema):
+  "Compile both schemas once in each worker process"
+  global validators # pylint: disable=global-statement
+  registry = SchemaRegistry()
+  validators = (registry.validator(old_schema), registry.validator(new_schema))
+
+def replay_chunk(chunk):
+  """Validate a chunk of records with both versions, returning the counts of
+  records valid with each, the records that only the old version accepts and
+  the records that are not JSON"""
+  old_valid = new_valid = 0
+  broken = []
+  unreadable = []
+  for source, line, text in chunk:
+    try:
+      record = json.loads(text)
+    except ValueError as e:
+      unreadable.append({"source": source, "line": line, "errors": [f"Invalid JSON: {e}"]})
+      continue
+    old_ok = validators[0].is_valid(record)
+    new_errors = [f"{'/'.join(str(p) for p in e.absolute_path) or '(root)'}: {e.message}"
+                  for e in validators[1].iter_errors(record)]
+    old_valid += old_ok
+    new_valid += not new_errors
+    if old_ok and new_errors:
+      broken.append({"source": source, "line": line, "errors": new_errors})
+  return len(chunk), old_valid, new_valid, broken, unreadable
+
+def replay(old_schema, new_schema, inputs, workers=None, chunk_size=200):
+  """Replay the records of the inputs through both schemas in a process pool,
+  with at most two chunks per worker in flight"""
+  workers = workers or os.cpu_count() or 1
+  summary = {"records": 0, "old_valid": 0, "new_valid": 0, "broken": [], "unreadable": []}
+  with ProcessPoolExecutor(max_workers=workers, initializer=start_worker,
+                           initargs=(old_schema, new_schema)) as executor:
+    for count, old_valid, new_valid, broken, unreadable in bounded_map(
+        executor, replay_chunk, chunks(read_records(inputs), chunk_size), workers * 2):
+      summary["records"] += count
+      summary["old_valid"] += old_valid
+      summary["new_valid"] += new_valid
+      summary["broken"].extend(broken)
+      summary["unreadable"].extend(unreadable)
+  for key in ("broken", "unreadable"):
+    summary[key].sort(key=lambda record: (record["source"], record["line"] or 0))
+  return summary
+
+def print_report(changes, summary):
+  "Print the differences and the replay summary, breaking changes first"
+  for item in sorted(changes, key=lambda item: not item["breaking"]):
+    print(f"{'BREAKING' if item['breaking'] else 'ok':<8} {item['path']}: {item['message']}")
+  if not changes:
+    print("No structural differences")
+  if summary is not None:
+    print(f"\nReplayed {summary['records']} records: {summary['old_valid']} valid with the old version, "
+          f"{summary['new_valid']} with the new one, {len(summary['broken'])} would break, "
+          f"{len(summary['unreadable'])} are not valid JSON")
+    for record in summary["broken"] + summary["unreadable"]:
+      location = record["source"] if record["line"] is None else f"{record['source']}:{record['line']}"
+      print(f"  {location}: {'; '.join(record['errors'])}")
+
+def main():
+  parser = argparse.ArgumentParser(description="Compare two versions of a schema")
+  parser.add_argument("old", help="Old version directory, for example visualization/v1.0.0")
+  parser.add_argument("new", help="New version directory, for example visualization/v1.1.0")
+  parser.add_argument("--corpus", nargs="*", default=[],
+                      help="Records to replay: newline delimited JSON files, .json files or directories")
+  parser.add_argument("--workers", type=int, default=None, help="Number of processes, defaults to the number of CPUs")
+  parser.add_argument("--json", action="store_true", help="Print the differences and replay as JSON")
+  args = parser.parse_args()
+
+  old_schema = os.path.join(args.old, "schema.json")
+  new_schema = os.path.join(args.new, "schema.json")
+  registry = SchemaRegistry()
+  changes = diff_schemas(SchemaWalker(registry.bundle(old_schema)), SchemaWalker(registry.bundle(new_schema)))
+  summary = replay(old_schema, new_schema, args.corpus, args.workers) if args.corpus else None
+
+  if args.json:
+    print(json.dumps({"changes": changes, "replay": summary}, indent=2))
+  else:
+    print_report(changes, summary)
+  if any(item["breaking"] for item in changes) or (summary and (summary["broken"] or summary["unreadable"])):
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
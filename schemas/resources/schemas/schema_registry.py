@@ -0,0 +1,102 @@
+"""
+A registry of compiled schemas for validate.py and the other schema tools.
+Each schema file is read once and every file it reaches through $ref is
+loaded with it, with references resolved against the file they are in. The
+validator of a schema is built and its schema checked once per process.
+Building one takes a few milliseconds, about what reading a cached copy from
+disk would cost, so compiled schemas are not kept between runs.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+
+from jsonschema import Draft7Validator
+from jsonschema.validators import validator_for
+from referencing import Registry, Resource
+from referencing.jsonschema import DRAFT7
+
+# Parsed files, kept for the life of the process
+parsed_files = {}
+
+def load_json(json_file):
+  "Parse a JSON file once, returning the data and None, or None and the syntax error."
+  path = str(Path(json_file).resolve())
+  if path not in parsed_files:
+    try:
+      with open(path, encoding="utf-8") as file:
+        parsed_files[path] = (json.load(file), None)
+    except (OSError, ValueError) as e:
+      parsed_files[path] = (None, f"{json_file}: {e}")
+  return parsed_files[path]
+
+def file_refs(schema):
+  "Find the file part of every $ref in a schema that points at another file"
+  refs = set()
+  pending = [schema]
+  while pending:
+    node = pending.pop()
+    if isinstance(node, dict):
+      ref = node.get("$ref")
+      if isinstance(ref, str) and not ref.startswith("#") and "://" not in ref:
+        refs.add(ref.split("#")[0])
+      pending.extend(node.values())
+    elif isinstance(node, list):
+      pending.extend(node)
+  return refs
+
+def schema_dependencies(schema_file, found=None):
+  "Find a schema file and every file it references with $ref, directly or not"
+  found = set() if found is None else found
+  path = Path(schema_file).resolve()
+  if path in found or not path.exists():
+    return found
+  found.add(path)
+  schema, error = load_json(path)
+  if not error:
+    for ref in file_refs(schema):
+      schema_dependencies(path.parent / ref, found)
+  return found
+
+def file_hash(path):
+  "Hash the content of a file"
+  with open(path, "rb") as file:
+    return hashlib.sha256(file.read()).hexdigest()
+
+class SchemaRegistry:
+  """Compiles schema files into validators, once per process.
+
+  Example Use of this class
+  registry = SchemaRegistry()
+  errors = list(registry.validator("grid/v0.0.1/schema.json").iter_errors(document))"""
+
+  def __init__(self):
+    self.validators = {}
+
+  def bundle(self, schema_file):
+    """Load a schema and every file it references, keyed by their file URI.
+    Each $id is replaced with the file URI so that references resolve against
+    the file they are in. Raises ValueError if a file cannot be parsed."""
+    resources = {}
+    for path in sorted(schema_dependencies(schema_file)):
+      contents, error = load_json(path)
+      if error:
+        raise ValueError(error)
+      resources[path.as_uri()] = dict(contents, **{"$id": path.as_uri()})
+    return {"root": Path(schema_file).resolve().as_uri(), "resources": resources}
+
+  def validator(self, schema_file):
+    """Return the validator of a schema file. Raises ValueError for a file that
+    cannot be parsed and jsonschema's SchemaError for an invalid schema."""
+    path = Path(schema_file).resolve()
+    if path in self.validators:
+      return self.validators[path]
+    bundle = self.bundle(path)
+    root = bundle["resources"][bundle["root"]]
+    cls = validator_for(root, default=Draft7Validator)
+    cls.check_schema(root)
+    registry = Registry().with_resources(
+      (uri, Resource.from_contents(contents, default_specification=DRAFT7))
+      for uri, contents in bundle["resources"].items()).crawl()
+    self.validators[path] = cls(root, registry=registry)
+    return self.validators[path]
@@ -1,65 +1,183 @@
 """
 This is not a self contain test, but a quick and dirty tool to run some tests.
-To run this test, check out and compile the code at
-https://git.earthdata.nasa.gov/projects/EMFD/repos/unified-metadata-model-validator/browse
-and place this jar file in "~/bin/draft-7-validator.jar". Additionally install
-the jq command using `brew install jq`.
+Every <concept>/<version>/ directory with a schema.json, metadata.json or
+config.json is found and checked in a process pool: each JSON file is parsed
+once, each draft-07 schema is compiled once and the example metadata and index
+configuration of the version are validated against them, see
+schema_registry.py. Versions whose files, and the files their schemas $ref,
+have not changed since the last run are taken from a cache. Install the
+validator with `pip install jsonschema`. Run from this directory with
+`python3 validate.py`.
 """
 
+import argparse
+import hashlib
+import json
 import os
-import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 
-JAR = "~/bin/draft-7-validator.jar"
+from schema_registry import SchemaRegistry, file_hash, load_json, schema_dependencies
+
+INDEX_SCHEMA = "config/v0.0.1/schema.json"
+VERSION_FILES = ("schema.json", "metadata.json", "config.json")
+# Kept in the build directory of the project, since everything under resources
+# is packaged into the cmr-schemas jar
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "target",
+                          "validate-cache.json")
+# Change when the checks change so that cached results are not reused
+CACHE_VERSION = 1
+
+# The compiled schemas, kept for the life of each worker process
+registry = SchemaRegistry()
 
 def validate_json(json_file):
-  "Check that a JSON file is valid according to the jq command."
-  print(f"JSON Syntax for {json_file}\n")
-  cmd = ['jq', "--monochrome-output", "--ascii-output", "\".\"", json_file]
-  result = subprocess.run(cmd, stdout=subprocess.PIPE)
-  print(result.stdout.decode('utf-8'))
-  return result.returncode
-
-def validate_schema(jar, schema, metadata):
-  "Check that a metadata file conforms to a schema file"
-  cmd = ['java', '-jar', jar, schema, metadata]
-  result = subprocess.run(cmd, stdout=subprocess.PIPE)
-  print(result.stdout.decode('utf-8'))
-  return result.returncode
-
-def test_index(schema_name):
-  "Check that all versions of index files confirms to a fixed index schema"
-  jar = os.path.expanduser(JAR)
-  ret = 0
-  sub_folders = [f.path for f in os.scandir(schema_name) if f.is_dir()]
-  for version in list(sub_folders):
-    index_schema = f"{os.getcwd()}/config/v0.0.1/schema.json"
-    index = f"{os.getcwd()}/{version}/config.json"
-    ret = ret + validate_schema(jar, index_schema, index)
-  return ret
+  "Check that a JSON file is valid JSON, returning the list of errors."
+  _, error = load_json(json_file)
+  return [error] if error else []
+
+def validate_schema(schema, metadata):
+  "Check that a metadata file conforms to a schema file, returning the list of errors"
+  try:
+    validator = registry.validator(schema)
+  except Exception as e: # pylint: disable=broad-except
+    return [f"{schema}: {e}"]
+  document, error = load_json(metadata)
+  if error:
+    return [error]
+  try:
+    return [f"{metadata}: {'/'.join(str(p) for p in e.absolute_path) or '(root)'}: {e.message}"
+            for e in sorted(validator.iter_errors(document), key=lambda e: list(e.absolute_path))]
+  except Exception as e: # pylint: disable=broad-except
+    return [f"{metadata}: {e}"]
+
+def validate_version(version):
+  """Check one version directory: the syntax of its files, the metadata
+  against the schema and the index configuration against the index schema."""
+  start = time.perf_counter()
+  checks = []
+  schema = os.path.join(version, "schema.json")
+  metadata = os.path.join(version, "metadata.json")
+  config = os.path.join(version, "config.json")
+  if os.path.exists(schema) and os.path.exists(metadata):
+    checks.append({"check": "schema", "file": metadata, "errors": validate_schema(schema, metadata)})
+  for json_file in json_files(version):
+    checks.append({"check": "syntax", "file": json_file, "errors": validate_json(json_file)})
+  if os.path.exists(config):
+    checks.append({"check": "index", "file": config, "errors": validate_schema(INDEX_SCHEMA, config)})
+  return {"version": version, "checks": checks, "seconds": time.perf_counter() - start}
+
+def versions_of(schema_name):
+  "List the version directories of a schema"
+  return sorted(f.path for f in os.scandir(schema_name) if f.is_dir())
+
+def discover_versions(root="."):
+  "Find every <concept>/<version>/ directory that holds a schema, metadata or config file"
+  versions = []
+  for concept in sorted(f.path for f in os.scandir(root) if f.is_dir() and not f.name.startswith(".")):
+    versions = versions + [os.path.relpath(version, root) for version in versions_of(concept)
+                           if any(os.path.exists(os.path.join(version, name)) for name in VERSION_FILES)]
+  return versions
+
+def json_files(version):
+  "List the JSON files in a version directory and its sub directories"
+  return sorted(str(path) for path in Path(version).rglob("*.json"))
+
+def version_key(version):
+  """Hash everything the checks of a version depend on: its own JSON files, the
+  files its schema references and, when it has a config, the index schema."""
+  dependencies = {Path(json_file).resolve() for json_file in json_files(version)}
+  schema = os.path.join(version, "schema.json")
+  if os.path.exists(schema):
+    dependencies |= schema_dependencies(schema)
+  if os.path.exists(os.path.join(version, "config.json")):
+    dependencies |= schema_dependencies(INDEX_SCHEMA)
+  digest = hashlib.sha256(str(CACHE_VERSION).encode("utf-8"))
+  for path in sorted(dependencies):
+    digest.update(f"{path}:{file_hash(path)}\n".encode("utf-8"))
+  return digest.hexdigest()
+
+def load_cache(cache_file):
+  "Read the results of the previous run, keyed by version"
+  try:
+    with open(cache_file, encoding="utf-8") as file:
+      return json.load(file)
+  except (OSError, ValueError):
+    return {}
+
+def save_cache(cache_file, cache):
+  "Write the results of this run for the next one"
+  os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+  with open(cache_file, "w", encoding="utf-8") as file:
+    json.dump(cache, file, indent=1)
+
+def validate_changed(versions, workers=None, cache_file=CACHE_FILE):
+  """Validate the versions whose key is not in the cache and take the rest from
+  the cache, returning the results in order. A cache_file of None turns caching
+  of results off."""
+  cache = load_cache(cache_file) if cache_file else {}
+  keys = {version: version_key(version) for version in versions}
+  changed = [version for version in versions if cache.get(version, {}).get("key") != keys[version]]
+  fresh = dict(zip(changed, validate_versions(changed, workers))) if changed else {}
+  results = []
+  for version in versions:
+    if version in fresh:
+      cache[version] = {"key": keys[version], "result": fresh[version]}
+      results.append(fresh[version])
+    else:
+      results.append(dict(cache[version]["result"], cached=True))
+  if cache_file:
+    save_cache(cache_file, {version: entry for version, entry in cache.items() if os.path.isdir(version)})
+  return results
+
+def validate_versions(versions, workers=None):
+  "Validate the versions in a process pool, returning the results in order"
+  if workers == 1:
+    return [validate_version(version) for version in versions]
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    return list(executor.map(validate_version, versions))
 
-def test_schema(schema_name):
-  "Check that all versions of a schema matadata matches the definition"
-  jar = os.path.expanduser(JAR)
+def print_results(results):
+  "Print the result and time of every check, returning the number of errors"
   ret = 0
-  sub_folders = [f.path for f in os.scandir(schema_name) if f.is_dir()]
-  for version in list(sub_folders):
-    print ('*'*80 + "\n")
-    schema = f"{os.getcwd()}/{version}/schema.json"
-    metadata = f"{os.getcwd()}/{version}/metadata.json"
-    ret = ret + validate_schema(jar, schema, metadata)
-    ret = ret + validate_json(schema)
-    ret = ret + validate_json(metadata)
+  for result in results:
+    print('*'*80)
+    timing = "cached" if result.get("cached") else f"{result['seconds']*1000:.0f} ms"
+    print(f"{result['version']} ({timing})")
+    for check in result["checks"]:
+      status = "FAIL" if check["errors"] else "ok"
+      print(f"  {status:<4} {check['check']:<6} {check['file']}")
+      for error in check["errors"]:
+        print(f"         {error}")
+      ret = ret + len(check["errors"])
   return ret
 
 def main():
-  ret = test_schema("index")
+  parser = argparse.ArgumentParser(description="Validate the generic document schemas")
+  parser.add_argument("concepts", nargs="*",
+                      help="Concept directories to check, defaults to every directory found")
+  parser.add_argument("--workers", type=int, default=None,
+                      help="Number of processes, defaults to the number of CPUs")
+  parser.add_argument("--cache", default=CACHE_FILE,
+                      help="File the results are kept in, defaults to target/validate-cache.json of the project")
+  parser.add_argument("--no-cache", action="store_true",
+                      help="Check every version again instead of reusing the results in the cache file")
+  args = parser.parse_args()
 
-  for i in ["data-quality-summary", "grid", "order-option", "visualization"]:
-    ret = ret + test_schema(i)
-    ret = ret + test_index(i)
+  start = time.perf_counter()
+  versions = discover_versions()
+  if args.concepts:
+    versions = [version for version in versions if Path(version).parts[0] in args.concepts]
+  ret = print_results(validate_changed(versions, args.workers, None if args.no_cache else args.cache))
 
+  print(f"\nValidated {len(versions)} versions in {time.perf_counter() - start:.2f} seconds")
   if ret == 0:
     print ("No errors found")
+  else:
+    print (f"{ret} errors found")
+    sys.exit(1)
 
 if __name__ == "__main__":
   main()
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from logger import logger
+
+# The number of message keys remembered. 0 turns duplicate suppression off.
+DEDUP_CACHE_SIZE = os.getenv("DEDUP_CACHE_SIZE", "10000")
+# The number of seconds a message key is remembered for.
+DEDUP_CACHE_TTL = os.getenv("DEDUP_CACHE_TTL", "3600")
+# An optional SQLite file the keys are also written to, so they survive a restart of the worker.
+DEDUP_CACHE_FILE = os.getenv("DEDUP_CACHE_FILE")
+# Either message-id to use the SQS MessageId as the key, or content-hash to use a hash of the
+# message body, which also catches the same notification delivered twice by SNS.
+DEDUP_KEY = os.getenv("DEDUP_KEY", "message-id")
+
+class DedupCache:
+    """Encapsulates a bounded cache of recently published messages used to skip duplicates.
+    Keys expire after ttl seconds and the oldest keys are evicted once max_size is reached.
+    When a file name is given the keys are also stored in a SQLite database that is read back
+    when the cache is created.
+
+    Example Use of this class
+    dedup_cache = DedupCache()
+    key = dedup_cache.key(message)
+    if not dedup_cache.seen(key):
+        ... publish the message ...
+        dedup_cache.add(key)
+    """
+
+    def __init__(self, max_size=None, ttl=None, file_name=None, key_type=None):
+        """ Sets up the in memory cache and loads any unexpired keys from the file. """
+        self.max_size = int(max_size if max_size is not None else DEDUP_CACHE_SIZE)
+        self.ttl = float(ttl if ttl is not None else DEDUP_CACHE_TTL)
+        self.key_type = key_type or DEDUP_KEY
+        # key -> expiry time, ordered from the oldest to the newest key
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.connection = None
+        file_name = file_name if file_name is not None else DEDUP_CACHE_FILE
+        if file_name:
+            self.open_file(file_name)
+
+    def open_file(self, file_name):
+        """ Opens the SQLite database, drops the expired keys and loads the rest. """
+        self.connection = sqlite3.connect(file_name, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS dedup (key TEXT PRIMARY KEY, expires REAL)")
+        self.connection.execute("DELETE FROM dedup WHERE expires <= ?", (time.time(),))
+        self.connection.commit()
+        rows = self.connection.execute("SELECT key, expires FROM dedup ORDER BY expires").fetchall()
+        for key, expires in rows[-self.max_size:] if self.max_size > 0 else []:
+            self.entries[key] = expires
+        logger.info(f"Subscription worker loaded {len(self.entries)} message keys from {file_name}")
+
+    def key(self, message):
+        """ Returns the cache key of an SQS message. """
+        if self.key_type == "content-hash":
+            return hashlib.sha256(message["Body"].encode("utf-8")).hexdigest()
+        return message["MessageId"]
+
+    def seen(self, key):
+        """ Returns True if the key was added less than ttl seconds ago. """
+        with self.lock:
+            expires = self.entries.get(key)
+            if expires is None:
+                return False
+            if expires <= time.time():
+                del self.entries[key]
+                return False
+            return True
+
+    def add(self, key):
+        """ Remembers the key for ttl seconds, evicting expired and then the oldest keys to stay
+        within max_size. """
+        if self.max_size <= 0:
+            return
+        now = time.time()
+        expires = now + self.ttl
+        evicted = []
+        with self.lock:
+            self.entries[key] = expires
+            self.entries.move_to_end(key)
+            # Keys are ordered by expiry, so expired keys are always at the front.
+            while self.entries:
+                oldest_key, oldest_expires = next(iter(self.entries.items()))
+                if oldest_expires > now and len(self.entries) <= self.max_size:
+                    break
+                del self.entries[oldest_key]
+                evicted.append(oldest_key)
+            if self.connection:
+                self.connection.execute("INSERT OR REPLACE INTO dedup (key, expires) VALUES (?, ?)", (key, expires))
+                self.connection.executemany("DELETE FROM dedup WHERE key = ?", [(evicted_key,) for evicted_key in evicted])
+                self.connection.commit()
+
+    def close(self):
+        """ Closes the SQLite database if there is one. """
+        if self.connection:
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,15 @@
+import json
+
+# orjson is optional. When it is installed it is used to decode the notifications because it is
+# several times faster than the standard library, otherwise the standard library is used.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def loads(data):
+    """ Decodes a JSON string using the fastest JSON library that is installed. Both libraries
+    raise a json.JSONDecodeError (a ValueError) for malformed input. """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
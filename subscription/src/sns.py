@@ -24,11 +24,14 @@ class Sns:
     @staticmethod
     def publish_message(topic, message):
         """ Publishes a message with attributes to the CMR external topic. Subscriptions
-        can be filtered based on the message attributes. """
+        can be filtered based on the message attributes. A message that is still an
+        encoded JSON string is published as is. """
         message_body = message["Body"]
         message_subject = message_body["Subject"]
         message_attributes = message_body["MessageAttributes"]
-        message_message = json.dumps(message_body["Message"])
+        message_message = message_body["Message"]
+        if not isinstance(message_message, str):
+            message_message = json.dumps(message_message)
         try:
             if message_attributes:
                 att_dict = {}
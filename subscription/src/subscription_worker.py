@@ -1,11 +1,13 @@
 import boto3
 import multiprocessing
 import os
-import json
+import json_codec
 from flask import Flask, jsonify
 from sns import Sns
 from botocore.exceptions import ClientError
 from access_control import AccessControl
+from visibility_heartbeat import VisibilityHeartbeat
+from dedup_cache import DedupCache
 from logger import logger
 import traceback
 
@@ -14,13 +16,25 @@ QUEUE_URL = os.getenv("QUEUE_URL")
 DEAD_LETTER_QUEUE_URL = os.getenv("DEAD_LETTER_QUEUE_URL")
 SUB_DEAD_LETTER_QUEUE_URL = os.getenv("SUB_DEAD_LETTER_QUEUE_URL")
 LONG_POLL_TIME = os.getenv("LONG_POLL_TIME", "1")
+MAX_NUMBER_OF_MESSAGES = os.getenv("MAX_NUMBER_OF_MESSAGES", "10")
+# When true the inner notification message is published as the string it was received as
+# instead of being decoded and encoded again.
+MESSAGE_PASS_THROUGH = os.getenv("MESSAGE_PASS_THROUGH", "false")
 SNS_NAME = os.getenv("SNS_NAME")
 
+# The outcomes of processing a message. Published and skipped messages are deleted from the queue,
+# failed messages are left on the queue to be received again. Rejected messages can never be processed,
+# because they are not valid JSON or miss a field, so they are sent to SUB_DEAD_LETTER_QUEUE_URL and deleted.
+PUBLISHED = "published"
+SKIPPED = "skipped"
+FAILED = "failed"
+REJECTED = "rejected"
+
 def receive_message(sqs_client, queue_url):
     """ Calls the queue to get one message from it to process the message. """
     response = sqs_client.receive_message(
         QueueUrl=queue_url,
-        MaxNumberOfMessages=10,
+        MaxNumberOfMessages=(int (MAX_NUMBER_OF_MESSAGES)),
         # Long Polling
         WaitTimeSeconds=(int (LONG_POLL_TIME)))
 
@@ -38,13 +52,25 @@ def delete_messages(sqs_client, queue_url, messages):
         receipt_handle = message['ReceiptHandle']
         delete_message(sqs_client=sqs_client, queue_url=queue_url, receipt_handle=receipt_handle)
 
-def process_messages(sns_client, topic, messages, access_control):
+def process_messages(sns_client, topic, messages, access_control, dedup_cache=None):
     """ Processes a list of messages that was received from a queue. Check to see if ACLs pass for the granule.
-        If the checks pass then send the notification. """
+        If the checks pass then send the notification. Only the outer message body is decoded to get the routing
+        attributes when MESSAGE_PASS_THROUGH is true, the inner message is then passed on untouched. Messages that
+        are in the dedup cache were published recently and are skipped. Returns a list with the outcome of each
+        message, in the same order as the messages: PUBLISHED, SKIPPED, REJECTED or FAILED. """
+
+    pass_through = MESSAGE_PASS_THROUGH.lower() == "true"
+    outcomes = []
 
     for message in messages.get("Messages", []):
         try:
-            message_body = json.loads(message["Body"])
+            dedup_key = dedup_cache.key(message) if dedup_cache else None
+            if dedup_key and dedup_cache.seen(dedup_key):
+                logger.info(f"Subscription worker: Skipping message {message.get('MessageId')} that was already published.")
+                outcomes.append(SKIPPED)
+                continue
+
+            message_body = json_codec.loads(message["Body"])
 
             message_attributes = message_body["MessageAttributes"]
             logger.debug(f"Subscription worker: Received message including attributes: {message_body}")
@@ -59,25 +85,89 @@ def process_messages(sns_client, topic, messages, access_control):
             #logger.info(f"Subscription Worker access control duration {((time.time() * 1000) - start_access_control)} ms.")
             if( acl_read):
                 #logger.debug(f"Subscription worker: {subscriber} has permission to receive granule notifications for {collection_concept_id}")
-                message_body['Message'] = json.loads(message_body['Message'])
-                message['Body'] = message_body
-                sns_client.publish_message(topic, message)
+                if not pass_through:
+                    message_body['Message'] = json_codec.loads(message_body['Message'])
+                # The received message keeps its original body so that it can still be sent to a queue.
+                sns_client.publish_message(topic, dict(message, Body=message_body))
+                if dedup_key:
+                    dedup_cache.add(dedup_key)
+                outcomes.append(PUBLISHED)
             else:
                 logger.warning(f"Subscription worker: {subscriber} does not have read permission to receive notifications for {collection_concept_id}.")
+                outcomes.append(SKIPPED)
+        except (ValueError, KeyError, TypeError) as e:
+            # Decoding errors and missing fields will not go away when the message is received again.
+            logger.error(f"Subscription worker: Rejecting message {message.get('MessageId')} that can not be processed. {e!r}")
+            outcomes.append(REJECTED)
         except Exception as e:
             logger.error(f"Subscription worker: There is a problem in process messages {message}. {e}")
             logger.error(f"Subscription worker: Stack trace {traceback.print_exc()}")
+            outcomes.append(FAILED)
+    return outcomes
 
-def poll_queue(running):
-    """ Poll the SQS queue and process messages. """
-
-    sqs_client = boto3.client("sqs", region_name=AWS_REGION)
-    sns_resource = boto3.resource("sns", region_name=AWS_REGION)
+def reject_messages(sqs_client, messages):
+    """ Sends messages that can never be processed to SUB_DEAD_LETTER_QUEUE_URL, when it is set, so that they
+        can be looked at later. """
+    for message in messages.get("Messages", []):
+        if SUB_DEAD_LETTER_QUEUE_URL:
+            sqs_client.send_message(QueueUrl=SUB_DEAD_LETTER_QUEUE_URL, MessageBody=message['Body'])
+        else:
+            logger.error(f"Subscription worker: Dropping message {message.get('MessageId')} that can not be processed: {message['Body']}")
+
+def handle_messages(sqs_client, queue_url, sns_client, topic, messages, access_control, heartbeat, dedup_cache=None):
+    """ Processes the messages received from a queue. The messages that were published or skipped are deleted,
+        the rejected ones are moved to the subscription dead letter queue. The messages that failed are left on
+        the queue and are made visible again soon so that they are retried. """
+    heartbeat.track(queue_url, messages)
+    try:
+        outcomes = process_messages(sns_client=sns_client, topic=topic, messages=messages, access_control=access_control, dedup_cache=dedup_cache)
+    except Exception:
+        heartbeat.release(queue_url, messages)
+        raise
+
+    received = messages.get("Messages", [])
+    handled = {"Messages": [message for message, outcome in zip(received, outcomes) if outcome in (PUBLISHED, SKIPPED)]}
+    rejected = {"Messages": [message for message, outcome in zip(received, outcomes) if outcome == REJECTED]}
+    failed = {"Messages": [message for message, outcome in zip(received, outcomes) if outcome == FAILED]}
+
+    if rejected["Messages"]:
+        try:
+            reject_messages(sqs_client=sqs_client, messages=rejected)
+            handled["Messages"].extend(rejected["Messages"])
+        except Exception as e:
+            logger.error(f"Subscription worker: Could not move rejected messages to {SUB_DEAD_LETTER_QUEUE_URL}. {e}")
+            failed["Messages"].extend(rejected["Messages"])
+
+    heartbeat.untrack(handled)
+    try:
+        delete_messages(sqs_client=sqs_client, queue_url=queue_url, messages=handled)
+    finally:
+        if failed["Messages"]:
+            logger.warning(f"Subscription worker: {len(failed['Messages'])} of {len(received)} messages from {queue_url} failed and will be retried.")
+            heartbeat.release(queue_url, failed)
+    return outcomes
+
+def poll_queue(running, sqs_client=None, sns_resource=None, access_control=None):
+    """ Poll the SQS queue and process messages. The AWS clients and access control
+        are created here unless they are passed in, which lets the local benchmark
+        harness drive this loop against in-process stand-ins. """
+
+    if sqs_client is None:
+        sqs_client = boto3.client("sqs", region_name=AWS_REGION)
+    if sns_resource is None:
+        sns_resource = boto3.resource("sns", region_name=AWS_REGION)
     sns_client = Sns(sns_resource)
     logger.info(f"The passed in topic name is {SNS_NAME}")
     topic = sns_client.create_topic(SNS_NAME)
     
-    access_control = AccessControl()
+    if access_control is None:
+        access_control = AccessControl()
+
+    # Keeps the messages that are being processed invisible on the queue for as long as they are in flight.
+    heartbeat = VisibilityHeartbeat(sqs_client)
+    # Remembers the messages that were published so that redelivered messages are not published again.
+    dedup_cache = DedupCache()
+    heartbeat.start()
     while running.value:
         try:
              # Poll the SQS
@@ -85,20 +175,22 @@ def poll_queue(running):
 
              if messages:
                  try:
-                     process_messages(sns_client=sns_client, topic=topic, messages=messages, access_control=access_control)
-                     delete_messages(sqs_client=sqs_client, queue_url=QUEUE_URL, messages=messages)
+                     handle_messages(sqs_client=sqs_client, queue_url=QUEUE_URL, sns_client=sns_client, topic=topic, messages=messages,
+                                     access_control=access_control, heartbeat=heartbeat, dedup_cache=dedup_cache)
                  except Exception as e:
-                     # This exception has already been logged, but capturing the exception here so that the message won't be deleted if it can't be processed.
-                     # Do not do anything with the exception here so that we can process the dead letter queue.
+                     # This exception has already been logged, but capturing the exception here so that the messages won't be deleted if they can't
+                     # be processed. Do not do anything with the exception here so that we can process the dead letter queue.
                      None
              
              dl_messages = receive_message(sqs_client=sqs_client, queue_url=DEAD_LETTER_QUEUE_URL)
              if dl_messages:
-                 process_messages(sns_client=sns_client, topic=topic, messages=dl_messages, access_control=access_control)
-                 delete_messages(sqs_client=sqs_client, queue_url=DEAD_LETTER_QUEUE_URL, messages=dl_messages)
+                 handle_messages(sqs_client=sqs_client, queue_url=DEAD_LETTER_QUEUE_URL, sns_client=sns_client, topic=topic, messages=dl_messages,
+                                 access_control=access_control, heartbeat=heartbeat, dedup_cache=dedup_cache)
 
         except Exception as e:
              logger.error(f"An error occurred receiving or deleting messages: {e}")
+    heartbeat.stop()
+    dedup_cache.close()
 
 app = Flask(__name__)
 @app.route('/shutdown', methods=['POST'])
@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from botocore.exceptions import ClientError
+from logger import logger
+
+# The visibility timeout configured on the queues, in seconds. A heartbeat pushes the visibility
+# of every message still being processed this far out again.
+VISIBILITY_TIMEOUT = os.getenv("VISIBILITY_TIMEOUT", "30")
+# Messages that failed are made visible again after this many seconds so that they are retried
+# quickly instead of waiting out the full visibility timeout.
+FAILED_VISIBILITY_TIMEOUT = os.getenv("FAILED_VISIBILITY_TIMEOUT", "5")
+# SQS accepts at most 10 entries per ChangeMessageVisibilityBatch call.
+MAX_BATCH_ENTRIES = 10
+
+class VisibilityHeartbeat:
+    """Encapsulates extending the SQS visibility timeout of messages that are still being processed.
+    Messages are tracked by receipt handle from the time they are received. A background thread
+    extends the visibility of every message that has been in flight for a third of the visibility
+    timeout with ChangeMessageVisibilityBatch, so a slow batch does not reappear on the queue and
+    get published twice.
+
+    Example Use of this class
+    heartbeat = VisibilityHeartbeat(sqs_client)
+    heartbeat.start()
+    heartbeat.track(queue_url, messages)
+    ... process the messages ...
+    heartbeat.untrack(messages)   # or heartbeat.release(queue_url, messages) when they failed
+    heartbeat.stop()
+    """
+
+    def __init__(self, sqs_client, visibility_timeout=None, failed_visibility_timeout=None):
+        """ Sets up the tracked receipt handles and the heartbeat timing. """
+        self.sqs_client = sqs_client
+        self.visibility_timeout = int(visibility_timeout if visibility_timeout is not None else VISIBILITY_TIMEOUT)
+        self.failed_visibility_timeout = int(failed_visibility_timeout if failed_visibility_timeout is not None
+                                             else FAILED_VISIBILITY_TIMEOUT)
+        self.interval = self.visibility_timeout / 3
+        # receipt handle -> (queue url, time the visibility was last set)
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """ Starts the background heartbeat thread. """
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="visibility-heartbeat", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """ Stops the background heartbeat thread. """
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """ Wakes up twice per interval to extend the messages that are due. """
+        while not self.stop_event.wait(self.interval / 2):
+            self.extend_due()
+
+    def track(self, queue_url, messages):
+        """ Starts tracking the received messages. """
+        now = time.monotonic()
+        with self.lock:
+            for message in messages.get("Messages", []):
+                self.in_flight[message['ReceiptHandle']] = (queue_url, now)
+
+    def untrack(self, messages):
+        """ Stops tracking messages, normally because they are about to be deleted. """
+        with self.lock:
+            for message in messages.get("Messages", []):
+                self.in_flight.pop(message['ReceiptHandle'], None)
+
+    def release(self, queue_url, messages):
+        """ Stops tracking messages that could not be processed and shortens their visibility
+        timeout so they are received again soon. """
+        self.untrack(messages)
+        receipt_handles = [message['ReceiptHandle'] for message in messages.get("Messages", [])]
+        self.change_visibility(queue_url, receipt_handles, self.failed_visibility_timeout)
+
+    def extend_due(self):
+        """ Extends the visibility of every tracked message whose visibility was last set at least
+        one interval ago. """
+        now = time.monotonic()
+        due = {}
+        with self.lock:
+            for receipt_handle, (queue_url, visible_since) in self.in_flight.items():
+                if now - visible_since >= self.interval:
+                    due.setdefault(queue_url, []).append(receipt_handle)
+                    self.in_flight[receipt_handle] = (queue_url, now)
+        for queue_url, receipt_handles in due.items():
+            logger.debug(f"Subscription worker: extending the visibility of {len(receipt_handles)} messages on {queue_url}")
+            failed = self.change_visibility(queue_url, receipt_handles, self.visibility_timeout)
+            # A receipt handle that can no longer be changed has been deleted or has expired.
+            with self.lock:
+                for receipt_handle in failed:
+                    self.in_flight.pop(receipt_handle, None)
+
+    def change_visibility(self, queue_url, receipt_handles, visibility_timeout):
+        """ Calls ChangeMessageVisibilityBatch in batches of 10 and returns the receipt handles
+        that could not be changed. """
+        failed = []
+        for start in range(0, len(receipt_handles), MAX_BATCH_ENTRIES):
+            batch = receipt_handles[start:start + MAX_BATCH_ENTRIES]
+            entries = [{"Id": str(index), "ReceiptHandle": receipt_handle, "VisibilityTimeout": visibility_timeout}
+                       for index, receipt_handle in enumerate(batch)]
+            try:
+                response = self.sqs_client.change_message_visibility_batch(QueueUrl=queue_url, Entries=entries)
+            except ClientError as error:
+                logger.warning(f"Subscription worker could not change the message visibility on {queue_url}: {error}")
+                failed.extend(batch)
+                continue
+            for failure in response.get("Failed", []):
+                logger.debug(f"Subscription worker could not change the message visibility: {failure}")
+                failed.append(batch[int(failure["Id"])])
+        return failed
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from dedup_cache import DedupCache
+
+class TestDedupCache(unittest.TestCase):
+
+    def test_seen(self):
+        dedup_cache = DedupCache(max_size=10, ttl=60, file_name="")
+        self.assertFalse(dedup_cache.seen('message1'))
+        dedup_cache.add('message1')
+        self.assertTrue(dedup_cache.seen('message1'))
+        self.assertFalse(dedup_cache.seen('message2'))
+
+    @patch('dedup_cache.time.time')
+    def test_ttl(self, mock_time):
+        mock_time.return_value = 1000
+        dedup_cache = DedupCache(max_size=10, ttl=60, file_name="")
+        dedup_cache.add('message1')
+
+        mock_time.return_value = 1059
+        self.assertTrue(dedup_cache.seen('message1'))
+        mock_time.return_value = 1060
+        self.assertFalse(dedup_cache.seen('message1'))
+        self.assertEqual(len(dedup_cache.entries), 0)
+
+    def test_max_size(self):
+        dedup_cache = DedupCache(max_size=2, ttl=60, file_name="")
+        for key in ['message1', 'message2', 'message3']:
+            dedup_cache.add(key)
+
+        self.assertFalse(dedup_cache.seen('message1'))
+        self.assertTrue(dedup_cache.seen('message2'))
+        self.assertTrue(dedup_cache.seen('message3'))
+
+    def test_disabled(self):
+        dedup_cache = DedupCache(max_size=0, ttl=60, file_name="")
+        dedup_cache.add('message1')
+        self.assertFalse(dedup_cache.seen('message1'))
+
+    def test_key(self):
+        message = {'MessageId': 'sqs-id', 'Body': '{"MessageId": "sns-id"}'}
+        self.assertEqual(DedupCache(file_name="").key(message), 'sqs-id')
+        content_hash = DedupCache(file_name="", key_type="content-hash").key(message)
+        self.assertEqual(len(content_hash), 64)
+        self.assertEqual(content_hash, DedupCache(file_name="", key_type="content-hash").key(dict(message, MessageId='other')))
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, 'dedup.db')
+            dedup_cache = DedupCache(max_size=2, ttl=60, file_name=file_name)
+            for key in ['message1', 'message2', 'message3']:
+                dedup_cache.add(key)
+            dedup_cache.close()
+
+            # The keys survive a restart, the evicted key is gone from the file too.
+            dedup_cache = DedupCache(max_size=2, ttl=60, file_name=file_name)
+            self.assertFalse(dedup_cache.seen('message1'))
+            self.assertTrue(dedup_cache.seen('message2'))
+            self.assertTrue(dedup_cache.seen('message3'))
+            dedup_cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
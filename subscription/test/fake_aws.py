@@ -0,0 +1,162 @@
+""" In-process stand-ins for the parts of AWS SQS and SNS that the subscription worker uses.
+These are used by the poll_queue benchmark and its tests so that the real worker loop can be
+driven without AWS. Every call can be given an artificial latency and every call is counted
+so that API calls per message can be reported. """
+
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from botocore.exceptions import ParamValidationError
+
+class FakeSqsClient:
+    """Encapsulates a set of in-memory SQS queues keyed by queue URL.
+    Messages honor a visibility timeout: a received message is hidden until it is deleted or
+    its visibility timeout runs out, after which it can be received again.
+
+    latency is either a number of seconds applied to every call or a dictionary of
+    operation name to seconds, for example {"receive_message": 0.02}."""
+
+    def __init__(self, latency=0, visibility_timeout=30):
+        self.latency = latency
+        self.visibility_timeout = visibility_timeout
+        self.calls = Counter()
+        self.condition = threading.Condition()
+        self.queues = {}
+        self.in_flight = {}
+
+    def _call(self, operation):
+        """ Counts the call and sleeps for the configured latency of the operation. """
+        with self.condition:
+            self.calls[operation] += 1
+        delay = self.latency.get(operation, 0) if isinstance(self.latency, dict) else self.latency
+        if delay:
+            time.sleep(delay)
+
+    def _requeue_expired(self, now):
+        """ Puts in flight messages whose visibility timeout ran out back on their queue.
+        The caller must hold the condition lock. """
+        for receipt_handle, (queue_url, record, visible_at) in list(self.in_flight.items()):
+            if visible_at <= now:
+                del self.in_flight[receipt_handle]
+                self.queues.setdefault(queue_url, deque()).append(record)
+
+    def send_message(self, QueueUrl, MessageBody):
+        """ Adds a message to the end of the queue and returns its message id. """
+        self._call("send_message")
+        if not isinstance(MessageBody, str):
+            # Like botocore, which only sends string bodies.
+            raise ParamValidationError(report=f"Invalid type for parameter MessageBody, value: {MessageBody}")
+        record = {"MessageId": str(uuid.uuid4()), "Body": MessageBody, "ReceiveCount": 0}
+        with self.condition:
+            self.queues.setdefault(QueueUrl, deque()).append(record)
+            self.condition.notify_all()
+        return {"MessageId": record["MessageId"]}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0):
+        """ Returns up to MaxNumberOfMessages visible messages. Like SQS long polling this waits
+        up to WaitTimeSeconds for a message to become visible when the queue is empty. """
+        self._call("receive_message")
+        deadline = time.monotonic() + WaitTimeSeconds
+        messages = []
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self._requeue_expired(now)
+                queue = self.queues.get(QueueUrl)
+                if queue or now >= deadline:
+                    break
+                self.condition.wait(timeout=min(deadline - now, 0.05))
+            queue = self.queues.get(QueueUrl, deque())
+            while queue and len(messages) < MaxNumberOfMessages:
+                record = queue.popleft()
+                record["ReceiveCount"] += 1
+                receipt_handle = str(uuid.uuid4())
+                self.in_flight[receipt_handle] = (QueueUrl, record, now + self.visibility_timeout)
+                messages.append({"MessageId": record["MessageId"],
+                                 "ReceiptHandle": receipt_handle,
+                                 "Body": record["Body"],
+                                 "Attributes": {"ApproximateReceiveCount": str(record["ReceiveCount"])}})
+        response = {"ResponseMetadata": {"HTTPStatusCode": 200}}
+        if messages:
+            response["Messages"] = messages
+        return response
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        """ Deletes an in flight message. Like SQS, an unknown or expired receipt handle is ignored. """
+        self._call("delete_message")
+        with self.condition:
+            self.in_flight.pop(ReceiptHandle, None)
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        """ Deletes up to 10 in flight messages in one call. """
+        self._call("delete_message_batch")
+        with self.condition:
+            for entry in Entries:
+                self.in_flight.pop(entry["ReceiptHandle"], None)
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        """ Changes the visibility timeout of up to 10 in flight messages in one call. A receipt
+        handle that is no longer in flight is reported as failed. """
+        self._call("change_message_visibility_batch")
+        successful = []
+        failed = []
+        with self.condition:
+            now = time.monotonic()
+            for entry in Entries:
+                in_flight = self.in_flight.get(entry["ReceiptHandle"])
+                if in_flight is None:
+                    failed.append({"Id": entry["Id"], "Code": "ReceiptHandleIsInvalid", "SenderFault": True})
+                    continue
+                queue_url, record, _ = in_flight
+                self.in_flight[entry["ReceiptHandle"]] = (queue_url, record, now + entry["VisibilityTimeout"])
+                successful.append({"Id": entry["Id"]})
+            self.condition.notify_all()
+        return {"Successful": successful, "Failed": failed}
+
+    def approximate_number_of_messages(self, queue_url):
+        """ Returns the number of visible and in flight messages of a queue. This is not counted
+        as an API call since it is only used by the harness. """
+        with self.condition:
+            in_flight = sum(1 for url, _, _ in self.in_flight.values() if url == queue_url)
+            return len(self.queues.get(queue_url, ())) + in_flight
+
+class FakeTopic:
+    """Encapsulates an in-memory SNS topic that records every published message."""
+
+    def __init__(self, name, latency=0):
+        self.name = name
+        self.latency = latency
+        self.calls = Counter()
+        self.published = []
+        self.lock = threading.Lock()
+
+    def publish(self, Subject=None, Message=None, MessageAttributes=None):
+        """ Records the published message along with the time it was published. """
+        with self.lock:
+            self.calls["publish"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        message_id = str(uuid.uuid4())
+        with self.lock:
+            self.published.append({"MessageId": message_id,
+                                   "Subject": Subject,
+                                   "Message": Message,
+                                   "MessageAttributes": MessageAttributes,
+                                   "PublishedAt": time.monotonic()})
+        return {"MessageId": message_id}
+
+class FakeSnsResource:
+    """Encapsulates the SNS resource used by the Sns class. All topics share the latency."""
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.topics = {}
+
+    def create_topic(self, Name):
+        """ Returns the named topic, creating it if needed. """
+        if Name not in self.topics:
+            self.topics[Name] = FakeTopic(Name, latency=self.latency)
+        return self.topics[Name]
@@ -0,0 +1,20 @@
+import json
+import unittest
+from unittest.mock import patch
+import json_codec
+
+class TestJsonCodec(unittest.TestCase):
+
+    def test_loads(self):
+        self.assertEqual(json_codec.loads('{"concept-id": "G1200484365-PROV"}'), {'concept-id': 'G1200484365-PROV'})
+
+    @patch('json_codec.orjson', None)
+    def test_loads_without_orjson(self):
+        self.assertEqual(json_codec.loads('{"concept-id": "G1200484365-PROV"}'), {'concept-id': 'G1200484365-PROV'})
+
+    def test_loads_malformed(self):
+        with self.assertRaises(json.JSONDecodeError):
+            json_codec.loads('{"concept-id": ')
+
+if __name__ == '__main__':
+    unittest.main()
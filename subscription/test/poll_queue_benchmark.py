@@ -0,0 +1,190 @@
+""" Measures how many messages per second the subscription worker poll_queue loop sustains.
+The real poll_queue loop is run against the in-process SQS and SNS stand-ins in fake_aws.py
+with an artificial latency per API call. For every batch size and concurrency setting the
+queue is loaded with messages, one or more poll_queue loops drain it and the throughput,
+the API calls per message and the end to end latency (sent to published) are reported.
+
+Usage:
+PYTHONPATH=src python3 test/poll_queue_benchmark.py
+or
+PYTHONPATH=src python3 test/poll_queue_benchmark.py --messages 2000 --batch-sizes 1,10 \\
+    --concurrency 1,4 --sqs-latency-ms 20 --sns-latency-ms 30
+"""
+
+import argparse
+import json
+import multiprocessing
+import statistics
+import threading
+import time
+
+import subscription_worker
+import visibility_heartbeat
+from access_control import AccessControl
+from fake_aws import FakeSnsResource, FakeSqsClient
+
+QUEUE_URL = "fake://subscription-queue"
+DEAD_LETTER_QUEUE_URL = "fake://subscription-dead-letter-queue"
+TOPIC_NAME = "cmr-subscription-benchmark"
+
+def make_message_body(benchmark_id):
+    """ Builds an SNS notification body like the ones CMR ingest puts on the subscription queue.
+    The benchmark-id attribute is passed through to the topic so latency can be measured. """
+    message = {"concept-id": f"G{benchmark_id}-PROV",
+               "granule-ur": f"Granule_UR_{benchmark_id}",
+               "producer-granule-id": f"Granule_UR_{benchmark_id}.nc",
+               "location": f"http://localhost:3003/concepts/G{benchmark_id}-PROV/1"}
+    return json.dumps({
+        "Type": "Notification",
+        "MessageId": f"benchmark-{benchmark_id}",
+        "TopicArn": "arn:name",
+        "Subject": "Update Notification",
+        "Message": json.dumps(message),
+        "Timestamp": "2025-02-26T18:25:26.951Z",
+        "MessageAttributes": {
+            "mode": {"Type": "String", "Value": "Update"},
+            "collection-concept-id": {"Type": "String", "Value": "C1200484363-PROV"},
+            "endpoint": {"Type": "String", "Value": "http://notification/tester"},
+            "subscriber": {"Type": "String", "Value": "user1_test"},
+            "endpoint-type": {"Type": "String", "Value": "url"},
+            "benchmark-id": {"Type": "String", "Value": str(benchmark_id)}
+        }
+    })
+
+def percentile(values, percent):
+    """ Returns the nearest rank percentile of a list of values. """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = max(0, int(round(percent / 100 * len(ordered))) - 1)
+    return ordered[index]
+
+def run_benchmark(messages=1000, batch_size=10, concurrency=1, sqs_latency=0, sns_latency=0,
+                  long_poll_time=0, pass_through=False, visibility_timeout=30, timeout=300):
+    """ Runs concurrency poll_queue loops until messages notifications have been drained from the
+    fake queue and returns a dictionary with the measurements. Latencies are in seconds.
+    The worker settings are only changed for the duration of the run. """
+    settings = {"QUEUE_URL": QUEUE_URL,
+                "DEAD_LETTER_QUEUE_URL": DEAD_LETTER_QUEUE_URL,
+                "SNS_NAME": TOPIC_NAME,
+                "MAX_NUMBER_OF_MESSAGES": str(batch_size),
+                "LONG_POLL_TIME": str(long_poll_time),
+                "MESSAGE_PASS_THROUGH": str(pass_through).lower()}
+    saved = {name: getattr(subscription_worker, name) for name in settings}
+    saved_visibility_timeout = visibility_heartbeat.VISIBILITY_TIMEOUT
+    for name, value in settings.items():
+        setattr(subscription_worker, name, value)
+    visibility_heartbeat.VISIBILITY_TIMEOUT = str(visibility_timeout)
+    try:
+        return _run_benchmark(messages, batch_size, concurrency, sqs_latency, sns_latency,
+                              visibility_timeout, timeout)
+    finally:
+        for name, value in saved.items():
+            setattr(subscription_worker, name, value)
+        visibility_heartbeat.VISIBILITY_TIMEOUT = saved_visibility_timeout
+
+def _run_benchmark(messages, batch_size, concurrency, sqs_latency, sns_latency, visibility_timeout, timeout):
+    """ Loads the fake queue, drives the poll_queue loops and collects the measurements. """
+    sqs_client = FakeSqsClient(latency=sqs_latency, visibility_timeout=visibility_timeout)
+    sns_resource = FakeSnsResource(latency=sns_latency)
+
+    sent_at = {}
+    latency = sqs_client.latency
+    sqs_client.latency = 0
+    for benchmark_id in range(messages):
+        sqs_client.send_message(QueueUrl=QUEUE_URL, MessageBody=make_message_body(benchmark_id))
+        sent_at[str(benchmark_id)] = time.monotonic()
+    sqs_client.latency = latency
+    sqs_client.calls.clear()
+
+    running = multiprocessing.Value('b', True)
+    access_control = AccessControl()
+    workers = [threading.Thread(target=subscription_worker.poll_queue,
+                                args=(running,),
+                                kwargs={"sqs_client": sqs_client,
+                                        "sns_resource": sns_resource,
+                                        "access_control": access_control},
+                                daemon=True)
+               for _ in range(concurrency)]
+
+    start = time.monotonic()
+    for worker in workers:
+        worker.start()
+    while sqs_client.approximate_number_of_messages(QUEUE_URL) > 0 \
+            and time.monotonic() - start < timeout:
+        time.sleep(0.005)
+    elapsed = time.monotonic() - start
+    running.value = False
+    for worker in workers:
+        worker.join()
+
+    topic = sns_resource.create_topic(TOPIC_NAME)
+    latencies = [record["PublishedAt"] - sent_at[record["MessageAttributes"]["benchmark-id"]["StringValue"]]
+                 for record in topic.published]
+    api_calls = sum(sqs_client.calls.values()) + sum(topic.calls.values())
+    published = len(topic.published)
+    unique = len({record["MessageAttributes"]["benchmark-id"]["StringValue"] for record in topic.published})
+    return {"messages": messages,
+            "batch_size": batch_size,
+            "concurrency": concurrency,
+            "published": published,
+            "duplicates": published - unique,
+            "remaining": sqs_client.approximate_number_of_messages(QUEUE_URL),
+            "elapsed": elapsed,
+            "throughput": published / elapsed if elapsed else 0,
+            "api_calls": api_calls,
+            "api_calls_per_message": api_calls / published if published else 0,
+            "sqs_calls": dict(sqs_client.calls),
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "latency_max": max(latencies, default=0),
+            "latency_mean": statistics.fmean(latencies) if latencies else 0}
+
+def print_report(results):
+    """ Prints one line per benchmark run. """
+    header = f"{'batch':>5} {'workers':>7} {'published':>9} {'dups':>5} {'msg/s':>9} {'calls/msg':>9} " \
+             f"{'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print(f"{result['batch_size']:>5} {result['concurrency']:>7} "
+              f"{result['published']:>9} {result['duplicates']:>5} {result['throughput']:>9.1f} "
+              f"{result['api_calls_per_message']:>9.2f} "
+              f"{result['latency_p50'] * 1000:>9.1f} {result['latency_p95'] * 1000:>9.1f} "
+              f"{result['latency_max'] * 1000:>9.1f}")
+
+def get_args():
+    """ Parse the passed in arguments if any. Provide defaults values. """
+    parser = argparse.ArgumentParser(description="Subscription worker poll_queue throughput benchmark")
+    parser.add_argument("--messages", type=int, default=1000, help="Number of messages to load on the queue per run.")
+    parser.add_argument("--batch-sizes", type=str, default="1,5,10", help="Comma separated MaxNumberOfMessages values.")
+    parser.add_argument("--concurrency", type=str, default="1,2,4", help="Comma separated numbers of poll_queue loops.")
+    parser.add_argument("--sqs-latency-ms", type=float, default=10, help="Latency added to every SQS call.")
+    parser.add_argument("--sns-latency-ms", type=float, default=20, help="Latency added to every SNS publish.")
+    parser.add_argument("--long-poll-time", type=int, default=0, help="LONG_POLL_TIME used by the worker.")
+    parser.add_argument("--visibility-timeout", type=int, default=30, help="Visibility timeout of the fake queue in seconds.")
+    parser.add_argument("--pass-through", action="store_true", help="Run the worker with MESSAGE_PASS_THROUGH=true.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON instead of a table.")
+    return parser.parse_args()
+
+def main():
+    """ Runs the benchmark for every batch size and concurrency combination. """
+    args = get_args()
+    results = []
+    for batch_size in [int(size) for size in args.batch_sizes.split(",")]:
+        for concurrency in [int(workers) for workers in args.concurrency.split(",")]:
+            results.append(run_benchmark(messages=args.messages,
+                                         batch_size=batch_size,
+                                         concurrency=concurrency,
+                                         sqs_latency=args.sqs_latency_ms / 1000,
+                                         sns_latency=args.sns_latency_ms / 1000,
+                                         long_poll_time=args.long_poll_time,
+                                         pass_through=args.pass_through,
+                                         visibility_timeout=args.visibility_timeout))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+
+if __name__ == "__main__":
+    main()
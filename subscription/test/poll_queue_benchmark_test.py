@@ -0,0 +1,67 @@
+import json
+import unittest
+from fake_aws import FakeSqsClient, FakeSnsResource
+from poll_queue_benchmark import run_benchmark, make_message_body
+
+class TestFakeAws(unittest.TestCase):
+
+    def test_receive_and_delete(self):
+        sqs_client = FakeSqsClient()
+        sqs_client.send_message(QueueUrl='queue', MessageBody='body1')
+        sqs_client.send_message(QueueUrl='queue', MessageBody='body2')
+
+        response = sqs_client.receive_message(QueueUrl='queue', MaxNumberOfMessages=10)
+        self.assertEqual([message['Body'] for message in response['Messages']], ['body1', 'body2'])
+
+        # In flight messages are hidden until they are deleted.
+        self.assertNotIn('Messages', sqs_client.receive_message(QueueUrl='queue'))
+        for message in response['Messages']:
+            sqs_client.delete_message(QueueUrl='queue', ReceiptHandle=message['ReceiptHandle'])
+        self.assertEqual(sqs_client.approximate_number_of_messages('queue'), 0)
+        self.assertEqual(sqs_client.calls['receive_message'], 2)
+        self.assertEqual(sqs_client.calls['delete_message'], 2)
+
+    def test_visibility_timeout(self):
+        sqs_client = FakeSqsClient(visibility_timeout=0)
+        sqs_client.send_message(QueueUrl='queue', MessageBody='body1')
+        sqs_client.receive_message(QueueUrl='queue')
+
+        response = sqs_client.receive_message(QueueUrl='queue')
+        self.assertEqual(response['Messages'][0]['Attributes']['ApproximateReceiveCount'], '2')
+
+    def test_publish(self):
+        topic = FakeSnsResource().create_topic('topic')
+        topic.publish(Subject='subject', Message='message')
+        self.assertEqual(topic.published[0]['Message'], 'message')
+        self.assertEqual(topic.calls['publish'], 1)
+
+class TestPollQueueBenchmark(unittest.TestCase):
+
+    def test_make_message_body(self):
+        body = json.loads(make_message_body(7))
+        self.assertEqual(body['MessageAttributes']['benchmark-id']['Value'], '7')
+        self.assertEqual(json.loads(body['Message'])['concept-id'], 'G7-PROV')
+
+    def test_run_benchmark(self):
+        result = run_benchmark(messages=25, batch_size=10, concurrency=2, timeout=30)
+
+        self.assertEqual(result['published'], 25)
+        self.assertEqual(result['remaining'], 0)
+        self.assertGreater(result['throughput'], 0)
+        # Every message is published once and deleted once.
+        self.assertEqual(result['sqs_calls']['delete_message'], 25)
+        self.assertGreaterEqual(result['api_calls_per_message'], 2)
+        self.assertEqual(result['duplicates'], 0)
+
+    def test_slow_batch_is_not_redelivered(self):
+        # Each batch takes longer to publish than the visibility timeout, the heartbeat keeps the
+        # messages hidden so that none of them is published twice.
+        result = run_benchmark(messages=4, batch_size=2, concurrency=1, sns_latency=0.6,
+                               visibility_timeout=1, timeout=30)
+
+        self.assertEqual(result['published'], 4)
+        self.assertEqual(result['duplicates'], 0)
+        self.assertGreater(result['sqs_calls']['change_message_visibility_batch'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,5 +28,30 @@ class TestSns(unittest.TestCase):
         with self.assertRaises(ClientError):
             self.sns.create_topic("test_topic")
 
+    def test_publish_message_encodes_decoded_message(self):
+        mock_topic = MagicMock()
+        message = {'Body': {'Subject': 'Update Notification',
+                            'Message': {'concept-id': 'G1200484365-PROV'},
+                            'MessageAttributes': {'mode': {'Type': 'String', 'Value': 'Update'}}}}
+
+        Sns.publish_message(mock_topic, message)
+
+        mock_topic.publish.assert_called_once_with(
+            Subject='Update Notification',
+            Message='{"concept-id": "G1200484365-PROV"}',
+            MessageAttributes={'mode': {'DataType': 'String', 'StringValue': 'Update'}})
+
+    def test_publish_message_passes_through_encoded_message(self):
+        mock_topic = MagicMock()
+        message = {'Body': {'Subject': 'Update Notification',
+                            'Message': '{"concept-id":"G1200484365-PROV"}',
+                            'MessageAttributes': None}}
+
+        Sns.publish_message(mock_topic, message)
+
+        mock_topic.publish.assert_called_once_with(
+            Subject='Update Notification',
+            Message='{"concept-id":"G1200484365-PROV"}')
+
 if __name__ == '__main__':
     unittest.main()
@@ -3,7 +3,22 @@ import unittest
 from unittest.mock import patch, MagicMock
 import boto3
 from botocore.exceptions import ClientError
-from subscription_worker import (receive_message, delete_message, delete_messages, process_messages, poll_queue, app)
+from sns import Sns
+from subscription_worker import (receive_message, delete_message, delete_messages, process_messages, handle_messages, poll_queue, app,
+                                 PUBLISHED, SKIPPED, FAILED, REJECTED)
+from dedup_cache import DedupCache
+from visibility_heartbeat import VisibilityHeartbeat
+from fake_aws import FakeSqsClient
+
+def make_body(concept_id):
+    return json.dumps({
+        'Subject': 'Update Notification',
+        'Message': json.dumps({'concept-id': concept_id}),
+        'MessageAttributes': {
+            'collection-concept-id': {'Type': 'String', 'Value': 'C1200484363-PROV'},
+            'subscriber': {'Type': 'String', 'Value': 'user1_test'}
+        }
+    })
 
 class TestSubscriptionWorker(unittest.TestCase):
 
@@ -80,13 +95,166 @@ class TestSubscriptionWorker(unittest.TestCase):
             }]
         }
 
-        process_messages(mock_sns_instance, 'test-topic', messages, mock_access_control_instance)
+        outcomes = process_messages(mock_sns_instance, 'test-topic', messages, mock_access_control_instance)
+        self.assertEqual(outcomes, [PUBLISHED])
 
         # Re-enable ACL check with CMR-10855
         # Check if has_read_permission was called with correct arguments
         #mock_access_control_instance.has_read_permission.assert_called_once_with('user1_test', 'C1200484363-PROV')
         
-        mock_sns_instance.publish_message.assert_called_once_with('test-topic', messages['Messages'][0])
+        mock_sns_instance.publish_message.assert_called_once()
+        topic, published = mock_sns_instance.publish_message.call_args.args
+        self.assertEqual(topic, 'test-topic')
+        self.assertEqual(published['Body']['Message']['concept-id'], 'G1200484365-PROV')
+        # The received message is left as it was received.
+        self.assertIsInstance(messages['Messages'][0]['Body'], str)
+
+    @patch('subscription_worker.MESSAGE_PASS_THROUGH', 'true')
+    def test_process_messages_pass_through(self):
+        mock_sns_instance = MagicMock()
+        inner_message = '{"concept-id": "G1200484365-PROV", "location": "http://localhost:3003/concepts/G1200484365-PROV/39"}'
+        messages = {
+            'Messages': [{
+                'Body': json.dumps({
+                    'Type': 'Notification',
+                    'Subject': 'Update Notification',
+                    'Message': inner_message,
+                    'MessageAttributes': {
+                        'collection-concept-id': {'Type': 'String', 'Value': 'C1200484363-PROV'},
+                        'subscriber': {'Type': 'String', 'Value': 'user1_test'}
+                    }
+                })
+            }]
+        }
+
+        process_messages(mock_sns_instance, 'test-topic', messages, MagicMock())
+
+        mock_sns_instance.publish_message.assert_called_once()
+        topic, published = mock_sns_instance.publish_message.call_args.args
+        self.assertEqual(topic, 'test-topic')
+        # The inner message is passed on as the string that was received.
+        self.assertEqual(published['Body']['Message'], inner_message)
+
+    def test_process_messages_skips_duplicates(self):
+        mock_sns_instance = MagicMock()
+        message = {
+            'MessageId': 'sqs-message-id',
+            'Body': json.dumps({
+                'Subject': 'Update Notification',
+                'Message': '{"concept-id": "G1200484365-PROV"}',
+                'MessageAttributes': {
+                    'collection-concept-id': {'Type': 'String', 'Value': 'C1200484363-PROV'},
+                    'subscriber': {'Type': 'String', 'Value': 'user1_test'}
+                }
+            })
+        }
+        dedup_cache = DedupCache(max_size=10, ttl=60, file_name="")
+
+        first = process_messages(mock_sns_instance, 'test-topic', {'Messages': [dict(message)]}, MagicMock(), dedup_cache)
+        second = process_messages(mock_sns_instance, 'test-topic', {'Messages': [dict(message)]}, MagicMock(), dedup_cache)
+
+        self.assertEqual(first, [PUBLISHED])
+        self.assertEqual(second, [SKIPPED])
+
+        mock_sns_instance.publish_message.assert_called_once()
+
+    def test_process_messages_does_not_cache_failures(self):
+        mock_sns_instance = MagicMock()
+        mock_sns_instance.publish_message.side_effect = Exception("SNS error")
+        message = {
+            'MessageId': 'sqs-message-id',
+            'Body': json.dumps({
+                'Subject': 'Update Notification',
+                'Message': '{"concept-id": "G1200484365-PROV"}',
+                'MessageAttributes': {
+                    'collection-concept-id': {'Type': 'String', 'Value': 'C1200484363-PROV'},
+                    'subscriber': {'Type': 'String', 'Value': 'user1_test'}
+                }
+            })
+        }
+        dedup_cache = DedupCache(max_size=10, ttl=60, file_name="")
+
+        outcomes = process_messages(mock_sns_instance, 'test-topic', {'Messages': [message]}, MagicMock(), dedup_cache)
+
+        self.assertEqual(outcomes, [FAILED])
+        self.assertFalse(dedup_cache.seen('sqs-message-id'))
+
+    def test_handle_messages_only_deletes_handled_messages(self):
+        sqs_client = FakeSqsClient()
+        sqs_client.send_message(QueueUrl='queue-url', MessageBody=make_body('G1-PROV'))
+        sqs_client.send_message(QueueUrl='queue-url', MessageBody=make_body('G2-PROV'))
+        sqs_client.send_message(QueueUrl='queue-url', MessageBody=make_body('G3-PROV'))
+        messages = sqs_client.receive_message(QueueUrl='queue-url', MaxNumberOfMessages=10)
+        mock_sns_instance = MagicMock()
+
+        def publish_message(topic, message):
+            if message['Body']['Message']['concept-id'] == 'G2-PROV':
+                raise ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}}, 'Publish')
+        mock_sns_instance.publish_message.side_effect = publish_message
+        heartbeat = VisibilityHeartbeat(sqs_client, visibility_timeout=30, failed_visibility_timeout=0)
+
+        outcomes = handle_messages(sqs_client, 'queue-url', mock_sns_instance, 'test-topic', messages, MagicMock(), heartbeat)
+
+        self.assertEqual(outcomes, [PUBLISHED, FAILED, PUBLISHED])
+        self.assertEqual(sqs_client.calls['delete_message'], 2)
+        self.assertEqual(heartbeat.in_flight, {})
+        # The failed message is visible again right away and is the only one left.
+        retry = sqs_client.receive_message(QueueUrl='queue-url', MaxNumberOfMessages=10)
+        self.assertEqual([message['Body'] for message in retry['Messages']], [make_body('G2-PROV')])
+
+    def test_handle_messages_rejects_poison_messages(self):
+        sqs_client = FakeSqsClient()
+        sqs_client.send_message(QueueUrl='queue-url', MessageBody='not json')
+        sqs_client.send_message(QueueUrl='queue-url', MessageBody=json.dumps({'Message': '{}'}))
+        sqs_client.send_message(QueueUrl='queue-url', MessageBody=make_body('G3-PROV'))
+        messages = sqs_client.receive_message(QueueUrl='queue-url', MaxNumberOfMessages=10)
+        mock_sns_instance = MagicMock()
+        heartbeat = VisibilityHeartbeat(sqs_client, visibility_timeout=30, failed_visibility_timeout=0)
+
+        with patch('subscription_worker.SUB_DEAD_LETTER_QUEUE_URL', 'sub-dead-letter-url'):
+            outcomes = handle_messages(sqs_client, 'queue-url', mock_sns_instance, 'test-topic', messages, MagicMock(), heartbeat)
+
+        self.assertEqual(outcomes, [REJECTED, REJECTED, PUBLISHED])
+        self.assertEqual(mock_sns_instance.publish_message.call_count, 1)
+        self.assertEqual(sqs_client.calls['delete_message'], 3)
+        self.assertEqual(heartbeat.in_flight, {})
+        self.assertNotIn('Messages', sqs_client.receive_message(QueueUrl='queue-url', MaxNumberOfMessages=10))
+        moved = sqs_client.receive_message(QueueUrl='sub-dead-letter-url', MaxNumberOfMessages=10)
+        self.assertEqual([message['Body'] for message in moved['Messages']], ['not json', json.dumps({'Message': '{}'})])
+
+    def test_handle_messages_rejects_messages_without_subject(self):
+        body = json.loads(make_body('G1-PROV'))
+        del body['Subject']
+        sqs_client = FakeSqsClient()
+        sqs_client.send_message(QueueUrl='queue-url', MessageBody=json.dumps(body))
+        messages = sqs_client.receive_message(QueueUrl='queue-url', MaxNumberOfMessages=10)
+        topic = MagicMock()
+        heartbeat = VisibilityHeartbeat(sqs_client, visibility_timeout=30, failed_visibility_timeout=0)
+
+        with patch('subscription_worker.SUB_DEAD_LETTER_QUEUE_URL', 'sub-dead-letter-url'):
+            outcomes = handle_messages(sqs_client, 'queue-url', Sns(MagicMock()), topic, messages, MagicMock(), heartbeat)
+
+        # The message is decoded before publishing fails, the original string is what is moved.
+        self.assertEqual(outcomes, [REJECTED])
+        topic.publish.assert_not_called()
+        self.assertEqual(heartbeat.in_flight, {})
+        self.assertNotIn('Messages', sqs_client.receive_message(QueueUrl='queue-url', MaxNumberOfMessages=10))
+        moved = sqs_client.receive_message(QueueUrl='sub-dead-letter-url', MaxNumberOfMessages=10)
+        self.assertEqual([message['Body'] for message in moved['Messages']], [json.dumps(body)])
+
+    def test_handle_messages_releases_batch_on_error(self):
+        sqs_client = FakeSqsClient()
+        sqs_client.send_message(QueueUrl='queue-url', MessageBody=make_body('G1-PROV'))
+        messages = sqs_client.receive_message(QueueUrl='queue-url', MaxNumberOfMessages=10)
+        heartbeat = VisibilityHeartbeat(sqs_client, visibility_timeout=30, failed_visibility_timeout=0)
+
+        with patch('subscription_worker.process_messages', side_effect=Exception("unexpected")):
+            with self.assertRaises(Exception):
+                handle_messages(sqs_client, 'queue-url', MagicMock(), 'test-topic', messages, MagicMock(), heartbeat)
+
+        self.assertEqual(sqs_client.calls['delete_message'], 0)
+        self.assertEqual(heartbeat.in_flight, {})
+        self.assertIn('Messages', sqs_client.receive_message(QueueUrl='queue-url'))
 
 if __name__ == '__main__':
     unittest.main()
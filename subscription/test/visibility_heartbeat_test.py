@@ -0,0 +1,83 @@
+import unittest
+from unittest.mock import MagicMock
+from botocore.exceptions import ClientError
+from visibility_heartbeat import VisibilityHeartbeat
+
+def make_messages(count):
+    return {'Messages': [{'ReceiptHandle': f'receipt{index}'} for index in range(count)]}
+
+class TestVisibilityHeartbeat(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_sqs = MagicMock()
+        self.mock_sqs.change_message_visibility_batch.return_value = {'Successful': [], 'Failed': []}
+        self.heartbeat = VisibilityHeartbeat(self.mock_sqs, visibility_timeout=30, failed_visibility_timeout=5)
+
+    def test_interval(self):
+        self.assertEqual(self.heartbeat.interval, 10)
+
+    def test_extend_due_skips_recent_messages(self):
+        self.heartbeat.track('queue-url', make_messages(2))
+        self.heartbeat.extend_due()
+        self.mock_sqs.change_message_visibility_batch.assert_not_called()
+
+    def test_extend_due(self):
+        self.heartbeat.track('queue-url', make_messages(12))
+        self.heartbeat.interval = 0
+        self.heartbeat.extend_due()
+
+        # SQS only accepts 10 entries per call.
+        self.assertEqual(self.mock_sqs.change_message_visibility_batch.call_count, 2)
+        first_call = self.mock_sqs.change_message_visibility_batch.call_args_list[0]
+        self.assertEqual(first_call.kwargs['QueueUrl'], 'queue-url')
+        self.assertEqual(len(first_call.kwargs['Entries']), 10)
+        self.assertEqual(first_call.kwargs['Entries'][0],
+                         {'Id': '0', 'ReceiptHandle': 'receipt0', 'VisibilityTimeout': 30})
+
+    def test_extend_due_drops_failed_receipt_handles(self):
+        self.mock_sqs.change_message_visibility_batch.return_value = {
+            'Successful': [{'Id': '0'}],
+            'Failed': [{'Id': '1', 'Code': 'ReceiptHandleIsInvalid', 'SenderFault': True}]}
+        self.heartbeat.track('queue-url', make_messages(2))
+        self.heartbeat.interval = 0
+        self.heartbeat.extend_due()
+
+        self.assertEqual(list(self.heartbeat.in_flight.keys()), ['receipt0'])
+
+    def test_untrack(self):
+        messages = make_messages(2)
+        self.heartbeat.track('queue-url', messages)
+        self.heartbeat.untrack(messages)
+        self.heartbeat.interval = 0
+        self.heartbeat.extend_due()
+
+        self.assertEqual(self.heartbeat.in_flight, {})
+        self.mock_sqs.change_message_visibility_batch.assert_not_called()
+
+    def test_release(self):
+        messages = make_messages(2)
+        self.heartbeat.track('queue-url', messages)
+        self.heartbeat.release('queue-url', messages)
+
+        self.assertEqual(self.heartbeat.in_flight, {})
+        self.mock_sqs.change_message_visibility_batch.assert_called_once_with(
+            QueueUrl='queue-url',
+            Entries=[{'Id': '0', 'ReceiptHandle': 'receipt0', 'VisibilityTimeout': 5},
+                     {'Id': '1', 'ReceiptHandle': 'receipt1', 'VisibilityTimeout': 5}])
+
+    def test_change_visibility_client_error(self):
+        self.mock_sqs.change_message_visibility_batch.side_effect = ClientError(
+            {'Error': {'Code': 'TestException', 'Message': 'Test error message'}},
+            'ChangeMessageVisibilityBatch')
+
+        failed = self.heartbeat.change_visibility('queue-url', ['receipt0'], 30)
+        self.assertEqual(failed, ['receipt0'])
+
+    def test_start_stop(self):
+        self.heartbeat.start()
+        self.assertTrue(self.heartbeat.thread.is_alive())
+        self.heartbeat.stop()
+        self.assertIsNone(self.heartbeat.thread)
+
+if __name__ == '__main__':
+    unittest.main()